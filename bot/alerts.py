@@ -0,0 +1,312 @@
+import logging
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# 提醒类型
+KIND_LEVEL = 'level'
+KIND_BAND = 'band'
+
+# 价位提醒：价格升至 level 及以上（ABOVE）或降至 level 及以下（BELOW）时触发
+ABOVE = 'above'
+BELOW = 'below'
+
+# 布林带提醒：收盘价突破上轨（UPPER）或跌破下轨（LOWER）时触发
+UPPER = 'upper'
+LOWER = 'lower'
+
+# level 仅用于价位提醒，period / std 仅用于布林带提醒
+Alert = namedtuple('Alert', ['alert_id', 'user_id', 'symbol', 'kind', 'direction', 'level', 'period', 'std'])
+
+
+class _Ladder:
+    """单个合约单个方向的价位提醒，按价位升序保存在两个平行列表中"""
+
+    __slots__ = ('levels', 'ids')
+
+    def __init__(self):
+        self.levels = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.levels)
+
+    def add(self, level: float, alert_id: int):
+        # 价位相同时按编号排序，保证删除时可以二分定位
+        index = bisect_right(self.levels, level)
+        while index > 0 and self.levels[index - 1] == level and self.ids[index - 1] > alert_id:
+            index -= 1
+        self.levels.insert(index, level)
+        self.ids.insert(index, alert_id)
+
+    def remove(self, level: float, alert_id: int):
+        start = bisect_left(self.levels, level)
+        stop = bisect_right(self.levels, level, lo=start)
+        index = start + bisect_left(self.ids[start:stop], alert_id)
+        if index < stop and self.ids[index] == alert_id:
+            del self.levels[index]
+            del self.ids[index]
+
+    def pop_at_or_below(self, price: float) -> list:
+        """取出价位不高于 price 的提醒（列表前缀）"""
+        count = bisect_right(self.levels, price)
+        triggered = self.ids[:count]
+        del self.levels[:count], self.ids[:count]
+        return triggered
+
+    def pop_at_or_above(self, price: float) -> list:
+        """取出价位不低于 price 的提醒（列表后缀）"""
+        start = bisect_left(self.levels, price)
+        triggered = self.ids[start:]
+        del self.levels[start:], self.ids[start:]
+        return triggered
+
+
+class AlertBook:
+    """
+    价格提醒索引
+
+    价位提醒按合约和方向保存在有序列表中，每个新价格用二分查找直接定位被触发的提醒（O(log n + k)），
+    不需要遍历所有用户的条件；布林带提醒按 (合约, 周期, 标准差, 方向) 分组，由盘中突破事件触发。
+    提醒触发后即删除。相同用户的相同条件只保存一份。
+    """
+
+    def __init__(self):
+        self._alerts = {}
+        self._keys = {}
+        self._by_user = {}
+        self._above = {}
+        self._below = {}
+        self._bands = {}
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def get(self, alert_id: int):
+        return self._alerts.get(alert_id)
+
+    def symbols(self) -> set:
+        """有待触发提醒的合约"""
+        return {alert.symbol for alert in self._alerts.values()}
+
+    def band_params(self) -> set:
+        """布林带提醒用到的 (period, std) 组合"""
+        return {(period, std) for _, period, std, _ in self._bands}
+
+    def alerts_for(self, user_id) -> list:
+        return [self._alerts[alert_id] for alert_id in sorted(self._by_user.get(user_id, ()))]
+
+    # ========== 添加与删除 ==========
+
+    def add_level(self, user_id, symbol: str, level: float, direction: str) -> Alert:
+        """添加价位提醒；相同提醒已存在时返回已有的提醒"""
+        if direction not in (ABOVE, BELOW):
+            raise ValueError(f"未知的价位提醒方向: {direction}")
+        return self._add(Alert(None, user_id, symbol, KIND_LEVEL, direction, float(level), None, None))
+
+    def add_band(self, user_id, symbol: str, direction: str, period: int, std: float) -> Alert:
+        """添加布林带提醒；相同提醒已存在时返回已有的提醒"""
+        if direction not in (UPPER, LOWER):
+            raise ValueError(f"未知的布林带提醒方向: {direction}")
+        return self._add(Alert(None, user_id, symbol, KIND_BAND, direction, None, period, std))
+
+    def load(self, alerts):
+        """从持久化的提醒恢复索引（保留原编号）"""
+        for alert in alerts:
+            self._add(alert)
+
+    def _add(self, alert: Alert) -> Alert:
+        key = alert[1:]
+        existing = self._keys.get(key)
+        if existing is not None:
+            return self._alerts[existing]
+
+        if alert.alert_id is None:
+            alert = alert._replace(alert_id=self._next_id)
+        # 恢复的提醒保留原编号，之后的编号从其后继续
+        self._next_id = max(self._next_id, alert.alert_id + 1)
+
+        self._alerts[alert.alert_id] = alert
+        self._keys[key] = alert.alert_id
+        self._by_user.setdefault(alert.user_id, set()).add(alert.alert_id)
+        if alert.kind == KIND_LEVEL:
+            ladders = self._above if alert.direction == ABOVE else self._below
+            ladders.setdefault(alert.symbol, _Ladder()).add(alert.level, alert.alert_id)
+        else:
+            self._bands.setdefault((alert.symbol, alert.period, alert.std, alert.direction), set()).add(alert.alert_id)
+        return alert
+
+    def remove(self, alert_id: int):
+        """删除提醒，返回被删除的提醒（不存在时返回None）"""
+        alert = self._alerts.get(alert_id)
+        if alert is None:
+            return None
+
+        if alert.kind == KIND_LEVEL:
+            ladders = self._above if alert.direction == ABOVE else self._below
+            ladder = ladders[alert.symbol]
+            ladder.remove(alert.level, alert_id)
+            if not ladder:
+                del ladders[alert.symbol]
+        else:
+            group = (alert.symbol, alert.period, alert.std, alert.direction)
+            self._bands[group].discard(alert_id)
+            if not self._bands[group]:
+                del self._bands[group]
+        self._forget(alert)
+        return alert
+
+    def remove_user(self, user_id) -> int:
+        """删除用户的全部提醒，返回删除数量"""
+        alerts = list(self._by_user.get(user_id, ()))
+        for alert_id in alerts:
+            self.remove(alert_id)
+        return len(alerts)
+
+    def _forget(self, alert: Alert):
+        del self._alerts[alert.alert_id]
+        del self._keys[alert[1:]]
+        owned = self._by_user[alert.user_id]
+        owned.discard(alert.alert_id)
+        if not owned:
+            del self._by_user[alert.user_id]
+
+    # ========== 触发 ==========
+
+    def on_price(self, symbol: str, high: float, low: float = None) -> list:
+        """
+        用一根K线（或一个成交价）检查价位提醒
+
+        参数:
+        symbol (str): 合约代码
+        high (float): 最高价，不低于 ABOVE 提醒价位时触发
+        low (float, optional): 最低价，不高于 BELOW 提醒价位时触发；默认与 high 相同
+
+        返回:
+        list: 被触发（并已删除）的 Alert
+        """
+        low = high if low is None else low
+        triggered = []
+        ladder = self._above.get(symbol)
+        if ladder:
+            triggered.extend(ladder.pop_at_or_below(high))
+            if not ladder:
+                del self._above[symbol]
+        ladder = self._below.get(symbol)
+        if ladder:
+            triggered.extend(ladder.pop_at_or_above(low))
+            if not ladder:
+                del self._below[symbol]
+        return self._release(triggered)
+
+    def on_band_break(self, symbol: str, direction: str, period: int, std: float) -> list:
+        """收盘价突破上轨或跌破下轨时调用，返回被触发（并已删除）的 Alert"""
+        return self._release(self._bands.pop((symbol, period, std, direction), ()))
+
+    def _release(self, alert_ids) -> list:
+        alerts = [self._alerts[alert_id] for alert_id in alert_ids]
+        for alert in alerts:
+            self._forget(alert)
+        return alerts
+
+
+def describe(alert: Alert) -> str:
+    """提醒条件的文字描述"""
+    if alert.kind == KIND_LEVEL:
+        return f"{alert.symbol} {'≥' if alert.direction == ABOVE else '≤'} {alert.level:g}"
+    band = '突破上轨' if alert.direction == UPPER else '跌破下轨'
+    return f"{alert.symbol} {band}（{alert.period}, {alert.std}）"
+
+
+def format_alert_messages(triggered, prices: dict = None) -> list:
+    """
+    将触发的提醒合并为消息，同一用户同一合约只发一条
+
+    参数:
+    triggered: 触发的 Alert
+    prices (dict, optional): {合约: 最新价}
+
+    返回:
+    list: (user_id, text) 对
+    """
+    grouped = {}
+    for alert in triggered:
+        grouped.setdefault((alert.user_id, alert.symbol), []).append(alert)
+
+    messages = []
+    for (user_id, symbol), alerts in grouped.items():
+        price = (prices or {}).get(symbol)
+        header = f"🔔 {symbol} 价格提醒" + (f"（最新 {price:g}）" if price is not None else "")
+        lines = [header] + [f"#{alert.alert_id} {describe(alert)}" for alert in alerts]
+        messages.append((user_id, "\n".join(lines)))
+    return messages
+
+
+def _scan_levels(alerts: dict, symbol: str, high: float, low: float) -> list:
+    """逐条检查全部价位提醒（基准对照），取出被触发的提醒编号"""
+    triggered = [alert_id for alert_id, alert in alerts.items()
+                 if alert.symbol == symbol and (alert.level <= high if alert.direction == ABOVE
+                                                else alert.level >= low)]
+    for alert_id in triggered:
+        del alerts[alert_id]
+    return triggered
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description='价位提醒基准：二分索引与逐条扫描对比，并校验结果一致')
+    parser.add_argument('--alerts', type=int, default=100_000)
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--ticks', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    symbols = [f"SYM{index:02d}" for index in range(args.symbols)]
+    prices = {symbol: 1000.0 for symbol in symbols}
+    book = AlertBook()
+    started = time.perf_counter()
+    for index in range(args.alerts):
+        symbol = rng.choice(symbols)
+        direction = rng.choice((ABOVE, BELOW))
+        # 提醒价位分布在当前价两侧 1%~20%，行情随机游走时逐步触发
+        offset = prices[symbol] * rng.uniform(0.01, 0.2)
+        book.add_level(index % 5000, symbol, prices[symbol] + (offset if direction == ABOVE else -offset), direction)
+    build = time.perf_counter() - started
+    reference = dict(book._alerts)
+    print(f"{len(book)} 个提醒，{args.symbols} 个合约，建立索引 {build * 1000:.0f}ms")
+
+    ticks = []
+    for _ in range(args.ticks):
+        symbol = rng.choice(symbols)
+        price = prices[symbol] = prices[symbol] * (1 + rng.gauss(0, 0.005))
+        ticks.append((symbol, price * 1.001, price * 0.999))
+
+    # 两种方式分别完整跑一遍，避免交替运行时扫描把索引挤出 CPU 缓存
+    def run(check):
+        results, times = [], []
+        for symbol, high, low in ticks:
+            started = time.perf_counter()
+            results.append(sorted(check(symbol, high, low)))
+            times.append(time.perf_counter() - started)
+        return results, times
+
+    indexed, indexed_times = run(lambda symbol, high, low: [alert.alert_id
+                                                            for alert in book.on_price(symbol, high, low)])
+    scanned, scan_times = run(lambda symbol, high, low: _scan_levels(reference, symbol, high, low))
+    if indexed != scanned:
+        mismatch = next(i for i, (a, b) in enumerate(zip(indexed, scanned)) if a != b)
+        raise SystemExit(f"结果不一致: 第 {mismatch} 个价格 {ticks[mismatch]}")
+
+    quiet = [i for i, result in enumerate(indexed) if not result]
+    print(f"{args.ticks} 个价格，触发 {sum(map(len, indexed))} 个提醒，与逐条扫描结果一致")
+    print(f"平均每个价格：二分 {sum(indexed_times) / args.ticks * 1e6:.1f}us，"
+          f"扫描 {sum(scan_times) / args.ticks * 1e6:.0f}us")
+    if quiet:
+        print(f"未触发的价格（{len(quiet)} 个）：二分 {sum(indexed_times[i] for i in quiet) / len(quiet) * 1e6:.1f}us，"
+              f"扫描 {sum(scan_times[i] for i in quiet) / len(quiet) * 1e6:.0f}us")
@@ -0,0 +1,325 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import timedelta
+
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+# 消息优先级（数值越小越优先）
+class Priority:
+    INTERACTIVE = 0  # 对用户输入的即时回复
+    NOTIFICATION = 5  # 单个用户的通知（如价格提醒）
+    BROADCAST = 10  # 批量群发（如信号推送）
+
+
+class TokenBucket:
+    """令牌桶限流器"""
+
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距离下一个令牌可用还需等待的秒数"""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def consume(self, now: float):
+        """消耗一个令牌"""
+        self._refill(now)
+        self._tokens -= 1
+
+    def is_idle(self, now: float) -> bool:
+        """令牌桶是否已回满（可以回收）"""
+        self._refill(now)
+        return self._tokens >= self.capacity
+
+
+class _OutboundJob:
+    """待发送的出站消息"""
+
+    __slots__ = ('chat_id', 'method', 'kwargs', 'priority', 'future', 'attempts')
+
+    def __init__(self, chat_id, method, kwargs, priority, future):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+
+def _retry_seconds(retry_after) -> float:
+    """兼容 retry_after 为整数或 timedelta 的情况"""
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class OutboundDispatcher:
+    """
+    出站消息调度器
+
+    所有发往 Telegram 的消息都经由此处排队，按全局、单聊、群组三级令牌桶限流：
+    - 全局：默认每秒 30 条
+    - 单聊：默认每秒 1 条
+    - 群组：默认每分钟 20 条
+
+    队列按优先级出队，交互回复优先于批量群发；某个会话的令牌不足时，
+    该消息进入延迟队列，不会阻塞其它会话的消息。收到 RetryAfter 时
+    暂停全部发送直到限制解除，然后重新入队。
+    """
+
+    def __init__(self, bot,
+                 global_rate: float = 30,
+                 global_burst: float = 1,
+                 chat_rate: float = 1,
+                 chat_burst: float = 1,
+                 group_rate: float = 20 / 60,
+                 group_burst: float = 1,
+                 max_in_flight: int = 30,
+                 max_retries: int = 3):
+        self._bot = bot
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._chat_buckets = {}
+        self._group_buckets = {}
+        self.max_retries = max_retries
+
+        self._queue = []  # (priority, seq, job)
+        self._deferred = []  # (ready_time, priority, seq, job)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = set()
+        self._runner = None
+        self._last_prune = time.monotonic()
+
+    # ========== 生命周期 ==========
+
+    def start(self):
+        """启动调度循环"""
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止调度循环，未发送的消息以取消结束"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+        for entry in self._queue + self._deferred:
+            entry[-1].future.cancel()
+        self._queue.clear()
+        self._deferred.clear()
+
+    # ========== 发送接口 ==========
+
+    def submit(self, chat_id, method: str = 'send_message',
+               priority: int = Priority.INTERACTIVE, **kwargs) -> asyncio.Future:
+        """提交一条出站请求，返回发送结果的 Future"""
+        future = asyncio.get_running_loop().create_future()
+        job = _OutboundJob(chat_id, method, kwargs, priority, future)
+        heapq.heappush(self._queue, (priority, next(self._seq), job))
+        self._wakeup.set()
+        return future
+
+    async def send_message(self, chat_id, text: str,
+                           priority: int = Priority.INTERACTIVE, **kwargs):
+        """发送文本消息"""
+        return await self.submit(chat_id, 'send_message', priority, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo,
+                         priority: int = Priority.INTERACTIVE, **kwargs):
+        """发送图片"""
+        return await self.submit(chat_id, 'send_photo', priority, photo=photo, **kwargs)
+
+    async def broadcast(self, messages, priority: int = Priority.BROADCAST) -> dict:
+        """
+        批量发送消息
+
+        参数:
+            messages: 可迭代的 (chat_id, text) 对
+            priority: 消息优先级，默认为群发优先级
+
+        返回:
+            dict: {'sent': 成功数量, 'failed': 失败数量}
+        """
+        futures = [self.submit(chat_id, 'send_message', priority, text=text)
+                   for chat_id, text in messages]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        failed = sum(1 for result in results if isinstance(result, BaseException))
+        if failed:
+            logger.warning(f"群发完成，{failed}/{len(results)} 条消息发送失败")
+        return {'sent': len(results) - failed, 'failed': failed}
+
+    def pending_count(self) -> int:
+        """排队中（含延迟）的消息数量"""
+        return len(self._queue) + len(self._deferred)
+
+    # ========== 调度循环 ==========
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._release_deferred(now)
+
+            if not self._queue:
+                timeout = self._deferred[0][0] - now if self._deferred else None
+                await self._wait_for_work(timeout)
+                continue
+
+            # 全局暂停（RetryAfter）或全局令牌不足时整体等待
+            wait = max(self._paused_until - now, self._global.wait_time(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            priority, seq, job = heapq.heappop(self._queue)
+            if job.future.done():
+                continue
+
+            chat_wait = self._chat_wait_time(job.chat_id, now)
+            if chat_wait > 0:
+                heapq.heappush(self._deferred, (now + chat_wait, priority, seq, job))
+                continue
+
+            self._consume(job.chat_id, now)
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+            if now - self._last_prune > 60:
+                self._prune_buckets(now)
+
+    async def _wait_for_work(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _release_deferred(self, now: float):
+        """将已到发送时间的延迟消息放回主队列"""
+        while self._deferred and self._deferred[0][0] <= now:
+            _, priority, seq, job = heapq.heappop(self._deferred)
+            heapq.heappush(self._queue, (priority, seq, job))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _group_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._group_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._group_rate, self._group_burst)
+            self._group_buckets[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def _is_group(chat_id) -> bool:
+        # 群组和频道的 chat_id 为负数
+        return isinstance(chat_id, int) and chat_id < 0
+
+    def _chat_wait_time(self, chat_id, now: float) -> float:
+        wait = self._chat_bucket(chat_id).wait_time(now)
+        if self._is_group(chat_id):
+            wait = max(wait, self._group_bucket(chat_id).wait_time(now))
+        return wait
+
+    def _consume(self, chat_id, now: float):
+        self._global.consume(now)
+        self._chat_bucket(chat_id).consume(now)
+        if self._is_group(chat_id):
+            self._group_bucket(chat_id).consume(now)
+
+    def _prune_buckets(self, now: float):
+        """回收已回满的单聊/群组令牌桶，避免长期运行时无限增长"""
+        for buckets in (self._chat_buckets, self._group_buckets):
+            for chat_id in [cid for cid, bucket in buckets.items() if bucket.is_idle(now)]:
+                del buckets[chat_id]
+        self._last_prune = now
+
+    def _requeue(self, job: _OutboundJob, delay: float):
+        ready_time = time.monotonic() + delay
+        heapq.heappush(self._deferred, (ready_time, job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    async def _send(self, job: _OutboundJob):
+        try:
+            method = getattr(self._bot, job.method)
+            result = await method(chat_id=job.chat_id, **job.kwargs)
+        except RetryAfter as flood_error:
+            delay = _retry_seconds(flood_error.retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            logger.warning(f"触发 Telegram 限流，暂停发送 {delay:.0f} 秒")
+            self._retry_or_fail(job, flood_error, delay)
+        except TimedOut as timeout_error:
+            # 超时的请求可能已送达，不重试以免重复推送
+            if not job.future.done():
+                job.future.set_exception(timeout_error)
+        except NetworkError as network_error:
+            self._retry_or_fail(job, network_error, 2 ** job.attempts)
+        except Exception as send_error:
+            if not job.future.done():
+                job.future.set_exception(send_error)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _retry_or_fail(self, job: _OutboundJob, error: Exception, delay: float):
+        job.attempts += 1
+        if job.future.done():
+            return
+        if job.attempts > self.max_retries:
+            logger.error(f"发送到 {job.chat_id} 的消息重试 {self.max_retries} 次后仍失败: {error}")
+            job.future.set_exception(error)
+        else:
+            self._requeue(job, delay)
+
+
+def create_dispatcher(bot, senders: int = 1) -> OutboundDispatcher:
+    """
+    按环境变量创建出站调度器
+
+    OUTBOUND_GLOBAL_RATE / OUTBOUND_CHAT_RATE 覆盖全局与单聊的每秒发送上限（默认为 Telegram 的限制，
+    压测时可调高以测量 Bot 自身的处理能力）。
+
+    参数:
+        senders: 共用同一个 Bot 发送消息的进程数，全局速率在它们之间平分
+                 （分片运行时为工作进程数 + 1：主进程也发送定时推送与提醒）
+    """
+    global_rate = float(os.getenv('OUTBOUND_GLOBAL_RATE') or 30)
+    chat_rate = float(os.getenv('OUTBOUND_CHAT_RATE') or 1)
+    return OutboundDispatcher(bot, global_rate=global_rate / senders, chat_rate=chat_rate)
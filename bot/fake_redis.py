@@ -0,0 +1,293 @@
+"""
+本地模拟的 Redis 服务器（RESP2），用于开发与联调 RedisSessionStore，不需要安装 Redis
+
+支持会话存储用到的命令：PING、SELECT、AUTH、GET、SET、DEL、EXISTS、INCR、INCRBY、SADD、SREM、SMEMBERS、
+ZADD、ZREM、ZRANGEBYSCORE、WATCH、UNWATCH、MULTI、EXEC、DISCARD、FLUSHDB、DBSIZE。用法：
+
+    python -m bot.fake_redis --port 6399
+
+然后设置 SESSION_STORE_URL=redis://127.0.0.1:6399/0（以及 SESSION_SECRET_KEY）。
+"""
+import logging
+import socket
+import socketserver
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 事务中不排队、立即执行的命令
+_IMMEDIATE = {'EXEC', 'DISCARD', 'MULTI', 'WATCH'}
+
+
+class _Reply:
+    """RESP 响应编码"""
+
+    @staticmethod
+    def encode(value) -> bytes:
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, _Status):
+            return b'+%s\r\n' % value.text.encode()
+        if isinstance(value, _Failure):
+            return b'-%s\r\n' % value.text.encode()
+        if isinstance(value, bool):
+            return b':%d\r\n' % int(value)
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, (list, tuple, set)):
+            return b'*%d\r\n' % len(value) + b''.join(_Reply.encode(item) for item in value)
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class _Status:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Failure:
+    def __init__(self, text):
+        self.text = text
+
+
+OK = _Status('OK')
+QUEUED = _Status('QUEUED')
+
+
+class FakeRedisServer:
+    """
+    模拟服务器：所有数据保存在内存中，每个键维护修改计数用于 WATCH
+
+    参数:
+        port: 监听端口，0 表示自动分配
+        password: 设置后要求客户端先 AUTH
+    """
+
+    def __init__(self, port: int = 0, password: str = None):
+        self.password = password
+        self.commands = 0
+        self._dbs = {}
+        self._revisions = {}
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name='fake-redis')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ========== 数据操作（调用方持有 _lock）==========
+
+    def _db(self, index: int) -> dict:
+        return self._dbs.setdefault(index, {})
+
+    def _touch(self, index: int, key: bytes):
+        self._revisions[(index, key)] = self._revisions.get((index, key), 0) + 1
+
+    def _run(self, client, name: str, args: list):
+        db = self._db(client.db)
+        if name == 'PING':
+            return _Status('PONG')
+        if name == 'SELECT':
+            client.db = int(args[0])
+            return OK
+        if name == 'GET':
+            value = db.get(args[0])
+            return value if value is None or isinstance(value, bytes) else _Failure('WRONGTYPE')
+        if name == 'SET':
+            db[args[0]] = args[1]
+            self._touch(client.db, args[0])
+            return OK
+        if name == 'DEL':
+            removed = 0
+            for key in args:
+                if db.pop(key, None) is not None:
+                    self._touch(client.db, key)
+                    removed += 1
+            return removed
+        if name == 'EXISTS':
+            return sum(key in db for key in args)
+        if name in ('INCR', 'INCRBY'):
+            value = int(db.get(args[0], b'0')) + (int(args[1]) if name == 'INCRBY' else 1)
+            db[args[0]] = str(value).encode()
+            self._touch(client.db, args[0])
+            return value
+        if name == 'SADD':
+            members = db.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            self._touch(client.db, args[0])
+            return added
+        if name == 'SREM':
+            members = db.get(args[0], set())
+            removed = len(members & set(args[1:]))
+            members.difference_update(args[1:])
+            if not members:
+                db.pop(args[0], None)
+            self._touch(client.db, args[0])
+            return removed
+        if name == 'SMEMBERS':
+            return sorted(db.get(args[0], set()))
+        if name == 'ZADD':
+            scores = db.setdefault(args[0], {})
+            pairs = list(zip(args[1::2], args[2::2]))
+            added = sum(member not in scores for _, member in pairs)
+            scores.update((member, float(score)) for score, member in pairs)
+            self._touch(client.db, args[0])
+            return added
+        if name == 'ZREM':
+            scores = db.get(args[0], {})
+            removed = sum(scores.pop(member, None) is not None for member in args[1:])
+            if not scores:
+                db.pop(args[0], None)
+            self._touch(client.db, args[0])
+            return removed
+        if name == 'ZRANGEBYSCORE':
+            low, high = _score_bound(args[1]), _score_bound(args[2])
+            members = sorted((score, member) for member, score in db.get(args[0], {}).items()
+                             if low(score, 'min') and high(score, 'max'))
+            if len(args) > 3 and args[3].upper() == b'WITHSCORES':
+                return [item for score, member in members for item in (member, _format_score(score))]
+            return [member for _, member in members]
+        if name == 'FLUSHDB':
+            for key in list(db):
+                self._touch(client.db, key)
+            db.clear()
+            return OK
+        if name == 'DBSIZE':
+            return len(db)
+        return _Failure(f"ERR unknown command '{name}'")
+
+    def execute(self, client, name: str, args: list):
+        """执行一条命令（事务状态保存在 client 上）"""
+        with self._lock:
+            self.commands += 1
+            if self.password and not client.authenticated and name != 'AUTH':
+                return _Failure('NOAUTH Authentication required.')
+            if name == 'AUTH':
+                client.authenticated = args[-1].decode() == self.password
+                return OK if client.authenticated else _Failure('WRONGPASS invalid password')
+
+            if client.queue is not None and name not in _IMMEDIATE:
+                client.queue.append((name, args))
+                return QUEUED
+            if name == 'WATCH':
+                for key in args:
+                    client.watched[(client.db, key)] = self._revisions.get((client.db, key), 0)
+                return OK
+            if name == 'UNWATCH':
+                client.watched.clear()
+                return OK
+            if name == 'MULTI':
+                client.queue = []
+                return OK
+            if name == 'DISCARD':
+                client.queue = None
+                client.watched.clear()
+                return OK
+            if name == 'EXEC':
+                if client.queue is None:
+                    return _Failure('ERR EXEC without MULTI')
+                queued, client.queue = client.queue, None
+                dirty = any(self._revisions.get(key, 0) != revision for key, revision in client.watched.items())
+                client.watched.clear()
+                if dirty:
+                    return _NullArray()
+                return [self._run(client, queued_name, queued_args) for queued_name, queued_args in queued]
+            return self._run(client, name, args)
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.db = 0
+                self.queue = None
+                self.watched = {}
+                self.authenticated = False
+
+            def handle(self):
+                while True:
+                    try:
+                        command = _read_command(self.rfile)
+                    except (ConnectionError, ValueError):
+                        return
+                    if command is None:
+                        return
+                    reply = server.execute(self, command[0].decode().upper(), command[1:])
+                    self.wfile.write(b'*-1\r\n' if isinstance(reply, _NullArray) else _Reply.encode(reply))
+
+        return Handler
+
+
+class _NullArray:
+    """事务因 WATCH 的键被修改而取消"""
+    pass
+
+
+def _format_score(score: float) -> bytes:
+    return b'%d' % score if score.is_integer() else repr(score).encode()
+
+
+def _score_bound(raw: bytes):
+    """ZRANGEBYSCORE 的区间端点（支持 -inf / +inf 与 ( 开区间），返回判断函数"""
+    exclusive = raw.startswith(b'(')
+    value = float(raw[1:] if exclusive else raw)
+
+    def check(score: float, side: str) -> bool:
+        if side == 'min':
+            return score > value if exclusive else score >= value
+        return score < value if exclusive else score <= value
+    return check
+
+
+def _read_command(stream):
+    """读取一条 RESP 数组命令，连接关闭时返回None"""
+    line = stream.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        # 内联命令（如 telnet 输入）
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = stream.readline()
+        length = int(header[1:-2])
+        args.append(stream.read(length + 2)[:-2])
+    return args
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地模拟 Redis 服务器')
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeRedisServer(port=args.port)
+    print(f"模拟 Redis 已启动: {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
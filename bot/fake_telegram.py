@@ -0,0 +1,239 @@
+"""
+本地模拟的 Telegram Bot API 服务器，用于压测与联调（不连接真实 Telegram）
+
+提供 Bot 运行需要的方法：getMe、deleteWebhook、getUpdates（长轮询）、sendMessage / sendPhoto，其余方法一律返回成功。
+测试代码通过 send_text 模拟用户发消息，通过 exchange 发消息并等待 Bot 的回复。用法：
+
+    python -m bot.fake_telegram --port 8081
+
+然后设置 TELEGRAM_API_URL=http://127.0.0.1:8081，用任意 TELEGRAM_BOT_TOKEN 启动 Bot。
+
+服务器基于 asyncio 实现（HTTP/1.1 长连接），与压测客户端运行在同一个事件循环中，
+数千个模拟用户不需要数千个线程。
+"""
+import asyncio
+import email
+import json
+import logging
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 100000001, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'loadtest_bot'}
+
+# getUpdates 单次最多返回的更新数（与官方一致）
+MAX_UPDATES = 100
+
+
+class FakeBotApiServer:
+    """
+    模拟服务器：更新保存在内存队列中，Bot 发出的消息按会话投递给等待回复的测试代码
+
+    参数:
+        port: 监听端口，0 表示自动分配
+    """
+
+    def __init__(self, port: int = 0):
+        self.port = port
+        self.requests = Counter()
+        self.sent = 0
+        self._server = None
+        self._updates = deque()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._arrived = asyncio.Event()
+        self._replies = {}
+        self._writers = set()
+        self._closing = False
+        self.polling = asyncio.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        # 唤醒挂起的长轮询并断开连接，让连接处理协程正常结束
+        self._closing = True
+        self._arrived.set()
+        for writer in list(self._writers):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # ========== 模拟用户 ==========
+
+    def send_text(self, user_id: int, text: str) -> int:
+        """模拟用户发送一条私聊消息，返回更新编号"""
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+        message = {
+            'message_id': self._take_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        self._updates.append({'update_id': update_id, 'message': message})
+        self._arrived.set()
+        return update_id
+
+    async def exchange(self, user_id: int, text: str, timeout: float = 30.0):
+        """
+        发送消息并等待 Bot 的下一条回复
+
+        返回:
+            tuple: (回复耗时（秒）, 回复文本)
+
+        异常:
+            asyncio.TimeoutError: 超时未收到回复
+        """
+        replies = self._replies.setdefault(user_id, asyncio.Queue())
+        started = time.perf_counter()
+        self.send_text(user_id, text)
+        reply = await asyncio.wait_for(replies.get(), timeout)
+        return time.perf_counter() - started, reply
+
+    def forget(self, user_id: int):
+        """用户测试结束后释放回复队列"""
+        self._replies.pop(user_id, None)
+
+    # ========== Bot API 方法 ==========
+
+    def _take_message_id(self) -> int:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        limit = min(int(params.get('limit') or MAX_UPDATES), MAX_UPDATES)
+        timeout = float(params.get('timeout') or 0)
+        self.polling.set()
+
+        # offset 之前的更新视为已确认
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0 and not self._closing:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [self._updates[index] for index in range(min(limit, len(self._updates)))]
+
+    def _send_message(self, params: dict):
+        chat_id = int(params['chat_id'])
+        text = params.get('text', '')
+        self.sent += 1
+        replies = self._replies.get(chat_id)
+        if replies is not None:
+            replies.put_nowait(text)
+        return {
+            'message_id': self._take_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': text,
+        }
+
+    async def _call(self, method: str, params: dict):
+        self.requests[method] += 1
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'sendMessage':
+            return self._send_message(params)
+        if method in ('sendPhoto', 'sendDocument'):
+            return dict(self._send_message(params), text=None)
+        if method == 'getMe':
+            return BOT_USER
+        return True
+
+    # ========== HTTP ==========
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while not self._closing:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                path = request_line.split()[1]
+                method = path.rstrip('/').rsplit('/', 1)[-1]
+                try:
+                    result = await self._call(method, _parse_params(headers.get('content-type', ''), body))
+                    status, payload = b'200 OK', {'ok': True, 'result': result}
+                except (KeyError, ValueError) as e:
+                    status, payload = b'400 Bad Request', {'ok': False, 'error_code': 400,
+                                                          'description': f'Bad Request: {e}'}
+
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                writer.write(b'HTTP/1.1 %s\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (status, len(data), data))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    """解析请求参数：python-telegram-bot 以表单提交（非字符串的值为 JSON），也兼容 JSON 请求体"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        # 发送文件（图片）的请求只取文本字段
+        message = email.message_from_bytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+        return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode(errors='replace')
+                for part in message.get_payload() if part.get_filename() is None}
+    return dict(parse_qsl(body.decode(), keep_blank_values=True))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地模拟 Telegram Bot API 服务器')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def _serve_forever():
+        fake = await FakeBotApiServer(port=args.port).start()
+        print(f"模拟 Bot API 已启动: {fake.url}")
+        await fake._server.serve_forever()
+
+    try:
+        asyncio.run(_serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -1,18 +1,35 @@
+import functools
 import logging
 from datetime import datetime, timedelta
 import re
 import asyncio
+import math
 import os
+import random
 from dotenv import load_dotenv
 
+from bot.alerts import ABOVE, BELOW, KIND_BAND, KIND_LEVEL, LOWER, UPPER, Alert, AlertBook, describe
+from bot.dispatcher import Priority
+from bot.logging_setup import log_context
+from bot.session_store import VersionConflict, create_session_store
+from bot.processor import compute_user_signals, format_signal_message, get_chart_service
+
 
 # 加载环境变量
 load_dotenv()
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 会话更新遇到版本冲突时的最大尝试次数（每次冲突后随机等待，避免多个进程同步重试）
+MAX_UPDATE_ATTEMPTS = 10
+UPDATE_RETRY_DELAY = 0.005
+MAX_RETRY_DELAY = 0.2
+
+
+class NoLastPrice(Exception):
+    """合约暂无最新价，无法推断价位提醒的方向"""
+    pass
+
 
 # 用户状态枚举
 class UserState:
@@ -40,87 +57,139 @@ class UserSession:
         self.use_custom_cfmmc = None
         self.cfmmc_username = None
         self.cfmmc_password = None
+        self.alerts = {}  # 价格提醒 {alert_id: Alert}
         self.created_at = datetime.now()
+        self.last_activity = self.created_at
 
 
 class UserDataManager:
-    """用户数据管理器 - 封装所有数据存储和访问"""
-
-    def __init__(self):
-        self._sessions = {}  # 私有存储
-        self._last_activity = {}
+    """
+    用户数据管理器 - 封装所有数据存储和访问（会话保存在 SessionStore 中，可在多个进程间共享）
+
+    访问会话的方法均为协程：共享存储（Redis）的读写是阻塞的网络 I/O，在线程中执行，不阻塞事件循环；
+    内存存储直接调用。价格提醒索引只在本进程内存中，相关的查询与触发方法是普通函数。
+    创建时不访问存储（导入本模块不连接 Redis），提醒索引在首次 sync_alerts 时加载。
+    """
+
+    def __init__(self, store=None):
+        self._store = store if store is not None else create_session_store()
+        self._alert_book = AlertBook()  # 所有会话中价格提醒的索引
+        self._alert_revision = None  # 索引已同步到的提醒版本号，None 表示尚未加载
+        self._last_prices = {}
+
+    async def _call(self, func, *args):
+        """执行存储操作：共享存储在线程中执行"""
+        if self._store.shared:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _update(self, user_id, change, alerts_changed=False):
+        """
+        读取-修改-写入会话，版本冲突（会话被其他进程修改）时重新读取后重试
+
+        参数:
+            change: 接收会话并就地修改的函数，其返回值作为本方法的返回值
+            alerts_changed: change 会修改价格提醒（存储记录提醒变更，供其他进程增量同步索引）
+
+        返回:
+            change 的返回值；会话不存在时返回None
+
+        异常:
+            VersionConflict: 重试 MAX_UPDATE_ATTEMPTS 次后仍然冲突
+        """
+        for attempt in range(MAX_UPDATE_ATTEMPTS):
+            session, version = await self._call(self._store.load, user_id)
+            if session is None:
+                return None
+            result = change(session)
+            try:
+                await self._call(self._store.save, session, version, alerts_changed)
+                return result
+            except VersionConflict:
+                await asyncio.sleep(_retry_delay(attempt))
+        raise VersionConflict(f"用户 {user_id} 的会话更新冲突次数过多")
+
+    async def _set(self, user_id, **fields):
+        def change(session):
+            for name, value in fields.items():
+                setattr(session, name, value)
+        await self._update(user_id, change)
 
     # ========== 会话管理方法 ==========
 
-    def create_session(self, user_id):
+    async def create_session(self, user_id):
         """创建新会话"""
-        self._sessions[user_id] = UserSession(user_id)
-        self._last_activity[user_id] = datetime.now()
-        return self._sessions[user_id]
-
-    def get_session(self, user_id):
-        """获取会话（内部使用）"""
-        return self._sessions.get(user_id)
-
-    def has_session(self, user_id):
+        for attempt in range(MAX_UPDATE_ATTEMPTS):
+            previous, version = await self._call(self._store.load, user_id)
+            session = UserSession(user_id)
+            if previous:
+                session.alerts = previous.alerts  # 重新设置不影响已有的价格提醒
+            try:
+                await self._call(self._store.save, session, version)
+                return session
+            except VersionConflict:
+                await asyncio.sleep(_retry_delay(attempt))
+        raise VersionConflict(f"用户 {user_id} 的会话更新冲突次数过多")
+
+    async def get_session(self, user_id):
+        """获取会话（内部使用，返回副本，修改请使用 update_* 方法）"""
+        return (await self._call(self._store.load, user_id))[0]
+
+    async def has_session(self, user_id):
         """检查用户是否有会话"""
-        return user_id in self._sessions
+        return await self.get_session(user_id) is not None
 
-    def delete_session(self, user_id):
+    async def delete_session(self, user_id):
         """删除会话"""
-        self._sessions.pop(user_id, None)
-        self._last_activity.pop(user_id, None)
+        self._alert_book.remove_user(user_id)
+        await self._call(self._store.delete, user_id)
 
-    def update_activity(self, user_id):
+    async def update_activity(self, user_id):
         """更新活动时间"""
-        self._last_activity[user_id] = datetime.now()
+        await self._set(user_id, last_activity=datetime.now())
 
     # ========== 状态更新方法 ==========
 
-    def update_state(self, user_id, new_state):
+    async def update_state(self, user_id, new_state):
         """更新会话状态"""
-        if user_id in self._sessions:
-            self._sessions[user_id].state = new_state
+        await self._set(user_id, state=new_state)
 
-    def update_net_asset(self, user_id, net_asset):
+    async def update_net_asset(self, user_id, net_asset):
         """更新净资产"""
-        if user_id in self._sessions:
-            self._sessions[user_id].net_asset = net_asset
+        await self._set(user_id, net_asset=net_asset)
 
-    def update_signal_date(self, user_id, signal_date):
+    async def update_signal_date(self, user_id, signal_date):
         """更新信号日期"""
-        if user_id in self._sessions:
-            self._sessions[user_id].signal_date = signal_date
+        await self._set(user_id, signal_date=signal_date)
 
-    def update_bollinger_choice(self, user_id, use_custom):
+    async def update_bollinger_choice(self, user_id, use_custom):
         """更新布林带选择"""
-        if user_id in self._sessions:
-            self._sessions[user_id].use_custom_bollinger = use_custom
+        await self._set(user_id, use_custom_bollinger=use_custom)
 
-    def update_bollinger_period(self, user_id, period):
+    async def update_bollinger_period(self, user_id, period):
         """更新布林带周期"""
-        if user_id in self._sessions:
-            self._sessions[user_id].bollinger_period = period
+        await self._set(user_id, bollinger_period=period)
 
-    def update_cfmmc_choice(self, user_id, use_custom):
+    async def update_cfmmc_choice(self, user_id, use_custom):
         """更新CFMMC选择"""
-        if user_id in self._sessions:
-            self._sessions[user_id].use_custom_cfmmc = use_custom
+        await self._set(user_id, use_custom_cfmmc=use_custom)
+
+    async def update_cfmmc_username(self, user_id, username):
+        """临时保存CFMMC用户名（等待密码输入）"""
+        await self._set(user_id, cfmmc_username=username)
 
-    def update_cfmmc_credentials(self, user_id, username, password):
+    async def update_cfmmc_credentials(self, user_id, username, password):
         """更新CFMMC凭据"""
-        if user_id in self._sessions:
-            self._sessions[user_id].cfmmc_username = username
-            self._sessions[user_id].cfmmc_password = password
+        await self._set(user_id, cfmmc_username=username, cfmmc_password=password)
 
     # ========== 数据获取方法（对外接口）==========
 
-    def get_complete_data(self, user_id):
+    async def get_complete_data(self, user_id):
         """获取完整用户数据"""
-        if not self.is_setup_complete(user_id):
+        session = await self.get_session(user_id)
+        if not session or session.state != UserState.COMPLETED:
             return None
 
-        session = self._sessions[user_id]
         return {
             'net_asset': session.net_asset,
             'signal_date': session.signal_date,
@@ -132,94 +201,297 @@ class UserDataManager:
             'cfmmc_password': session.cfmmc_password
         }
 
-    def get_user_state(self, user_id):
+    async def get_user_state(self, user_id):
         """获取用户当前状态"""
-        session = self._sessions.get(user_id)
+        session = await self.get_session(user_id)
         return session.state if session else None
 
-    def is_setup_complete(self, user_id):
+    async def is_setup_complete(self, user_id):
         """检查用户是否完成设置"""
-        session = self._sessions.get(user_id)
+        session = await self.get_session(user_id)
         return session and session.state == UserState.COMPLETED
 
-    def get_bollinger_params(self, user_id):
+    async def get_bollinger_params(self, user_id):
         """获取布林带参数 (period, std)"""
-        session = self._sessions.get(user_id)
+        session = await self.get_session(user_id)
         if session and session.state == UserState.COMPLETED:
             return session.bollinger_period, session.bollinger_std
         return 19, 2  # 默认值
 
-    def get_cfmmc_credentials(self, user_id):
+    async def get_cfmmc_credentials(self, user_id):
         """获取CFMMC凭据"""
-        session = self._sessions.get(user_id)
-        if (session and
-                session.state == UserState.COMPLETED and
-                session.use_custom_cfmmc):
-            return {
-                'username': session.cfmmc_username,
-                'password': session.cfmmc_password
-            }
-        return {
-            'username': os.getenv('CFMMC_USER_NAME'),
-            'password': os.getenv('CFMMC_PASSWORD')
-        }
+        return cfmmc_credentials(await self.get_session(user_id))
 
-    def get_net_asset(self, user_id):
+    async def get_net_asset(self, user_id):
         """获取净资产"""
-        session = self._sessions.get(user_id)
+        session = await self.get_session(user_id)
         if session and session.state == UserState.COMPLETED:
             return session.net_asset
         return None
 
-    def get_signal_date(self, user_id):
+    async def get_signal_date(self, user_id):
         """获取信号日期"""
-        session = self._sessions.get(user_id)
+        session = await self.get_session(user_id)
         if session and session.state == UserState.COMPLETED:
             return session.signal_date
         return None
 
+    # ========== 价格提醒 ==========
+
+    async def add_level_alert(self, user_id, symbol, level, direction=None):
+        """
+        添加价位提醒
+
+        参数:
+            direction: ABOVE 或 BELOW；为None时按合约最新价推断（价位高于最新价为 ABOVE）
+
+        最新价先取本进程的分钟线价格（只有运行提醒轮询的主进程有），没有时取本地行情存储中最近一根
+        日线的收盘价（分片运行时的工作进程、或还没有提醒的合约）。
+
+        返回:
+            Alert: 新建（或已存在的相同）提醒；无会话时返回None
+
+        异常:
+            NoLastPrice: 未指定方向且合约没有最新价
+        """
+        if direction is None:
+            last_price = self._last_prices.get(symbol)
+            if last_price is None:
+                last_price = await asyncio.to_thread(_stored_close, symbol)
+            if last_price is None:
+                raise NoLastPrice(symbol)
+            direction = ABOVE if level > last_price else BELOW
+        return await self._add_alert(Alert(None, user_id, symbol, KIND_LEVEL, direction, float(level), None, None))
+
+    async def add_band_alert(self, user_id, symbol, direction):
+        """添加布林带提醒（使用用户的布林带参数），无会话时返回None"""
+        period, std = await self.get_bollinger_params(user_id)
+        return await self._add_alert(Alert(None, user_id, symbol, KIND_BAND, direction, None, period, std))
+
+    async def _add_alert(self, alert):
+        # 编号在读取-修改-写入之外分配，冲突重试时不重复占用编号
+        alert_id = await self._call(self._store.next_id, 'alert')
+
+        def change(session):
+            for existing in session.alerts.values():
+                if existing[1:] == alert[1:]:
+                    return existing
+            created = alert._replace(alert_id=alert_id)
+            session.alerts[created.alert_id] = created
+            return created
+
+        saved = await self._update(alert.user_id, change, alerts_changed=True)
+        if saved is not None:
+            self._alert_book.load([saved])
+        return saved
+
+    async def remove_alert(self, user_id, alert_id):
+        """删除用户自己的提醒，返回是否删除成功"""
+        removed = await self._update(user_id, lambda session: session.alerts.pop(alert_id, None) is not None,
+                                     alerts_changed=True)
+        if removed:
+            self._alert_book.remove(alert_id)
+        return bool(removed)
+
+    async def clear_alerts(self, user_id):
+        """删除用户的全部提醒，返回删除数量"""
+        def change(session):
+            count = len(session.alerts)
+            session.alerts.clear()
+            return count
+
+        count = await self._update(user_id, change, alerts_changed=True) or 0
+        self._alert_book.remove_user(user_id)
+        return count
+
+    async def get_alerts(self, user_id):
+        """获取用户的提醒列表（按编号排序）"""
+        session = await self.get_session(user_id)
+        return sorted(session.alerts.values()) if session else []
+
+    async def sync_alerts(self, force=False):
+        """
+        同步提醒索引（读取存储在线程中执行，索引只在事件循环线程中修改）
+
+        首次调用（或 force）时从全部会话加载；之后会话只在本进程中修改时索引始终是最新的，不需要同步。
+        共享存储（多个工作进程）时提醒可能由其他进程修改，检查提醒前调用：按提醒版本号只重新加载
+        有变更的用户，没有变更时只读取一个版本号。
+        """
+        if self._alert_revision is not None and not force and not self._store.shared:
+            return
+        since = None if force else self._alert_revision
+        revision, book, changed = await self._call(self._read_alert_changes, since)
+        if book is not None:
+            self._alert_book = book
+        for user_id, alerts in changed.items():
+            self._alert_book.remove_user(user_id)
+            self._alert_book.load(alerts)
+        self._alert_revision = revision
+
+    def _read_alert_changes(self, since):
+        """
+        读取提醒版本号 since 之后的变更
+
+        返回:
+            tuple: (提醒版本号, 重建的 AlertBook 或 None, {用户ID: 该用户当前的提醒列表})
+        """
+        revision, user_ids = self._store.alert_changes(since)
+        if user_ids is None:
+            book = AlertBook()
+            for session in self._store.sessions():
+                book.load(session.alerts.values())
+            return revision, book, {}
+
+        changed = {}
+        for user_id in user_ids:
+            session = self._store.load(user_id)[0]
+            changed[user_id] = list(session.alerts.values()) if session else []
+        return revision, None, changed
+
+    def get_alert_symbols(self):
+        """有待触发提醒的合约"""
+        return self._alert_book.symbols()
+
+    def get_alert_band_params(self):
+        """布林带提醒用到的 (period, std) 组合"""
+        return self._alert_book.band_params()
+
+    def update_last_price(self, symbol, price):
+        """记录合约最新价（用于推断价位提醒方向）"""
+        self._last_prices[symbol] = price
+
+    def trigger_price_alerts(self, symbol, high, low, close):
+        """用一根K线检查价位提醒，返回被触发的提醒（已从索引删除，随后用 forget_triggered 从会话中删除）"""
+        self.update_last_price(symbol, close)
+        return self._alert_book.on_price(symbol, high, low)
+
+    def trigger_band_alerts(self, symbol, direction, period, std):
+        """布林带突破时调用，返回被触发的提醒（已从索引删除，随后用 forget_triggered 从会话中删除）"""
+        return self._alert_book.on_band_break(symbol, direction, period, std)
+
+    async def forget_triggered(self, alerts):
+        """从会话中删除已触发的提醒；个别会话更新冲突时记录日志，不影响其余提醒"""
+        for alert in alerts:
+            try:
+                await self._update(alert.user_id,
+                                   lambda session, alert_id=alert.alert_id: session.alerts.pop(alert_id, None),
+                                   alerts_changed=True)
+            except VersionConflict as e:
+                logger.warning(f"删除已触发的提醒 #{alert.alert_id} 失败: {e}", extra={'user_id': alert.user_id})
+
     # ========== 清理和维护方法 ==========
 
-    def cleanup_inactive_sessions(self, inactive_hours=2, completed_hours=24):
+    async def cleanup_inactive_sessions(self, inactive_hours=2, completed_hours=24):
         """清理不活跃会话，返回清理的数量"""
         now = datetime.now()
         to_remove = []
 
-        for user_id, last_time in list(self._last_activity.items()):
-            if user_id not in self._sessions:
-                to_remove.append(user_id)
-                continue
-
-            session = self._sessions[user_id]
-
+        for session in await self._call(lambda: list(self._store.sessions())):
             # 根据状态使用不同的超时时间
             if session.state == UserState.COMPLETED:
                 timeout = timedelta(hours=completed_hours)
             else:
                 timeout = timedelta(hours=inactive_hours)
 
-            if now - last_time > timeout:
-                to_remove.append(user_id)
+            if now - session.last_activity > timeout:
+                to_remove.append(session.user_id)
 
         # 执行清理
         for user_id in to_remove:
-            self.delete_session(user_id)
+            await self.delete_session(user_id)
 
         return len(to_remove)
 
-    def get_active_users_count(self):
+    async def get_active_users_count(self):
         """获取活跃用户数量"""
-        return len(self._sessions)
+        return len(await self._call(self._store.user_ids))
 
-    def get_all_user_ids(self):
+    async def get_all_user_ids(self):
         """获取所有用户ID"""
-        return list(self._sessions.keys())
+        return await self._call(self._store.user_ids)
+
+    async def get_completed_sessions(self):
+        """获取所有已完成设置的会话（一次读取，供定时任务批量使用）"""
+        sessions = await self._call(lambda: list(self._store.sessions()))
+        return [session for session in sessions if session.state == UserState.COMPLETED]
+
+    async def get_completed_user_ids(self):
+        """获取已完成设置的用户ID"""
+        return [session.user_id for session in await self.get_completed_sessions()]
+
+
+def _stored_close(symbol):
+    """本地行情存储中合约最近一根日线的收盘价，没有时返回None"""
+    from trading.bar_store import bar_store
+
+    close = bar_store.history(symbol).get('close')
+    if close is None or not len(close):
+        return None
+    value = float(close[-1])
+    return value if math.isfinite(value) else None
+
+
+def cfmmc_credentials(session):
+    """会话使用的CFMMC凭据：未自定义账户时使用环境变量中的默认账户"""
+    if (session and
+            session.state == UserState.COMPLETED and
+            session.use_custom_cfmmc):
+        return {
+            'username': session.cfmmc_username,
+            'password': session.cfmmc_password
+        }
+    return {
+        'username': os.getenv('CFMMC_USER_NAME'),
+        'password': os.getenv('CFMMC_PASSWORD')
+    }
+
+
+def _retry_delay(attempt: int) -> float:
+    """版本冲突后的等待时间：随机指数退避，避免多个进程同步重试"""
+    return random.uniform(0, min(UPDATE_RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY))
 
 
 # 创建全局数据管理器实例
 user_data_manager = UserDataManager()
 
 
+async def reply_text(update, context, text, **kwargs):
+    """回复用户消息 - 经由出站调度器限流，交互回复优先于群发"""
+    dispatcher = context.bot_data.get('dispatcher') if context else None
+    if dispatcher is None:
+        return await update.message.reply_text(text, **kwargs)
+    return await dispatcher.send_message(
+        update.effective_chat.id, text, priority=Priority.INTERACTIVE, **kwargs
+    )
+
+
+async def reply_photo(update, context, photo, **kwargs):
+    """回复图片 - 经由出站调度器限流"""
+    dispatcher = context.bot_data.get('dispatcher') if context else None
+    if dispatcher is None:
+        return await update.message.reply_photo(photo, **kwargs)
+    return await dispatcher.send_photo(
+        update.effective_chat.id, photo, priority=Priority.INTERACTIVE, **kwargs
+    )
+
+
+def handle_conflicts(handler):
+    """
+    处理器装饰器：会话更新多次冲突（同一用户的消息在多个进程中同时处理）时提示用户重新发送，
+    不把 VersionConflict 抛给全局错误处理
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        try:
+            return await handler(update, context)
+        except VersionConflict as e:
+            user = getattr(update, 'effective_user', None)
+            logger.warning(f"会话更新冲突: {e}", extra={'user_id': user.id if user else None})
+            if update and update.message:
+                await reply_text(update, context, "⚠️ 操作过于频繁，请稍后重新发送。")
+    return wrapper
+
+
 async def cleanup_task():
     """定期清理任务"""
     while True:
@@ -227,31 +499,33 @@ async def cleanup_task():
             await asyncio.sleep(1800)  # 30分钟检查一次
 
             # 使用数据管理器的清理方法
-            removed_count = user_data_manager.cleanup_inactive_sessions()
+            removed_count = await user_data_manager.cleanup_inactive_sessions()
 
             if removed_count > 0:
                 logger.info(f"清理了 {removed_count} 个超时会话")
-                logger.info(f"当前活跃会话数: {user_data_manager.get_active_users_count()}")
+                logger.info(f"当前活跃会话数: {await user_data_manager.get_active_users_count()}")
 
         except Exception as e:
             logger.error(f"清理会话时出错: {e}")
 
 
+@handle_conflicts
 async def start_command(update, context):
     """处理 /start 命令"""
     _ = context
     user_id = update.effective_user.id
 
     # 更新活动时间
-    user_data_manager.update_activity(user_id)
+    await user_data_manager.update_activity(user_id)
 
     # 检查是否已有会话
-    if user_data_manager.has_session(user_id):
-        session = user_data_manager.get_session(user_id)
+    if await user_data_manager.has_session(user_id):
+        session = await user_data_manager.get_session(user_id)
 
         if session.state == UserState.COMPLETED:
             # 已完成设置
-            await update.message.reply_text(
+            await reply_text(
+                update, context,
                 "你好！看起来你已经完成了设置 ✨\n\n"
                 "输入 /status 查看当前设置\n"
                 "输入 /restart 重新设置\n"
@@ -260,7 +534,8 @@ async def start_command(update, context):
             return
         else:
             # 设置未完成，询问是否继续
-            await update.message.reply_text(
+            await reply_text(
+                update, context,
                 "检测到你有未完成的设置，是否继续之前的设置？\n\n"
                 "回复 '继续' 接着之前的步骤\n"
                 "回复 '重新开始' 清空重新设置\n"
@@ -269,7 +544,7 @@ async def start_command(update, context):
             return
 
     # 新用户，开始设置
-    user_data_manager.create_session(user_id)
+    await user_data_manager.create_session(user_id)
 
     welcome_msg = (
         "你好！欢迎使用期货交易信号助手 ✨\n\n"
@@ -281,7 +556,7 @@ async def start_command(update, context):
         "让我们开始吧！请输入你的净资产金额（单位：元）："
     )
 
-    await update.message.reply_text(welcome_msg)
+    await reply_text(update, context, welcome_msg)
 
 
 async def handle_net_asset(update, context):
@@ -296,20 +571,22 @@ async def handle_net_asset(update, context):
         net_asset = float(cleaned_text)
 
         if net_asset <= 0:
-            await update.message.reply_text("净资产必须大于0，请重新输入：")
+            await reply_text(update, context, "净资产必须大于0，请重新输入：")
             return
 
         # 保存数据并进入下一状态
-        user_data_manager.update_net_asset(user_id, net_asset)
-        user_data_manager.update_state(user_id, UserState.WAITING_SIGNAL_DATE)
+        await user_data_manager.update_net_asset(user_id, net_asset)
+        await user_data_manager.update_state(user_id, UserState.WAITING_SIGNAL_DATE)
 
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             f"净资产已记录：¥{net_asset:,.2f}\n\n"
             "请输入信号日期（格式：YYYYMMDD，如：20250607）："
         )
 
     except ValueError:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "输入格式不正确，请输入有效的数字金额："
         )
 
@@ -329,10 +606,11 @@ async def handle_signal_date(update, context):
         datetime.strptime(text, '%Y%m%d')
 
         # 保存数据并进入布林带选择状态
-        user_data_manager.update_signal_date(user_id, text)
-        user_data_manager.update_state(user_id, UserState.WAITING_BOLLINGER_CHOICE)
+        await user_data_manager.update_signal_date(user_id, text)
+        await user_data_manager.update_state(user_id, UserState.WAITING_BOLLINGER_CHOICE)
 
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             f"信号日期已记录：{text}\n\n"
             "是否需要自定义布林带周期参数？\n"
             "回复 '是' 进行自定义设置\n"
@@ -340,7 +618,8 @@ async def handle_signal_date(update, context):
         )
 
     except ValueError:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "日期格式不正确！请输入8位数字格式（YYYYMMDD），如：20250607"
         )
 
@@ -352,24 +631,27 @@ async def handle_bollinger_choice(update, context):
     text = update.message.text.strip().lower()
 
     if text in ['是', 'yes', 'y', '1']:
-        user_data_manager.update_bollinger_choice(user_id, True)
-        user_data_manager.update_state(user_id, UserState.WAITING_BOLLINGER_PERIOD)
+        await user_data_manager.update_bollinger_choice(user_id, True)
+        await user_data_manager.update_state(user_id, UserState.WAITING_BOLLINGER_PERIOD)
 
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "请输入布林带周期（建议范围：10-50）："
         )
     elif text in ['否', 'no', 'n', '0']:
-        user_data_manager.update_bollinger_choice(user_id, False)
-        user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_CHOICE)
+        await user_data_manager.update_bollinger_choice(user_id, False)
+        await user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_CHOICE)
 
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "已设置使用默认布林带参数 (19, 2)\n\n"
             "是否需要录入CFMMC账户密码信息？\n"
             "回复 '是' 进行账户设置\n"
             "回复 '否' 使用 yyh's 检查持仓状态"
         )
     else:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "请回复 '是' 或 '否'："
         )
 
@@ -384,16 +666,18 @@ async def handle_bollinger_period(update, context):
         period = int(text)
 
         if not (5 <= period <= 250):
-            await update.message.reply_text(
+            await reply_text(
+                update, context,
                 "布林带周期建议在5-250之间，请重新输入："
             )
             return
 
         # 保存数据并进入CFMMC选择状态
-        user_data_manager.update_bollinger_period(user_id, period)
-        user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_CHOICE)
+        await user_data_manager.update_bollinger_period(user_id, period)
+        await user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_CHOICE)
 
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             f"布林带周期已设置为：{period}天\n\n"
             "是否需要录入CFMMC账户密码信息？\n"
             "回复 '是' 进行账户设置\n"
@@ -401,7 +685,8 @@ async def handle_bollinger_period(update, context):
         )
 
     except ValueError:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "请输入有效的整数作为布林带周期："
         )
 
@@ -413,17 +698,18 @@ async def handle_cfmmc_choice(update, context):
     text = update.message.text.strip().lower()
 
     if text in ['是', 'yes', 'y', '1']:
-        user_data_manager.update_cfmmc_choice(user_id, True)
-        user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_USERNAME)
+        await user_data_manager.update_cfmmc_choice(user_id, True)
+        await user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_USERNAME)
 
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "请输入CFMMC用户名："
         )
     elif text in ['否', 'no', 'n', '0']:
-        user_data_manager.update_cfmmc_choice(user_id, False)
-        user_data_manager.update_state(user_id, UserState.COMPLETED)
+        await user_data_manager.update_cfmmc_choice(user_id, False)
+        await user_data_manager.update_state(user_id, UserState.COMPLETED)
 
-        session = user_data_manager.get_session(user_id)
+        session = await user_data_manager.get_session(user_id)
         summary_msg = (
             "✅ 信息收集完成！\n\n"
             f"📊 净资产：¥{session.net_asset:,.2f}\n"
@@ -434,9 +720,10 @@ async def handle_cfmmc_choice(update, context):
             "输入 /help 查看可用命令。"
         )
 
-        await update.message.reply_text(summary_msg)
+        await reply_text(update, context, summary_msg)
     else:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "请回复 '是' 或 '否'："
         )
 
@@ -448,19 +735,19 @@ async def handle_cfmmc_username(update, context):
     text = update.message.text.strip()
 
     if len(text) < 3:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "用户名长度太短，请重新输入："
         )
         return
 
     # 临时保存用户名，等待密码一起更新
-    session = user_data_manager.get_session(user_id)
-    if session:
-        session.cfmmc_username = text  # 临时保存
+    await user_data_manager.update_cfmmc_username(user_id, text)
 
-    user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_PASSWORD)
+    await user_data_manager.update_state(user_id, UserState.WAITING_CFMMC_PASSWORD)
 
-    await update.message.reply_text(
+    await reply_text(
+        update, context,
         f"用户名已记录\n\n"
         "请输入CFMMC密码："
     )
@@ -473,17 +760,18 @@ async def handle_cfmmc_password(update, context):
     text = update.message.text.strip()
 
     if len(text) < 6:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "密码长度太短，请重新输入："
         )
         return
 
     # 获取临时保存的用户名
-    session = user_data_manager.get_session(user_id)
+    session = await user_data_manager.get_session(user_id)
     if session and session.cfmmc_username:
         # 保存密码并完成设置
-        user_data_manager.update_cfmmc_credentials(user_id, session.cfmmc_username, text)
-        user_data_manager.update_state(user_id, UserState.COMPLETED)
+        await user_data_manager.update_cfmmc_credentials(user_id, session.cfmmc_username, text)
+        await user_data_manager.update_state(user_id, UserState.COMPLETED)
 
         summary_msg = (
             "✅ 信息收集完成！\n\n"
@@ -495,35 +783,46 @@ async def handle_cfmmc_password(update, context):
             "输入 /help 查看可用命令。"
         )
 
-        await update.message.reply_text(summary_msg)
+        await reply_text(update, context, summary_msg)
     else:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "出现错误，请使用 /restart 重新开始设置。"
         )
 
 
+@handle_conflicts
 async def handle_message(update, context):
-    """处理普通消息"""
+    """处理普通消息（处理期间的日志附带用户ID与会话状态）"""
+    user_id = update.effective_user.id
+    with log_context(user_id=user_id, state=await user_data_manager.get_user_state(user_id)):
+        await _dispatch_message(update, context)
+
+
+async def _dispatch_message(update, context):
+    """按会话状态分发普通消息"""
     user_id = update.effective_user.id
     text = update.message.text.strip()
 
     # 更新活动时间
-    user_data_manager.update_activity(user_id)
+    await user_data_manager.update_activity(user_id)
 
-    if not user_data_manager.has_session(user_id):
-        await update.message.reply_text(
+    if not await user_data_manager.has_session(user_id):
+        await reply_text(
+            update, context,
             "请先输入 /start 开始使用。"
         )
         return
 
-    session = user_data_manager.get_session(user_id)
+    session = await user_data_manager.get_session(user_id)
 
     # 处理继续/重新开始的选择（当用户在start命令后回复时）
     if text in ['继续', '重新开始'] and session.state != UserState.COMPLETED:
         if text == '重新开始':
             # 重置会话
-            user_data_manager.create_session(user_id)
-            await update.message.reply_text(
+            await user_data_manager.create_session(user_id)
+            await reply_text(
+                update, context,
                 "已重置设置，请输入你的净资产金额（单位：元）："
             )
             return
@@ -539,7 +838,7 @@ async def handle_message(update, context):
                 UserState.WAITING_CFMMC_PASSWORD: "请输入CFMMC密码："
             }
             prompt = state_prompts.get(session.state, "请继续之前的输入：")
-            await update.message.reply_text(f"好的，让我们继续~\n{prompt}")
+            await reply_text(update, context, f"好的，让我们继续~\n{prompt}")
             return
 
     # 根据当前状态处理消息
@@ -558,18 +857,20 @@ async def handle_message(update, context):
     elif session.state == UserState.WAITING_CFMMC_PASSWORD:
         await handle_cfmmc_password(update, context)
     elif session.state == UserState.COMPLETED:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "信息已收集完成。输入 /help 查看可用命令，或 /restart 重新设置。"
         )
 
 
+@handle_conflicts
 async def help_command(update, context):
     """处理 /help 命令"""
     _ = context
     user_id = update.effective_user.id
 
     # 更新活动时间
-    user_data_manager.update_activity(user_id)
+    await user_data_manager.update_activity(user_id)
 
     help_text = (
         "🤖 期货交易信号助手使用指南\n\n"
@@ -577,25 +878,29 @@ async def help_command(update, context):
         "/start - 开始使用（智能检测状态）\n"
         "/help - 显示此帮助信息\n"
         "/status - 查看当前设置\n"
+        "/signal - 查看布林带信号\n"
+        "/chart 品种或合约 - 查看布林带走势图（如 /chart RB）\n"
+        "/alert 合约 条件 - 设置价格或布林带提醒（如 /alert RB2510 上轨）\n"
         "/restart - 重新设置所有信息\n\n"
         "❓ 如有问题，请联系管理员。"
     )
-    await update.message.reply_text(help_text)
+    await reply_text(update, context, help_text)
 
 
+@handle_conflicts
 async def status_command(update, context):
     """处理 /status 命令"""
     _ = context
     user_id = update.effective_user.id
 
     # 更新活动时间
-    user_data_manager.update_activity(user_id)
+    await user_data_manager.update_activity(user_id)
 
-    if not user_data_manager.has_session(user_id):
-        await update.message.reply_text("请先输入 /start 开始设置。")
+    if not await user_data_manager.has_session(user_id):
+        await reply_text(update, context, "请先输入 /start 开始设置。")
         return
 
-    session = user_data_manager.get_session(user_id)
+    session = await user_data_manager.get_session(user_id)
 
     if session.state == UserState.COMPLETED:
         # 构建布林带参数显示
@@ -633,31 +938,174 @@ async def status_command(update, context):
         current_step = progress_states.get(session.state, "未知状态")
         status_msg = f"⚠️ 信息设置未完成\n当前步骤：{current_step}"
 
-    await update.message.reply_text(status_msg)
+    await reply_text(update, context, status_msg)
+
+
+@handle_conflicts
+async def signal_command(update, context):
+    """处理 /signal 命令"""
+    user_id = update.effective_user.id
+
+    # 更新活动时间
+    await user_data_manager.update_activity(user_id)
+
+    if not await user_data_manager.is_setup_complete(user_id):
+        await reply_text(update, context, "请先完成设置（输入 /start）后再查看信号。")
+        return
+
+    period, std = await user_data_manager.get_bollinger_params(user_id)
+    signal_date = await user_data_manager.get_signal_date(user_id)
+    params = (period, std, signal_date)
+
+    await reply_text(update, context, "正在计算信号，请稍候...")
+
+    try:
+        groups = await compute_user_signals({user_id: params})
+    except Exception as e:
+        logger.error(f"计算用户 {user_id} 的信号时出错: {e}")
+        await reply_text(update, context, "信号计算失败，请稍后重试。")
+        return
+
+    _, signals = groups[params]
+    await reply_text(update, context, format_signal_message(signals, period, std, signal_date))
+
+
+@handle_conflicts
+async def chart_command(update, context):
+    """处理 /chart 命令"""
+    user_id = update.effective_user.id
+
+    # 更新活动时间
+    await user_data_manager.update_activity(user_id)
+
+    if not await user_data_manager.is_setup_complete(user_id):
+        await reply_text(update, context, "请先完成设置（输入 /start）后再查看图表。")
+        return
+
+    if not context.args:
+        await reply_text(update, context, "请指定品种或合约，如：/chart RB 或 /chart RB2510")
+        return
+
+    symbol = context.args[0].strip()
+    period, std = await user_data_manager.get_bollinger_params(user_id)
+    signal_date = await user_data_manager.get_signal_date(user_id)
+
+    try:
+        chart = await get_chart_service().get_chart(symbol, period, std, signal_date)
+    except Exception as e:
+        logger.error(f"生成 {symbol} 图表时出错: {e}")
+        await reply_text(update, context, "图表生成失败，请稍后重试。")
+        return
+
+    if chart is None:
+        await reply_text(update, context, f"未找到 {symbol} 在 {signal_date} 之前的行情数据。")
+        return
+
+    code, image = chart
+    await reply_photo(update, context, image,
+                      caption=f"{code} 布林带 ({period}, {std})  截至 {signal_date}")
+
+
+ALERT_USAGE = (
+    "用法：\n"
+    "/alert RB2510 3500 - 价格到达 3500 时提醒（>3500 或 <3500 指定方向）\n"
+    "/alert RB2510 上轨 - 收盘价突破上轨时提醒（下轨同理）\n"
+    "/alert - 查看我的提醒\n"
+    "/alert del 编号 - 删除提醒；/alert clear - 删除全部提醒"
+)
+
+BAND_ALERT_WORDS = {'上轨': UPPER, 'upper': UPPER, '下轨': LOWER, 'lower': LOWER}
+
+
+@handle_conflicts
+async def alert_command(update, context):
+    """处理 /alert 命令"""
+    user_id = update.effective_user.id
+
+    # 更新活动时间
+    await user_data_manager.update_activity(user_id)
+
+    if not await user_data_manager.has_session(user_id):
+        await reply_text(update, context, "请先输入 /start 开始设置。")
+        return
+
+    args = context.args or []
+    if not args:
+        alerts = await user_data_manager.get_alerts(user_id)
+        if not alerts:
+            await reply_text(update, context, "你还没有价格提醒。\n\n" + ALERT_USAGE)
+            return
+        lines = ["🔔 我的提醒："] + [f"#{alert.alert_id} {describe(alert)}" for alert in alerts]
+        await reply_text(update, context, "\n".join(lines))
+        return
+
+    if args[0].lower() == 'clear':
+        count = await user_data_manager.clear_alerts(user_id)
+        await reply_text(update, context, f"已删除 {count} 个提醒。")
+        return
+
+    if args[0].lower() == 'del':
+        alert_id = args[1].lstrip('#') if len(args) > 1 else ''
+        if alert_id.isdigit() and await user_data_manager.remove_alert(user_id, int(alert_id)):
+            await reply_text(update, context, f"已删除提醒 #{alert_id}。")
+        else:
+            await reply_text(update, context, "未找到该提醒，请用 /alert 查看提醒编号。")
+        return
+
+    if len(args) < 2:
+        await reply_text(update, context, ALERT_USAGE)
+        return
+
+    symbol, condition = args[0].upper(), args[1].strip()
+    band = BAND_ALERT_WORDS.get(condition.lower())
+    if band:
+        alert = await user_data_manager.add_band_alert(user_id, symbol, band)
+    else:
+        match = re.fullmatch(r'([<>]?)=?\s*(\d+(?:\.\d+)?)', condition)
+        if not match:
+            await reply_text(update, context, ALERT_USAGE)
+            return
+        direction = {'>': ABOVE, '<': BELOW}.get(match.group(1))
+        try:
+            alert = await user_data_manager.add_level_alert(user_id, symbol, float(match.group(2)), direction)
+        except NoLastPrice:
+            await reply_text(update, context, f"暂无 {symbol} 的最新价，请用 >价格 或 <价格 指定提醒方向。")
+            return
+
+    if alert is None:
+        # 会话在检查之后被清理
+        await reply_text(update, context, "请先输入 /start 开始设置。")
+        return
+
+    await reply_text(update, context, f"✅ 已设置提醒 #{alert.alert_id}：{describe(alert)}")
 
 
+@handle_conflicts
 async def restart_command(update, context):
     """处理 /restart 命令"""
     _ = context
     user_id = update.effective_user.id
 
     # 更新活动时间
-    user_data_manager.update_activity(user_id)
+    await user_data_manager.update_activity(user_id)
 
     # 创建新会话
-    user_data_manager.create_session(user_id)
+    await user_data_manager.create_session(user_id)
 
-    await update.message.reply_text(
+    await reply_text(
+        update, context,
         "🔄 已重置设置，请输入你的净资产金额（单位：元）："
     )
 
 
 async def error_handler(update, context):
     """全局错误处理"""
-    logger.error(f"更新 {update} 引起异常：{context.error}")
+    user = getattr(update, 'effective_user', None)
+    logger.error(f"更新 {update} 引起异常：{context.error}", extra={'user_id': user.id if user else None})
 
     if update and update.message:
-        await update.message.reply_text(
+        await reply_text(
+            update, context,
             "抱歉，处理你的请求时出现了错误。请稍后重试或联系管理员。"
         )
 
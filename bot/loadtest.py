@@ -0,0 +1,257 @@
+"""
+Bot 压测工具
+
+在子进程中启动真实的 Bot（bot.main），连接本地模拟的 Bot API 服务器（bot.fake_telegram），
+模拟大量用户从 /start 开始走完整个设置流程（WAITING_NET_ASSET → … → COMPLETED），
+统计吞吐量、回复延迟（p50 / p99）与 Bot 进程的内存增长。用法：
+
+    python -m bot.loadtest --users 2000 --concurrency 200
+    python -m bot.loadtest --users 2000 --workers 4          # 分片运行（自动启动模拟 Redis）
+
+默认放开出站限流（OUTBOUND_GLOBAL_RATE / OUTBOUND_CHAT_RATE），测量 Bot 自身的处理能力；
+加 --telegram-limits 则保留 Telegram 的发送限制。
+"""
+import argparse
+import asyncio
+import base64
+import math
+import os
+import random
+import secrets
+import subprocess
+import sys
+import time
+
+from bot.fake_telegram import FakeBotApiServer
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 模拟用户的编号从此开始，避免与真实用户冲突
+FIRST_USER_ID = 7_000_000_000
+
+# 完成设置时回复中包含的文字
+COMPLETED_MARK = '信息收集完成'
+
+
+def user_script(rng: random.Random) -> list:
+    """一个模拟用户依次发送的消息，随机走自定义布林带 / CFMMC 账户的分支"""
+    script = ['/start', f"{rng.randint(10, 5000) * 1000:,}", '20250607']
+    if rng.random() < 0.5:
+        script += ['是', str(rng.randint(10, 50))]
+    else:
+        script.append('否')
+    if rng.random() < 0.3:
+        script += ['是', f"user{rng.randint(1000, 9999)}", 'secret123']
+    else:
+        script.append('否')
+    return script
+
+
+def _process_tree(pid: int) -> list:
+    """进程及其全部子孙进程的 pid"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # 进程名可能含空格，ppid 位于右括号之后的第二个字段
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, ()))
+    return tree
+
+
+def tree_rss(pid: int) -> int:
+    """进程树的常驻内存之和（字节）"""
+    from scrape.crawl_pool import _rss_bytes
+
+    return sum(_rss_bytes(member) for member in _process_tree(pid))
+
+
+def percentile(values: list, q: float) -> float:
+    """已排序列表的分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class LoadTest:
+    """
+    一次压测
+
+    参数:
+        users: 模拟用户总数
+        concurrency: 同时进行设置流程的用户数
+        workers: Bot 工作进程数（BOT_WORKERS）
+        think: 用户收到回复后到发送下一条消息的间隔（秒）
+        telegram_limits: 是否保留 Telegram 的出站限流
+        timeout: 单条消息等待回复的超时（秒）
+        seed: 随机种子
+        bot_log: Bot 进程的日志文件，默认丢弃
+    """
+
+    def __init__(self, users: int, concurrency: int, workers: int = 1, think: float = 0.0,
+                 telegram_limits: bool = False, timeout: float = 30.0, seed: int = 1, bot_log: str = None):
+        self.users = users
+        self.concurrency = concurrency
+        self.workers = workers
+        self.think = think
+        self.telegram_limits = telegram_limits
+        self.timeout = timeout
+        self.bot_log = bot_log
+        self._rng = random.Random(seed)
+        self.latencies = []
+        self.completed = 0
+        self.failures = {}
+        self.rss_samples = []
+
+    def _bot_env(self, api_url: str, store_url: str) -> dict:
+        env = dict(os.environ)
+        env.update({
+            'TELEGRAM_BOT_TOKEN': '123456:LOADTEST',
+            'TELEGRAM_API_URL': api_url,
+            'BOT_WORKERS': str(self.workers),
+            'SESSION_STORE_URL': store_url,
+            # 压测期间不执行定时任务
+            'SIGNAL_PUSH_TIME': '',
+            'POSITION_CHECK_TIME': '',
+            'CONTRACT_REFRESH_DAYS': '0',
+            'LOG_FILE': '',
+            'SESSION_SECRET_KEY': env.get('SESSION_SECRET_KEY') or base64.urlsafe_b64encode(secrets.token_bytes(32)).decode(),
+            'PYTHONPATH': os.pathsep.join(filter(None, [PROJECT_ROOT, env.get('PYTHONPATH')])),
+        })
+        if not self.telegram_limits:
+            env['OUTBOUND_GLOBAL_RATE'] = '1000000'
+            env['OUTBOUND_CHAT_RATE'] = '1000000'
+        return env
+
+    async def _run_user(self, api: FakeBotApiServer, user_id: int, script: list, slots: asyncio.Semaphore):
+        async with slots:
+            reply = ''
+            try:
+                for text in script:
+                    latency, reply = await api.exchange(user_id, text, self.timeout)
+                    self.latencies.append(latency)
+                    if self.think:
+                        await asyncio.sleep(self.think)
+            except asyncio.TimeoutError:
+                self.failures['timeout'] = self.failures.get('timeout', 0) + 1
+                return
+            finally:
+                api.forget(user_id)
+            if COMPLETED_MARK in reply:
+                self.completed += 1
+            else:
+                self.failures['unexpected_reply'] = self.failures.get('unexpected_reply', 0) + 1
+
+    async def _sample_memory(self, pid: int, interval: float = 0.5):
+        while True:
+            self.rss_samples.append(await asyncio.to_thread(tree_rss, pid))
+            await asyncio.sleep(interval)
+
+    async def run(self) -> dict:
+        """执行压测，返回统计结果"""
+        fake_redis = None
+        store_url = os.getenv('SESSION_STORE_URL', '')
+        if self.workers > 1 and not store_url.startswith('redis://'):
+            from bot.fake_redis import FakeRedisServer
+
+            fake_redis = FakeRedisServer().start()
+            store_url = fake_redis.url
+
+        api = await FakeBotApiServer().start()
+        log = open(self.bot_log, 'ab') if self.bot_log else subprocess.DEVNULL
+        bot = subprocess.Popen([sys.executable, '-m', 'bot.main'], env=self._bot_env(api.url, store_url),
+                               stdout=log, stderr=log, cwd=PROJECT_ROOT)
+        try:
+            # 等待 Bot 开始拉取更新，并等分片进程完成启动
+            await asyncio.wait_for(api.polling.wait(), 120)
+            await self._warm_up(api)
+            baseline = tree_rss(bot.pid)
+
+            sampler = asyncio.create_task(self._sample_memory(bot.pid))
+            slots = asyncio.Semaphore(self.concurrency)
+            scripts = [user_script(self._rng) for _ in range(self.users)]
+            started = time.perf_counter()
+            await asyncio.gather(*(self._run_user(api, FIRST_USER_ID + index, script, slots)
+                                   for index, script in enumerate(scripts)))
+            elapsed = time.perf_counter() - started
+            sampler.cancel()
+            final = tree_rss(bot.pid)
+        finally:
+            bot.terminate()
+            try:
+                await asyncio.to_thread(bot.wait, 15)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+            await api.stop()
+            if fake_redis is not None:
+                fake_redis.stop()
+            if log is not subprocess.DEVNULL:
+                log.close()
+
+        latencies = sorted(self.latencies)
+        return {
+            'users': self.users,
+            'completed': self.completed,
+            'failures': dict(self.failures),
+            'messages': len(latencies),
+            'elapsed': elapsed,
+            'messages_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'users_per_second': self.completed / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'rss_baseline': baseline,
+            'rss_peak': max(self.rss_samples + [final]),
+            'rss_final': final,
+            'rss_per_user': (final - baseline) / self.users if self.users else 0.0,
+        }
+
+    async def _warm_up(self, api: FakeBotApiServer):
+        """每个分片先处理一条消息，排除启动与首次导入的耗时"""
+        for shard in range(max(self.workers, 1)):
+            user_id = FIRST_USER_ID - 1 - shard
+            await api.exchange(user_id, '/help', timeout=120)
+            api.forget(user_id)
+
+
+def format_report(result: dict) -> str:
+    """压测结果的文字报告"""
+    mb = 1024 * 1024
+    failures = ', '.join(f"{name} {count}" for name, count in result['failures'].items()) or '无'
+    return "\n".join([
+        f"模拟用户: {result['users']}，完成设置: {result['completed']}，失败: {failures}",
+        f"消息数: {result['messages']}，耗时: {result['elapsed']:.1f} 秒",
+        f"吞吐量: {result['messages_per_second']:.0f} 条/秒，{result['users_per_second']:.1f} 个用户/秒",
+        f"回复延迟: p50 {result['p50_ms']:.1f} ms，p90 {result['p90_ms']:.1f} ms，"
+        f"p99 {result['p99_ms']:.1f} ms，最大 {result['max_ms']:.1f} ms",
+        f"Bot 内存: 起始 {result['rss_baseline'] / mb:.1f} MB，峰值 {result['rss_peak'] / mb:.1f} MB，"
+        f"结束 {result['rss_final'] / mb:.1f} MB（每用户 {result['rss_per_user'] / 1024:.1f} KB）",
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bot 压测：模拟用户走完设置流程')
+    parser.add_argument('--users', type=int, default=1000, help='模拟用户总数')
+    parser.add_argument('--concurrency', type=int, default=100, help='同时进行设置的用户数')
+    parser.add_argument('--workers', type=int, default=1, help='Bot 工作进程数（BOT_WORKERS）')
+    parser.add_argument('--think', type=float, default=0.0, help='用户两条消息之间的间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=30.0, help='单条消息等待回复的超时（秒）')
+    parser.add_argument('--telegram-limits', action='store_true', help='保留 Telegram 的出站限流')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bot-log', help='Bot 进程日志写入的文件')
+    args = parser.parse_args()
+
+    test = LoadTest(args.users, args.concurrency, workers=args.workers, think=args.think,
+                    telegram_limits=args.telegram_limits, timeout=args.timeout, seed=args.seed,
+                    bot_log=args.bot_log)
+    print(format_report(asyncio.run(test.run())))
@@ -0,0 +1,168 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 日志上下文：在处理某个用户的消息或某个后台任务时设置，之后该协程/线程中的日志自动携带
+user_id_var = contextvars.ContextVar('user_id', default=None)
+state_var = contextvars.ContextVar('state', default=None)
+job_id_var = contextvars.ContextVar('job_id', default=None)
+
+CONTEXT_FIELDS = {'user_id': user_id_var, 'state': state_var, 'job_id': job_id_var}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    在代码块内为日志附加上下文字段（user_id / state / job_id）
+
+    用法:
+        with log_context(user_id=123, state='waiting_net_asset'):
+            ...
+    """
+    tokens = [(CONTEXT_FIELDS[name], CONTEXT_FIELDS[name].set(value)) for name, value in fields.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """在产生日志的线程中读取上下文变量写入记录（记录里已通过 extra 指定的字段不覆盖）"""
+
+    def filter(self, record):
+        for name, var in CONTEXT_FIELDS.items():
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    限制重复的警告与错误
+
+    同一调用位置（logger、文件、行号）在 window 秒内最多输出 burst 条 WARNING 及以上的日志，
+    其余丢弃；窗口结束后的第一条日志附带被丢弃的条数。
+    """
+
+    def __init__(self, window: float = 60.0, burst: int = 5):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                if suppressed:
+                    record.msg = f"{record.getMessage()}（此前 {self.window:.0f} 秒内另有 {suppressed} 条相同位置的日志被省略）"
+                    record.args = None
+                started, count, suppressed = now, 0, 0
+
+            if count >= self.burst:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            self._windows[key] = (started, count + 1, suppressed)
+            return True
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """进程内队列处理器：记录不跨进程传递，入队时无需预先格式化和复制"""
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=logging.INFO, log_format: str = None, log_file: str = None):
+    """
+    配置全局日志：业务线程只把记录放入队列，格式化与 I/O 在后台监听线程中完成
+
+    参数:
+    level: 日志级别
+    log_format (str, optional): text 或 json，默认读取环境变量 LOG_FORMAT（默认 text）
+    log_file (str, optional): 同时写入的日志文件，默认读取环境变量 LOG_FILE
+
+    返回:
+    logging.handlers.QueueListener: 后台监听器（重复调用时返回已有实例）
+    """
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        log_format = (log_format or os.getenv('LOG_FORMAT', 'text')).lower()
+        log_file = log_file or os.getenv('LOG_FILE')
+        formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+
+        outputs = [logging.StreamHandler()]
+        if log_file:
+            outputs.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=10 * 2 ** 20,
+                                                                backupCount=5, encoding='utf-8'))
+        for handler in outputs:
+            handler.setFormatter(formatter)
+
+        # 上下文与限流在入队前完成（上下文变量只在产生日志的线程中可见）
+        queue_handler = LocalQueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(queue_handler.queue, *outputs, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """停止后台监听线程并输出队列中剩余的日志"""
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -1,55 +1,137 @@
+from bot.startup import startup_timer
+
 import os
 import logging
 import asyncio
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters
 
-from handlers import (
-    start_command, help_command, status_command, restart_command,
-    handle_message, error_handler, cleanup_inactive_sessions
+from bot.dispatcher import create_dispatcher
+from bot.logging_setup import setup_logging
+from bot.handlers import (
+    start_command, help_command, status_command, restart_command, signal_command, chart_command,
+    alert_command, handle_message, error_handler, cleanup_inactive_sessions, user_data_manager
 )
+from bot.processor import alert_watch_task, position_check_task, signal_push_task, shutdown_services
+from bot.sharding import create_router
+
+startup_timer.mark("导入模块")
 
 # 加载环境变量
 load_dotenv()
 
-# 配置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# 配置日志：格式化与输出在后台线程中完成，不阻塞事件循环（LOG_FORMAT=json 输出结构化日志）
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
-async def post_init(_application: Application
+async def post_init(application: Application
 ) -> None:
     """Bot启动后的初始化"""
+    # 分片模式下主进程与各工作进程分享全局发送速率
+    router = application.bot_data.get('router')
+
+    # 启动出站消息调度器，所有回复与群发都经由它限流
+    dispatcher = create_dispatcher(application.bot, senders=router.shards + 1 if router else 1)
+    dispatcher.start()
+    application.bot_data['dispatcher'] = dispatcher
+
+    # 分片模式：启动工作进程，用户消息转发给工作进程处理
+    if router:
+        router.start()
+        asyncio.create_task(router.supervise())
+        logger.info(f"已启动 {router.shards} 个分片工作进程")
+
     # 创建清理任务
     asyncio.create_task(cleanup_inactive_sessions())
     logger.info("会话清理任务已启动")
 
+    # 每日信号推送与持仓对账任务（未配置 SIGNAL_PUSH_TIME / POSITION_CHECK_TIME 时直接退出）
+    asyncio.create_task(signal_push_task(application, user_data_manager))
+    asyncio.create_task(position_check_task(application, user_data_manager))
 
-def main():
-    """启动Bot"""
-    # 获取Token
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not token:
-        logger.error("未找到TELEGRAM_BOT_TOKEN，请检查.env文件")
-        return
+    # 盘中价格提醒：有提醒时按分钟线轮询（提醒索引在任务首次轮询时加载，导入时不访问会话存储）
+    asyncio.create_task(alert_watch_task(application, user_data_manager))
+
+    # 合约参数：建立一次内存索引，快照过期时在后台从 akshare 刷新
+    from trading.contracts import contract_registry
+    contract_registry.warm()
+
+    startup_timer.mark("初始化")
+    startup_timer.log_report()
+    asyncio.create_task(asyncio.to_thread(contract_registry.refresh_if_stale))
+
+
+async def post_shutdown(application: Application) -> None:
+    """Bot停止前的清理"""
+    dispatcher = application.bot_data.pop('dispatcher', None)
+    if dispatcher:
+        await dispatcher.stop()
 
-    # 创建应用
-    application = Application.builder().token(token).post_init(post_init).build()
+    router = application.bot_data.pop('router', None)
+    if router:
+        router.stop()
+
+    shutdown_services()
+
+
+def build_application(token: str, base_url: str = None, updater: bool = True) -> Application:
+    """
+    创建应用并注册全部处理器（主进程与分片工作进程共用）
+
+    参数:
+    token (str): Bot Token
+    base_url (str, optional): Bot API 地址，如 http://127.0.0.1:8081，默认官方地址
+    updater (bool): 是否创建轮询更新器；分片工作进程的更新由主进程转发，不需要
+
+    返回:
+    Application: 未启动的应用
+    """
+    builder = Application.builder().token(token)
+    if base_url:
+        builder = builder.base_url(f"{base_url.rstrip('/')}/bot")
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # 注册命令处理器
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("restart", restart_command))
+    application.add_handler(CommandHandler("signal", signal_command))
+    application.add_handler(CommandHandler("chart", chart_command))
+    application.add_handler(CommandHandler("alert", alert_command))
 
     # 注册消息处理器
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     # 注册错误处理器
     application.add_error_handler(error_handler)
+    return application
+
+
+def main():
+    """启动Bot"""
+    # 获取Token
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        logger.error("未找到TELEGRAM_BOT_TOKEN，请检查.env文件")
+        return
+
+    # 创建应用（TELEGRAM_API_URL 可指向本地 Bot API 服务器或压测用的模拟服务器）
+    base_url = os.getenv('TELEGRAM_API_URL') or None
+    application = build_application(token, base_url=base_url)
+    application.post_init = post_init
+    application.post_shutdown = post_shutdown
+
+    # BOT_WORKERS > 1 时按用户ID分片：路由器最先执行，把用户消息转发给工作进程
+    router = create_router(token, base_url)
+    if router:
+        application.bot_data['router'] = router
+        application.add_handler(TypeHandler(Update, router.route), group=-1)
+    startup_timer.mark("构建应用")
 
     # 启动Bot
     logger.info("Bot启动中...")
@@ -62,4 +144,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+
+from bot.dispatcher import Priority
+from bot.logging_setup import log_context
+
+logger = logging.getLogger(__name__)
+
+# 信号服务与图表服务依赖 pandas / matplotlib，首次使用时创建
+_signal_service = None
+_chart_service = None
+
+
+def get_signal_service():
+    """获取全局信号服务实例"""
+    global _signal_service
+    if _signal_service is None:
+        from trading.signal import SignalService
+        _signal_service = SignalService()
+    return _signal_service
+
+
+def get_chart_service():
+    """获取全局图表服务实例"""
+    global _chart_service
+    if _chart_service is None:
+        from trading.chart import ChartService
+        # 图表缓存随信号服务的数据版本失效
+        _chart_service = ChartService(data_version=lambda: get_signal_service().data_version)
+    return _chart_service
+
+
+def shutdown_services():
+    """关闭图表渲染进程池与爬取工作进程池"""
+    if _chart_service is not None:
+        _chart_service.shutdown()
+
+    # 只在用过时关闭，避免为此导入爬虫模块
+    crawl_pool_module = sys.modules.get('scrape.crawl_pool')
+    if crawl_pool_module is not None:
+        crawl_pool_module.crawl_pool.shutdown()
+
+
+def format_signal_message(signals, period, std, signal_date) -> str:
+    """将信号表格式化为推送消息"""
+    header = f"📈 布林带信号 {signal_date}  参数({period}, {std})\n\n"
+
+    triggered = signals[signals['signal'].notna()]
+    if triggered.empty:
+        return header + "今日无品种突破布林带。"
+
+    lines = [
+        f"{row.variety} {row.symbol}：{row.signal}  收盘 {row.close:g}  "
+        f"上轨 {row.upper:.2f}  下轨 {row.lower:.2f}"
+        for row in triggered.itertuples()
+    ]
+    return header + "\n".join(lines)
+
+
+async def compute_user_signals(user_params: dict) -> dict:
+    """
+    在线程池中按参数分组计算信号，避免阻塞事件循环
+
+    参数:
+        user_params: {user_id: (period, std, signal_date)}
+
+    返回:
+        dict: {(period, std, signal_date): (用户ID列表, 信号DataFrame)}
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, get_signal_service().fan_out, user_params)
+
+
+async def broadcast_signals(dispatcher, user_data_manager) -> dict:
+    """为所有已完成设置的用户计算信号并群发，每组参数只计算和格式化一次"""
+    user_params = {session.user_id: (session.bollinger_period, session.bollinger_std, session.signal_date)
+                   for session in await user_data_manager.get_completed_sessions()}
+
+    if not user_params:
+        return {'sent': 0, 'failed': 0}
+
+    groups = await compute_user_signals(user_params)
+    messages = []
+    for (period, std, signal_date), (user_ids, signals) in groups.items():
+        text = format_signal_message(signals, period, std, signal_date)
+        messages.extend((user_id, text) for user_id in user_ids)
+
+    logger.info(f"信号推送：{len(user_params)} 个用户，{len(groups)} 组参数")
+    return await dispatcher.broadcast(messages, priority=Priority.BROADCAST)
+
+
+async def reconcile_positions(user_data_manager, positions: dict, trade_date: str):
+    """
+    夜间爬取持仓后，为所有用户一次性对账
+
+    参数:
+        positions: {user_id: 持仓明细DataFrame}
+        trade_date: 持仓日期
+
+    返回:
+        tuple: (detail, summary)，见 trading.reconcile.reconcile；summary 附带 trading.risk 的风险列
+    """
+    sessions = {session.user_id: session for session in await user_data_manager.get_completed_sessions()}
+    user_params = {}
+    net_assets = {}
+    for user_id in positions:
+        session = sessions.get(user_id)
+        period, std = (session.bollinger_period, session.bollinger_std) if session else (19, 2)
+        user_params[user_id] = (period, std, (session.signal_date if session else None) or trade_date.replace('-', ''))
+        net_assets[user_id] = session.net_asset if session else None
+
+    groups = await compute_user_signals(user_params)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _reconcile_with_risk, positions, groups, net_assets, trade_date)
+
+
+def _reconcile_with_risk(positions: dict, groups: dict, net_assets: dict, trade_date: str):
+    """对账后按当前持仓批量评估风险（保证金占用、组合波动率），风险列并入 summary"""
+    from trading.reconcile import reconcile_all
+    from trading.risk import risk_service
+
+    detail, summary = reconcile_all(positions, groups, net_assets, trade_date)
+    try:
+        risk = risk_service.assess(detail, net_assets, as_of=trade_date)
+        summary = summary.join(risk[['margin', 'margin_usage', 'daily_vol', 'daily_vol_pct', 'var_99',
+                                     'unmodelled_notional']])
+    except Exception as e:
+        logger.warning(f"风险评估失败，仅推送对账结果: {e}")
+    return detail, summary
+
+
+async def crawl_user_positions(user_data_manager, trade_date: str, max_concurrency: int = None):
+    """
+    并发爬取所有已完成设置用户的持仓，相同账户只爬取一次
+
+    参数:
+        trade_date: 交易日期，格式YYYY-MM-DD
+
+    返回:
+        tuple: ({user_id: 持仓DataFrame}, {user_id: 失败原因})
+    """
+    from bot.handlers import cfmmc_credentials
+    from scrape.cfmmc_crawler import CrawlJob, get_positions_batch
+
+    accounts = {}
+    for session in await user_data_manager.get_completed_sessions():
+        credentials = cfmmc_credentials(session)
+        if not credentials['username'] or not credentials['password']:
+            continue
+        accounts.setdefault((credentials['username'], credentials['password']), []).append(session.user_id)
+
+    jobs = [CrawlJob(i, trade_date, username, password) for i, (username, password) in enumerate(accounts)]
+    max_concurrency = max_concurrency or int(os.getenv('CRAWL_CONCURRENCY', '4'))
+    results = await get_positions_batch(jobs, max_concurrency)
+
+    positions, failures = {}, {}
+    for result, user_ids in zip(results, accounts.values()):
+        for user_id in user_ids:
+            if result.ok:
+                positions[user_id] = result.data
+            else:
+                failures[user_id] = str(result.error)
+    return positions, failures
+
+
+def format_reconcile_message(detail, summary_row) -> str:
+    """将单个用户的对账结果格式化为推送消息"""
+    lines = [
+        "🧾 持仓对账",
+        f"名义敞口 ¥{summary_row.gross_notional:,.0f}，占净资产 {summary_row.utilization:.1%}；"
+        f"目标占用 {summary_row.target_utilization:.1%}",
+    ]
+    margin_usage = getattr(summary_row, 'margin_usage', None)
+    if margin_usage is not None and not math.isnan(margin_usage):
+        lines.append(f"保证金占用约 {margin_usage:.1%}")
+    daily_vol = getattr(summary_row, 'daily_vol', None)
+    if daily_vol is not None and math.isfinite(daily_vol):
+        vol_pct = summary_row.daily_vol_pct
+        vol_pct = f"（{vol_pct:.2%}）" if math.isfinite(vol_pct) else ""
+        lines.append(f"组合日波动 ¥{daily_vol:,.0f}{vol_pct}，99% VaR ¥{summary_row.var_99:,.0f}")
+    unmodelled = getattr(summary_row, 'unmodelled_notional', None)
+    if unmodelled is not None and unmodelled > 0:
+        lines.append(f"⚠️ 缺少波动率数据的敞口 ¥{unmodelled:,.0f}，未计入波动率与 VaR")
+    adjust = detail[detail['delta'] != 0]
+    if adjust.empty:
+        lines.append("持仓与信号一致，无需调整。")
+    else:
+        lines.extend(f"{row.symbol}：持仓 {row.lots:+g} 手 → 目标 {row.target_lots:+g} 手（{row.delta:+g}）"
+                     for row in adjust.itertuples())
+    return "\n".join(lines)
+
+
+def _parse_daily_time(value: str):
+    """
+    解析 HH:MM 格式的每日时刻
+
+    返回:
+        tuple: (时, 分)；格式不正确时返回None
+    """
+    try:
+        parsed = datetime.strptime(value.strip(), '%H:%M')
+    except ValueError:
+        return None
+    return parsed.hour, parsed.minute
+
+
+def _seconds_until(at: tuple) -> float:
+    """距离下一个 (时, 分) 时刻的秒数"""
+    now = datetime.now()
+    hour, minute = at
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def run_daily(env_name: str, name: str, job):
+    """
+    每天在环境变量 env_name 配置的 HH:MM 时刻执行一次 job
+
+    时刻在进入循环前校验：格式错误时每次循环都会在 await 之前抛出异常，会卡死事件循环。
+    job 出错时记录日志，等待下一天再执行。
+
+    参数:
+        env_name: 配置时刻的环境变量，未配置时直接返回
+        name: 任务名称（用于日志）
+        job: 协程函数，参数为当天日期 YYYY-MM-DD
+    """
+    value = os.getenv(env_name)
+    if not value:
+        return
+    at = _parse_daily_time(value)
+    if at is None:
+        logger.error(f"{env_name} 格式错误（应为 HH:MM）: {value!r}，不执行{name}")
+        return
+
+    while True:
+        await asyncio.sleep(_seconds_until(at))
+        try:
+            await job(datetime.now().strftime('%Y-%m-%d'))
+        except Exception as e:
+            logger.error(f"{name}出错: {e}")
+
+
+async def position_check_task(application, user_data_manager):
+    """每晚爬取所有用户持仓并对账（需在环境变量 POSITION_CHECK_TIME 中配置 HH:MM）"""
+    async def check(trade_date: str):
+        dispatcher = application.bot_data.get('dispatcher')
+        if dispatcher is None:
+            return
+
+        with log_context(job_id=f"position_check:{trade_date}"):
+            positions, failures = await crawl_user_positions(user_data_manager, trade_date)
+
+            messages = [(user_id, f"❌ 持仓获取失败：{error}") for user_id, error in failures.items()]
+            if positions:
+                detail, summary = await reconcile_positions(user_data_manager, positions, trade_date)
+                by_user = dict(tuple(detail.groupby('user_id')))
+                messages.extend((user_id, format_reconcile_message(by_user[user_id], row))
+                                for user_id, row in zip(summary.index, summary.itertuples()))
+
+            result = await dispatcher.broadcast(messages, priority=Priority.NOTIFICATION)
+            logger.info(f"持仓对账推送完成：成功 {result['sent']} 条，失败 {result['failed']} 条")
+
+    await run_daily('POSITION_CHECK_TIME', '持仓对账', check)
+
+
+def check_alerts(user_data_manager, bars, monitors: dict, warmed: set) -> tuple:
+    """
+    用一批分钟K线检查价格提醒
+
+    首次出现的合约的K线只用于预热布林带和记录最新价，不触发提醒（避免用当日历史K线触发）；
+    新出现的布林带参数组合从下一批K线开始累计，满 period 根后才会触发。
+
+    参数:
+        bars: MinuteBar 列表（按时间排序）
+        monitors: {(period, std): IntradayMonitor}，跨批次复用
+        warmed: 已预热的合约集合，跨批次复用
+
+    返回:
+        tuple: (触发的 Alert 列表, {合约: 最新价})
+    """
+    from bot.alerts import LOWER, UPPER
+    from trading.intraday import IntradayMonitor
+    from trading.signal import SIGNAL_LONG
+
+    for period, std in user_data_manager.get_alert_band_params():
+        if (period, std) not in monitors:
+            monitors[(period, std)] = IntradayMonitor(None, period=period, std=std)
+
+    history = [bar for bar in bars if bar.symbol not in warmed]
+    live = [bar for bar in bars if bar.symbol in warmed]
+    warmed.update(bar.symbol for bar in history)
+
+    triggered, prices = [], {}
+    for bar in history:
+        user_data_manager.update_last_price(bar.symbol, bar.close)
+        prices[bar.symbol] = bar.close
+    for bar in live:
+        triggered.extend(user_data_manager.trigger_price_alerts(bar.symbol, bar.high, bar.low, bar.close))
+        prices[bar.symbol] = bar.close
+
+    for (period, std), monitor in monitors.items():
+        monitor.process(history, emit=False)
+        for event in monitor.process(live):
+            direction = UPPER if event.signal == SIGNAL_LONG else LOWER
+            triggered.extend(user_data_manager.trigger_band_alerts(event.symbol, direction, period, std))
+    return triggered, prices
+
+
+async def alert_watch_task(application, user_data_manager):
+    """盘中轮询有提醒的合约的分钟线并推送触发的提醒（轮询间隔见环境变量 ALERT_POLL_SECONDS）"""
+    from bot.alerts import format_alert_messages
+    from trading.intraday import AkshareMinuteSource
+
+    interval = float(os.getenv('ALERT_POLL_SECONDS', '60'))
+    source = AkshareMinuteSource()
+    monitors, warmed = {}, set()
+
+    while True:
+        try:
+            await asyncio.sleep(interval)
+
+            dispatcher = application.bot_data.get('dispatcher')
+            await user_data_manager.sync_alerts()
+            symbols = user_data_manager.get_alert_symbols()
+            if dispatcher is None or not symbols:
+                continue
+
+            with log_context(job_id='alert_watch'):
+                bars = await asyncio.to_thread(source.poll, sorted(symbols))
+                triggered, prices = check_alerts(user_data_manager, bars, monitors, warmed)
+                if triggered:
+                    await user_data_manager.forget_triggered(triggered)
+                    messages = format_alert_messages(triggered, prices)
+                    result = await dispatcher.broadcast(messages, priority=Priority.NOTIFICATION)
+                    logger.info(f"价格提醒：触发 {len(triggered)} 个，发送 {result['sent']} 条")
+
+        except Exception as e:
+            logger.error(f"价格提醒任务出错: {e}")
+
+
+async def signal_push_task(application, user_data_manager):
+    """每日定时推送信号（需在环境变量 SIGNAL_PUSH_TIME 中配置 HH:MM）"""
+    async def push(trade_date: str):
+        dispatcher = application.bot_data.get('dispatcher')
+        if dispatcher is None:
+            return
+
+        # 新的一天行情已更新，使缓存的信号与图表失效
+        get_signal_service().invalidate()
+        with log_context(job_id=f"signal_push:{trade_date}"):
+            result = await broadcast_signals(dispatcher, user_data_manager)
+            logger.info(f"每日信号推送完成：成功 {result['sent']} 条，失败 {result['failed']} 条")
+
+    await run_daily('SIGNAL_PUSH_TIME', '每日信号推送', push)
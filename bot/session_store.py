@@ -0,0 +1,389 @@
+"""
+用户会话存储
+
+SessionStore 定义会话的读写接口：load 返回 (会话, 版本号)，save 只有在存储中的版本号仍等于读取时的
+版本号时才写入（乐观锁），否则抛出 VersionConflict，由调用方重新读取后重试。
+
+MemorySessionStore 用于单进程运行；RedisSessionStore 通过 Redis（redis-py）在多个 Bot 工作进程之间
+共享会话，用 WATCH / MULTI / EXEC 实现版本检查。环境变量 SESSION_STORE_URL 为 redis://host:port/db 时
+使用 Redis，否则使用内存存储。
+
+凭据字段（CFMMC 用户名和密码）不以明文写入共享存储：RedisSessionStore 用环境变量 SESSION_SECRET_KEY
+作为密钥以 AES-GCM 加密后保存，未设置密钥时拒绝创建。
+
+提醒变更记录：修改了价格提醒的写入（以及删除会话）使存储中的提醒版本号加一，并记下该用户的最新变更版本。
+各进程的提醒索引用 alert_changes 只重新加载版本号之后有变更的用户，不需要每次读取全部会话。
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from bot.alerts import Alert
+
+SESSION_FIELDS = ['user_id', 'state', 'net_asset', 'signal_date', 'use_custom_bollinger', 'bollinger_period',
+                  'bollinger_std', 'use_custom_cfmmc', 'cfmmc_username', 'cfmmc_password']
+DATETIME_FIELDS = ['created_at', 'last_activity']
+CREDENTIAL_FIELDS = ['cfmmc_username', 'cfmmc_password']
+
+logger = logging.getLogger(__name__)
+
+
+class VersionConflict(Exception):
+    """会话在读取之后已被其他进程修改"""
+    pass
+
+
+def session_to_dict(session) -> dict:
+    """UserSession 转为可 JSON 序列化的字典"""
+    data = {name: getattr(session, name) for name in SESSION_FIELDS}
+    for name in DATETIME_FIELDS:
+        data[name] = getattr(session, name).isoformat()
+    data['alerts'] = [list(alert) for alert in session.alerts.values()]
+    return data
+
+
+def session_from_dict(data: dict):
+    """由 session_to_dict 的结果恢复 UserSession"""
+    from bot.handlers import UserSession
+
+    session = UserSession(data['user_id'])
+    for name in SESSION_FIELDS:
+        setattr(session, name, data.get(name, getattr(session, name)))
+    for name in DATETIME_FIELDS:
+        if data.get(name):
+            setattr(session, name, datetime.fromisoformat(data[name]))
+    session.alerts = {alert.alert_id: alert for alert in (Alert(*fields) for fields in data.get('alerts', []))}
+    return session
+
+
+class CredentialCipher:
+    """
+    凭据字段的加密（cryptography 的 AES-256-GCM）
+
+    密钥为 SESSION_SECRET_KEY：32 字节随机数的 URL 安全 base64 编码。每个字段使用随机的 96 位 nonce，
+    并以 "用户ID:字段名" 作为附加认证数据，密文不能挪到其他用户或字段。
+    密文格式为 enc:v1:<base64(nonce + 密文)>。
+    """
+
+    PREFIX = 'enc:v1:'
+    NONCE_SIZE = 12
+
+    def __init__(self, secret_key: str):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        try:
+            key = base64.urlsafe_b64decode(secret_key or '')
+        except (binascii.Error, ValueError):
+            key = b''
+        if len(key) != 32:
+            raise ValueError("SESSION_SECRET_KEY 必须是 32 字节随机数的 URL 安全 base64 编码")
+        self._aead = AESGCM(key)
+
+    def encrypt(self, text: str, context: str) -> str:
+        """
+        加密一个字段
+
+        参数:
+            text: 明文
+            context: 附加认证数据（用户ID与字段名），解密时必须一致
+        """
+        nonce = os.urandom(self.NONCE_SIZE)
+        body = self._aead.encrypt(nonce, text.encode(), context.encode())
+        return self.PREFIX + base64.urlsafe_b64encode(nonce + body).decode()
+
+    def decrypt(self, token: str, context: str) -> str:
+        """
+        解密 encrypt 的结果
+
+        异常:
+            ValueError: 格式错误、密钥不一致或密文被篡改
+        """
+        from cryptography.exceptions import InvalidTag
+
+        if not token.startswith(self.PREFIX):
+            raise ValueError("不是加密的凭据")
+        try:
+            raw = base64.urlsafe_b64decode(token[len(self.PREFIX):])
+        except (binascii.Error, ValueError):
+            raise ValueError("加密凭据格式错误") from None
+        try:
+            return self._aead.decrypt(raw[:self.NONCE_SIZE], raw[self.NONCE_SIZE:], context.encode()).decode()
+        except InvalidTag:
+            raise ValueError("凭据认证失败（密钥不一致或数据被篡改）") from None
+
+
+class SessionStore(ABC):
+    """会话存储接口"""
+
+    # 是否可能被其他进程修改（为 True 时，进程内的派生索引需要定期从存储重建）
+    shared = False
+
+    @abstractmethod
+    def load(self, user_id):
+        """
+        读取会话
+
+        返回:
+            tuple: (UserSession, 版本号)；不存在时返回 (None, 0)
+        """
+
+    @abstractmethod
+    def save(self, session, version: int, alerts_changed: bool = False) -> int:
+        """
+        写入会话（版本号为0表示新建或覆盖不存在的会话）
+
+        参数:
+            alerts_changed: 本次写入修改了价格提醒，记录为提醒变更
+
+        返回:
+            int: 写入后的版本号
+
+        异常:
+            VersionConflict: 存储中的版本号与 version 不一致
+        """
+
+    @abstractmethod
+    def delete(self, user_id):
+        """删除会话（记录为提醒变更）"""
+
+    @abstractmethod
+    def alert_changes(self, since):
+        """
+        提醒版本号 since 之后提醒有变更的用户
+
+        参数:
+            since: 上次读取到的提醒版本号，None 表示首次读取
+
+        返回:
+            tuple: (当前提醒版本号, 用户ID列表)；since 为 None 或存储已被清空（版本号回退）时用户ID列表为None，
+                   调用方应从全部会话重建索引
+        """
+
+    @abstractmethod
+    def user_ids(self) -> list:
+        """全部用户ID"""
+
+    def sessions(self):
+        """遍历全部会话"""
+        for user_id in self.user_ids():
+            session, _ = self.load(user_id)
+            if session is not None:
+                yield session
+
+    @abstractmethod
+    def next_id(self, name: str) -> int:
+        """分配一个跨进程唯一的递增编号"""
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储：保存序列化后的会话，读取时返回新对象，与 Redis 存储的语义一致"""
+
+    def __init__(self):
+        self._records = {}
+        self._counters = {}
+        self._alert_revision = 0
+        self._alert_changes = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        record = self._records.get(user_id)
+        if record is None:
+            return None, 0
+        data, version = record
+        return session_from_dict(data), version
+
+    def save(self, session, version: int, alerts_changed: bool = False) -> int:
+        data = session_to_dict(session)
+        with self._lock:
+            current = self._records.get(session.user_id, (None, 0))[1]
+            if current != version:
+                raise VersionConflict(f"用户 {session.user_id} 的会话已被修改（{version} -> {current}）")
+            self._records[session.user_id] = (data, version + 1)
+            if alerts_changed:
+                self._record_alert_change(session.user_id)
+        return version + 1
+
+    def delete(self, user_id):
+        with self._lock:
+            self._records.pop(user_id, None)
+            self._record_alert_change(user_id)
+
+    def _record_alert_change(self, user_id):
+        self._alert_revision += 1
+        self._alert_changes[user_id] = self._alert_revision
+
+    def alert_changes(self, since):
+        with self._lock:
+            if since is None or since > self._alert_revision:
+                return self._alert_revision, None
+            return self._alert_revision, [user_id for user_id, revision in self._alert_changes.items()
+                                          if revision > since]
+
+    def user_ids(self) -> list:
+        return list(self._records)
+
+    def next_id(self, name: str) -> int:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis 会话存储（redis-py）
+
+    会话保存在 {prefix}session:{user_id}（JSON，含版本号），全部用户ID保存在集合 {prefix}users 中。
+    提醒版本号保存在 {prefix}alerts:revision，各用户的最新提醒变更版本保存在有序集合 {prefix}alerts:changed。
+    提醒变更的事务同时 WATCH 版本号，因此变更按版本号顺序提交，读取方不会漏掉较小版本号的变更。
+    事务使用 pipeline 的 WATCH / MULTI / EXEC，pipeline 退出时连接复位，不会残留 WATCH 或 MULTI 状态。
+    客户端不自动重试：超时的命令可能已经在服务器上执行，INCR 等非幂等命令不能重发；只读命令在连接出错时
+    重试一次。凭据字段用 secret_key 加密后保存。
+    """
+
+    shared = True
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/0', prefix: str = 'tgbot:', secret_key: str = None):
+        """
+        参数:
+            url: redis://[:password@]host:port/db
+            prefix: 键名前缀
+            secret_key: 加密凭据字段的密钥，见 CredentialCipher
+
+        异常:
+            ValueError: 未提供密钥或密钥格式错误
+        """
+        import redis
+        from redis.backoff import NoBackoff
+        from redis.retry import Retry
+
+        self._cipher = CredentialCipher(secret_key)
+        self._redis = redis
+        # RESP2 兼容 Redis 6 之前的服务器与本地模拟服务器（bot.fake_redis）
+        self._client = redis.Redis.from_url(url, protocol=2, socket_timeout=5.0, socket_connect_timeout=5.0,
+                                            retry=Retry(NoBackoff(), 0))
+        self.prefix = prefix
+
+    def _read(self, command: str, *args, **kwargs):
+        """执行只读命令，连接出错时重试一次"""
+        try:
+            return getattr(self._client, command)(*args, **kwargs)
+        except (self._redis.ConnectionError, self._redis.TimeoutError):
+            return getattr(self._client, command)(*args, **kwargs)
+
+    def _key(self, user_id) -> str:
+        return f"{self.prefix}session:{user_id}"
+
+    @staticmethod
+    def _decode(raw):
+        if raw is None:
+            return None, 0
+        record = json.loads(raw)
+        return record['session'], record['version']
+
+    def _seal(self, data: dict) -> dict:
+        """加密凭据字段"""
+        for name in CREDENTIAL_FIELDS:
+            if data.get(name) is not None:
+                data[name] = self._cipher.encrypt(str(data[name]), f"{data['user_id']}:{name}")
+        return data
+
+    def _unseal(self, data: dict) -> dict:
+        """解密凭据字段；无法解密（例如更换了密钥）时丢弃，由用户重新设置"""
+        for name in CREDENTIAL_FIELDS:
+            value = data.get(name)
+            if value is None:
+                continue
+            try:
+                data[name] = self._cipher.decrypt(str(value), f"{data['user_id']}:{name}")
+            except ValueError as e:
+                logger.warning(f"用户 {data['user_id']} 的 {name} 无法解密，已忽略: {e}")
+                data[name] = None
+        return data
+
+    def load(self, user_id):
+        data, version = self._decode(self._read('get', self._key(user_id)))
+        return (session_from_dict(self._unseal(data)) if data else None), version
+
+    def save(self, session, version: int, alerts_changed: bool = False) -> int:
+        key = self._key(session.user_id)
+        payload = json.dumps({'version': version + 1, 'session': self._seal(session_to_dict(session))},
+                             ensure_ascii=False)
+        with self._client.pipeline() as pipe:
+            pipe.watch(*((key, self._alert_revision_key) if alerts_changed else (key,)))
+            _, current = self._decode(pipe.get(key))
+            if current != version:
+                raise VersionConflict(f"用户 {session.user_id} 的会话已被修改（{version} -> {current}）")
+            revision = self._read_alert_revision(pipe) + 1 if alerts_changed else None
+            pipe.multi()
+            pipe.set(key, payload)
+            pipe.sadd(f"{self.prefix}users", session.user_id)
+            if revision is not None:
+                self._queue_alert_change(pipe, session.user_id, revision)
+            try:
+                pipe.execute()
+            except self._redis.WatchError:
+                raise VersionConflict(f"用户 {session.user_id} 的会话在写入时被修改") from None
+        return version + 1
+
+    def delete(self, user_id):
+        # 只与其他提醒变更竞争版本号，冲突时立即重试
+        with self._client.pipeline() as pipe:
+            while True:
+                pipe.watch(self._alert_revision_key)
+                revision = self._read_alert_revision(pipe) + 1
+                pipe.multi()
+                pipe.delete(self._key(user_id))
+                pipe.srem(f"{self.prefix}users", user_id)
+                self._queue_alert_change(pipe, user_id, revision)
+                try:
+                    pipe.execute()
+                    return
+                except self._redis.WatchError:
+                    continue
+
+    @property
+    def _alert_revision_key(self) -> str:
+        return f"{self.prefix}alerts:revision"
+
+    def _read_alert_revision(self, pipe) -> int:
+        return int(pipe.get(self._alert_revision_key) or 0)
+
+    def _queue_alert_change(self, pipe, user_id, revision: int):
+        pipe.set(self._alert_revision_key, revision)
+        pipe.zadd(f"{self.prefix}alerts:changed", {user_id: revision})
+
+    def alert_changes(self, since):
+        revision = int(self._read('get', self._alert_revision_key) or 0)
+        if since is None or since > revision:
+            return revision, None
+        if revision == since:
+            return revision, []
+        reply = self._read('zrangebyscore', f"{self.prefix}alerts:changed", f"({since}", '+inf', withscores=True)
+        users = [int(member) for member, _ in reply]
+        # 读取版本号之后提交的变更也可能出现在结果中，版本号取两者较大者
+        return max([revision] + [int(score) for _, score in reply]), users
+
+    def user_ids(self) -> list:
+        return [int(member) for member in self._read('smembers', f"{self.prefix}users")]
+
+    def next_id(self, name: str) -> int:
+        # 非幂等命令：出错时不重发（超时的 INCR 可能已经执行），由调用方处理
+        return self._client.incr(f"{self.prefix}counter:{name}")
+
+
+def create_session_store(url: str = None) -> SessionStore:
+    """
+    按 SESSION_STORE_URL（redis://host:port/db）创建会话存储，未设置时使用内存存储
+
+    异常:
+        ValueError: 使用 Redis 存储但未设置 SESSION_SECRET_KEY（或格式错误）
+    """
+    url = url if url is not None else os.getenv('SESSION_STORE_URL', '')
+    if url.startswith('redis://'):
+        return RedisSessionStore(url, secret_key=os.getenv('SESSION_SECRET_KEY'))
+    return MemorySessionStore()
@@ -0,0 +1,144 @@
+"""
+按用户ID分片的 Bot 工作进程
+
+主进程负责拉取更新（Telegram 只允许一个 getUpdates 消费者）和定时任务，收到的更新按
+user_id % 工作进程数 转发到对应工作进程的队列；工作进程按顺序处理自己分片内的更新，
+同一用户的消息总是由同一个进程依次处理，会话状态通过共享的 SessionStore（Redis）读写。
+
+工作进程数由环境变量 BOT_WORKERS 指定（默认1，即不分片）；分片要求 SESSION_STORE_URL 指向 Redis。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)
+
+# 主进程检查工作进程存活的间隔（秒）
+SUPERVISE_INTERVAL = 5.0
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """用户所属的分片"""
+    return user_id % shards
+
+
+def _shard_main(shard: int, shards: int, inbox, token: str, base_url: str = None):
+    """工作进程入口：处理本分片的更新直到收到 None"""
+    from dotenv import load_dotenv
+
+    from bot.logging_setup import log_context, setup_logging
+
+    load_dotenv()
+    setup_logging()
+    with log_context(job_id=f"shard-{shard}"):
+        asyncio.run(_serve_shard(shard, shards, inbox, token, base_url))
+
+
+async def _serve_shard(shard: int, shards: int, inbox, token: str, base_url: str = None):
+    from telegram import Update
+
+    from bot.dispatcher import create_dispatcher
+    from bot.main import build_application
+
+    application = build_application(token, base_url=base_url, updater=False)
+    await application.initialize()
+
+    # 全局发送速率在各工作进程与主进程之间平分
+    dispatcher = create_dispatcher(application.bot, senders=shards + 1)
+    dispatcher.start()
+    application.bot_data['dispatcher'] = dispatcher
+    await application.start()
+    logger.info(f"分片 {shard}/{shards} 已启动 (pid {os.getpid()})")
+
+    try:
+        while True:
+            data = await asyncio.to_thread(inbox.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        await dispatcher.stop()
+        await application.shutdown()
+
+
+class ShardRouter:
+    """
+    主进程中的更新路由：启动并监督分片工作进程，把更新转发到用户所在的分片
+
+    参数:
+        shards: 工作进程数
+        token: Bot Token
+        base_url: Bot API 地址（默认官方地址）
+    """
+
+    def __init__(self, shards: int, token: str, base_url: str = None):
+        self.shards = shards
+        self._token = token
+        self._base_url = base_url
+        self._context = multiprocessing.get_context('spawn')
+        self._inboxes = [self._context.Queue() for _ in range(shards)]
+        self._processes = [None] * shards
+        self.restarts = 0
+        self.routed = [0] * shards
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    def _spawn(self, shard: int):
+        process = self._context.Process(
+            target=_shard_main, name=f'bot-shard-{shard}', daemon=True,
+            args=(shard, self.shards, self._inboxes[shard], self._token, self._base_url))
+        process.start()
+        self._processes[shard] = process
+
+    def stop(self, timeout: float = 10.0):
+        """通知各工作进程处理完已转发的更新后退出"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+    async def route(self, update, context):
+        """
+        转发更新（注册为最先执行的处理器）；没有用户的更新留在主进程处理
+
+        工作进程退出期间转发的更新保留在队列中，由重启后的进程继续处理。
+        """
+        from telegram.ext import ApplicationHandlerStop
+
+        user = update.effective_user
+        if user is None:
+            return
+        shard = shard_for(user.id, self.shards)
+        self._inboxes[shard].put(update.to_dict())
+        self.routed[shard] += 1
+        raise ApplicationHandlerStop
+
+    async def supervise(self):
+        """定期检查工作进程，退出的进程自动重启"""
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for shard, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.warning(f"分片 {shard} 工作进程退出（退出码 {process.exitcode}），重启")
+                    self._spawn(shard)
+                    self.restarts += 1
+
+
+def create_router(token: str, base_url: str = None):
+    """
+    按环境变量 BOT_WORKERS 创建分片路由；不分片或未配置共享会话存储时返回None
+    """
+    shards = int(os.getenv('BOT_WORKERS', '1'))
+    if shards <= 1:
+        return None
+    if not os.getenv('SESSION_STORE_URL', '').startswith('redis://'):
+        logger.error("BOT_WORKERS > 1 需要设置 SESSION_STORE_URL=redis://...，以单进程运行")
+        return None
+    return ShardRouter(shards, token, base_url)
@@ -0,0 +1,48 @@
+import sys
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 启动阶段不应被导入的重型依赖
+HEAVY_MODULES = ('pandas', 'akshare', 'DrissionPage', 'ddddocr', 'matplotlib')
+
+
+class StartupTimer:
+    """启动耗时记录器 - 记录各启动阶段的时间点并生成报告"""
+
+    def __init__(self):
+        self._marks = [('进程启动', time.perf_counter())]
+
+    def mark(self, phase: str):
+        """记录一个启动阶段完成的时间点"""
+        self._marks.append((phase, time.perf_counter()))
+
+    def elapsed(self) -> float:
+        """从进程启动到现在经过的秒数"""
+        return time.perf_counter() - self._marks[0][1]
+
+    def report(self) -> str:
+        """生成各阶段耗时报告"""
+        lines = []
+        for (_, prev_time), (phase, mark_time) in zip(self._marks, self._marks[1:]):
+            lines.append(f"  {phase}: {(mark_time - prev_time) * 1000:.0f}ms")
+        lines.append(f"  合计: {(self._marks[-1][1] - self._marks[0][1]) * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    @staticmethod
+    def loaded_heavy_modules():
+        """返回启动期间已被导入的重型依赖"""
+        return [name for name in HEAVY_MODULES if name in sys.modules]
+
+    def log_report(self):
+        """输出启动耗时报告，并检查是否有重型依赖被提前导入"""
+        logger.info("启动耗时报告：\n%s", self.report())
+
+        heavy = self.loaded_heavy_modules()
+        if heavy:
+            logger.warning(f"启动阶段已导入重型依赖：{', '.join(heavy)}，请改为首次使用时导入")
+
+
+# 全局启动计时器（在入口处最先导入）
+startup_timer = StartupTimer()
@@ -0,0 +1,5 @@
+from bot.main import main
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,22 @@
+from __future__ import annotations
+
 import asyncio
+import io
+import os
+import threading
 import time
 import tempfile
 import logging
-from typing import Optional, Tuple
-import pandas as pd
-from DrissionPage import Chromium, ChromiumOptions
-import ddddocr
+import uuid
+from collections import namedtuple
+from typing import List, Optional, Tuple, TYPE_CHECKING
 from pathlib import Path
 
+# pandas / DrissionPage / ddddocr 均为重型依赖，在首次使用时才导入
+if TYPE_CHECKING:
+    import pandas as pd
+    from DrissionPage import Chromium
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,16 +35,84 @@ class CFMMCVerificationCodeError(CFMMCLoginError):
     pass
 
 
+def parse_position_workbook(source) -> Optional[pd.DataFrame]:
+    """
+    解析 CFMMC 结算单中的持仓明细
+
+    参数:
+        source: 文件路径或二进制文件对象
+
+    返回:
+        pd.DataFrame: 持仓数据（去除全空行），解析失败时返回None
+    """
+    import pandas as pd
+
+    for sheet_name in ('持仓明细', 0):
+        try:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            df = pd.read_excel(source, sheet_name=sheet_name, skiprows=9)
+            return df.dropna(how='all') if not df.empty else pd.DataFrame()
+        except Exception:
+            continue
+    return None
+
+
+def _scratch_dir() -> Path:
+    """浏览器下载回退时使用的目录：优先使用内存文件系统 /dev/shm"""
+    shm = Path('/dev/shm')
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+# 批量爬取任务：key 由调用方指定（如用户ID），用于对应结果
+CrawlJob = namedtuple('CrawlJob', ['key', 'trade_date', 'username', 'password'])
+
+
+class CrawlResult:
+    """单个爬取任务的结果，失败时 data 为 None，error 记录原因"""
+
+    def __init__(self, job: CrawlJob, data=None, error: Exception = None, elapsed: float = 0.0):
+        self.job = job
+        self.data = data
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def key(self):
+        return self.job.key
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.data is not None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'error={self.error!r}'
+        return f"CrawlResult(key={self.job.key!r}, {status}, {self.elapsed:.1f}s)"
+
+
 class CFMMCCrawler:
     """CFMMC持仓信息爬虫类"""
 
     def __init__(self, headless: bool = True):
-        self.ocr = ddddocr.DdddOcr()
+        self._ocr = None
+        self._ocr_lock = threading.Lock()
         self.max_retries = 10
         self.login_timeout = 30
         self.download_timeout = 60
         self.headless = headless
 
+    @property
+    def ocr(self):
+        """验证码识别模型，首次访问时加载"""
+        if self._ocr is None:
+            with self._ocr_lock:
+                if self._ocr is None:
+                    import ddddocr
+                    self._ocr = ddddocr.DdddOcr(show_ad=False)
+        return self._ocr
+
     async def get_position_data(self,
                                 trade_date: str,
                                 username: str,
@@ -57,23 +134,10 @@ class CFMMCCrawler:
             CFMMCLoginError: 其他登录错误
         """
         browser = None
-        temp_dir = None
 
         try:
-            temp_dir = tempfile.mkdtemp()
-            browser = self._create_browser(temp_dir)
-            crawler = browser.latest_tab
-
-            login_success = await self._login_with_retry(crawler, username, password)
-            if not login_success:
-                return None
-
-            file_path = await self._download_position_file(crawler, trade_date, temp_dir)
-            if not file_path:
-                return None
-
-            df = await self._read_position_file(file_path)
-            return df
+            browser = self._create_browser()
+            return await self._crawl_in_tab(browser.latest_tab, trade_date, username, password)
 
         except (CFMMCCredentialsError, CFMMCVerificationCodeError, CFMMCLoginError):
             raise
@@ -88,20 +152,100 @@ class CFMMCCrawler:
                 except Exception as close_error:
                     logger.warning(f"关闭浏览器时出现警告: {close_error}")
 
-            if temp_dir:
-                await self._cleanup_temp_files(temp_dir)
+    async def crawl_batch(self, jobs: List[CrawlJob], max_concurrency: int = 4,
+                          tabs_per_browser: int = 4) -> List[CrawlResult]:
+        """
+        并发爬取多个账户的持仓
+
+        任务在共享浏览器的独立上下文标签页中执行（各自的 Cookie 与下载目录，互不干扰），
+        同时运行的任务数不超过 max_concurrency。单个任务失败（如密码错误）只记录在其结果中，
+        不影响其他任务。
+
+        参数:
+            jobs: CrawlJob 列表
+            max_concurrency: 最大并发任务数
+            tabs_per_browser: 每个浏览器同时承载的标签页数
+
+        返回:
+            List[CrawlResult]: 与 jobs 顺序一致的结果
+        """
+        if not jobs:
+            return []
+
+        concurrency = max(1, min(max_concurrency, len(jobs)))
+        browser_count = -(-concurrency // max(1, tabs_per_browser))
+        semaphore = asyncio.Semaphore(concurrency)
+        browsers = []
+        browser_lock = asyncio.Lock()
+
+        async def get_browser(index: int):
+            # 浏览器按需启动，任务少时不多开
+            async with browser_lock:
+                slot = index % browser_count
+                while len(browsers) <= slot:
+                    browsers.append(await asyncio.to_thread(self._create_browser))
+                return browsers[slot]
+
+        async def run(index: int, job: CrawlJob) -> CrawlResult:
+            async with semaphore:
+                started = time.time()
+                try:
+                    browser = await get_browser(index)
+                    data = await asyncio.to_thread(self._crawl_job_blocking, browser, job)
+                    error = None if data is not None else CFMMCLoginError("未能获取持仓文件")
+                    return CrawlResult(job, data, error, time.time() - started)
+                except Exception as job_error:
+                    logger.warning(f"账户 {job.key} 持仓爬取失败: {job_error}", extra={'job_id': job.key})
+                    return CrawlResult(job, None, job_error, time.time() - started)
 
-    def _create_browser(self, download_dir: str) -> Chromium:
-        """创建浏览器实例"""
         try:
-            if self.headless:
-                co = ChromiumOptions().headless()
-                browser = Chromium(co)
-            else:
-                browser = Chromium()
+            results = await asyncio.gather(*(run(i, job) for i, job in enumerate(jobs)))
+        finally:
+            for browser in browsers:
+                try:
+                    browser.quit()
+                except Exception as close_error:
+                    logger.warning(f"关闭浏览器时出现警告: {close_error}")
+
+        succeeded = sum(result.ok for result in results)
+        logger.info(f"批量爬取完成：{succeeded}/{len(jobs)} 个任务成功，{len(browsers)} 个浏览器")
+        return list(results)
 
-            browser.set.download_path(download_dir)
-            return browser
+    def _crawl_job_blocking(self, browser, job: CrawlJob):
+        """
+        在工作线程中执行单个任务（DrissionPage 调用是阻塞的，每个线程使用自己的事件循环）
+        """
+        tab = browser.new_tab(new_context=True)
+        try:
+            return asyncio.run(self._crawl_in_tab(tab, job.trade_date, job.username, job.password))
+        finally:
+            try:
+                tab.close()
+            except Exception as close_error:
+                logger.warning(f"关闭标签页时出现警告: {close_error}")
+
+    async def _crawl_in_tab(self, crawler, trade_date: str, username: str,
+                            password: str) -> Optional[pd.DataFrame]:
+        """在给定标签页中登录、下载结算单并在内存中解析"""
+        login_success = await self._login_with_retry(crawler, username, password)
+        if not login_success:
+            return None
+
+        content = await self._download_statement(crawler, trade_date)
+        if not content:
+            return None
+
+        return parse_position_workbook(io.BytesIO(content))
+
+    def _create_browser(self) -> Chromium:
+        """创建浏览器实例（自动分配端口与用户目录，多个实例可同时运行）"""
+        try:
+            from DrissionPage import Chromium, ChromiumOptions
+
+            co = ChromiumOptions().auto_port()
+            if self.headless:
+                co.headless()
+            return Chromium(co)
 
         except Exception as browser_error:
             raise CFMMCLoginError(f"浏览器启动失败: {browser_error}")
@@ -263,8 +407,13 @@ class CFMMCCrawler:
         except Exception:
             return False, 'unknown_error'
 
-    async def _download_position_file(self, crawler, trade_date: str, download_dir: str) -> Optional[str]:
-        """下载持仓文件"""
+    async def _download_statement(self, crawler, trade_date: str) -> Optional[bytes]:
+        """
+        查询指定日期并下载结算单，返回文件内容
+
+        优先用浏览器会话的 Cookie 直接请求下载链接，文件只存在于内存；
+        失败时由浏览器下载到 tmpfs 中唯一命名的文件，读入后立即删除。
+        """
         try:
             date_input = crawler.ele('@name=tradeDate')
             if not date_input:
@@ -282,74 +431,70 @@ class CFMMCCrawler:
             if not download_btn:
                 return None
 
-            download_btn.click()
-
-            file_path = await self._wait_for_download(download_dir)
-            return file_path
+            content = await self._fetch_with_session(crawler, download_btn)
+            if content:
+                return content
+            return await self._download_via_browser(download_btn)
 
-        except Exception:
+        except Exception as download_error:
+            logger.warning(f"下载结算单失败: {download_error}")
             return None
 
-    async def _wait_for_download(self, download_dir: str) -> Optional[str]:
-        """等待文件下载完成"""
-        start_time = time.time()
+    async def _fetch_with_session(self, crawler, download_btn) -> Optional[bytes]:
+        """携带浏览器 Cookie 直接请求下载链接"""
+        from scrape.cfmmc_http import download_with_cookies
 
-        while time.time() - start_time < self.download_timeout:
-            try:
-                download_path = Path(download_dir)
-                files = list(download_path.glob("*.xls*"))
-                actual_files = [f for f in files if not f.name.endswith('.crdownload')]
-
-                if actual_files:
-                    return str(actual_files[0])
-
-                await asyncio.sleep(1)
+        url = download_btn.link or download_btn.attr('href')
+        if not url or not url.startswith('http'):
+            return None
+        try:
+            return await asyncio.to_thread(download_with_cookies, url, crawler.cookies().as_dict(),
+                                           crawler.user_agent, self.download_timeout)
+        except Exception as fetch_error:
+            logger.info(f"直接下载结算单失败，改用浏览器下载: {fetch_error}")
+            return None
 
-            except Exception:
-                await asyncio.sleep(1)
+    async def _download_via_browser(self, download_btn) -> Optional[bytes]:
+        """由浏览器下载到 tmpfs 中的唯一文件名，读入内存后删除"""
+        name = f"cfmmc_{uuid.uuid4().hex}"
+        mission = download_btn.click.to_download(save_path=str(_scratch_dir()), rename=name,
+                                                 timeout=self.download_timeout)
+        if not mission:
+            return None
 
-        return None
+        file_path = await asyncio.to_thread(mission.wait, False, self.download_timeout)
+        if not file_path:
+            return None
 
-    async def _read_position_file(self, file_path: str) -> Optional[pd.DataFrame]:
-        """读取持仓文件为DataFrame"""
+        path = Path(file_path)
         try:
-            df = pd.read_excel(file_path, sheet_name='持仓明细', skiprows=9)
-
-            if df.empty:
-                return pd.DataFrame()
+            return path.read_bytes()
+        finally:
+            path.unlink(missing_ok=True)
 
-            df = await self._process_position_data(df)
-            return df
 
-        except Exception:
-            try:
-                df = pd.read_excel(file_path, skiprows=9)
-                df = await self._process_position_data(df)
-                return df
-            except Exception:
-                return None
+# 创建全局爬虫实例（构造时不加载模型，不启动浏览器）
+cfmmc_crawler = CFMMCCrawler()
 
-    @staticmethod
-    async def _process_position_data(df: pd.DataFrame) -> pd.DataFrame:
-        """处理持仓数据"""
-        try:
-            df = df.dropna(how='all')
-            return df
-        except Exception:
-            return df
 
-    @staticmethod
-    async def _cleanup_temp_files(temp_dir: str):
-        """清理临时文件"""
-        try:
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        except Exception:
-            pass
+def get_direct_client():
+    """
+    按环境变量 CFMMC_CLIENT 选择在当前进程中执行的持仓查询实现：browser（默认，DrissionPage）或 http（纯 HTTP 客户端）
+    """
+    if os.getenv('CFMMC_CLIENT', 'browser').lower() == 'http':
+        from scrape.cfmmc_http import cfmmc_http_client
+        return cfmmc_http_client
+    return cfmmc_crawler
 
 
-# 创建全局爬虫实例
-cfmmc_crawler = CFMMCCrawler()
+def get_position_client():
+    """
+    获取持仓查询实现：环境变量 CRAWL_WORKERS 大于0（默认2）时在工作进程池中执行，为0时在当前进程中执行
+    """
+    if int(os.getenv('CRAWL_WORKERS', '2')) > 0:
+        from scrape.crawl_pool import crawl_pool
+        return crawl_pool
+    return get_direct_client()
 
 
 async def get_user_position_data(trade_date: str,
@@ -366,4 +511,18 @@ async def get_user_position_data(trade_date: str,
     返回:
         pd.DataFrame: 持仓数据，失败时返回None
     """
-    return await cfmmc_crawler.get_position_data(trade_date, username, password)
\ No newline at end of file
+    return await get_position_client().get_position_data(trade_date, username, password)
+
+
+async def get_positions_batch(jobs: List[CrawlJob], max_concurrency: int = 4) -> List[CrawlResult]:
+    """
+    批量获取多个账户持仓的便捷函数
+
+    参数:
+        jobs: CrawlJob 列表，trade_date 格式YYYY-MM-DD
+        max_concurrency: 最大并发任务数
+
+    返回:
+        List[CrawlResult]: 与 jobs 顺序一致的结果
+    """
+    return await get_position_client().crawl_batch(jobs, max_concurrency)
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import os
+import time
+from typing import List, Optional, TYPE_CHECKING
+
+from scrape.cfmmc_crawler import (CFMMCCredentialsError, CFMMCLoginError, CFMMCVerificationCodeError,
+                                  CrawlJob, CrawlResult, cfmmc_crawler, parse_position_workbook)
+
+# requests / bs4 / pandas 在首次使用时才导入
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://investorservice.cfmmc.com'
+LOGIN_PATH = '/login.do'
+CAPTCHA_PATH = '/veriCode.do'
+PARAMETER_PATH = '/customer/setParameter.do'
+DOWNLOAD_PATH = '/customer/setupViewCustomerDetailFromCompanyWithExcel.do'
+LOGOUT_PATH = '/logout.do'
+
+# Struts 表单防重复提交令牌
+TOKEN_FIELD = 'org.apache.struts.taglib.html.TOKEN'
+
+# 结算单下载上限，防止异常响应占满内存
+MAX_DOWNLOAD_BYTES = 20 * 2 ** 20
+DOWNLOAD_CHUNK_SIZE = 64 * 2 ** 10
+
+CREDENTIALS_ERRORS = ["用户名或密码错误"]
+VERIFICATION_ERRORS = ["Invalid Verification Code", "验证码错误", "验证码不正确"]
+
+
+class CFMMCHttpClient:
+    """
+    CFMMC 持仓查询的纯 HTTP 客户端（不启动浏览器）
+
+    与 CFMMCCrawler 提供相同的 get_position_data / crawl_batch 接口：用 requests.Session 保持 Cookie，
+    直接下载登录页与验证码图片，提交表单后流式下载结算单并在内存中解析。
+    """
+
+    def __init__(self, base_url: str = None, timeout: float = 15.0, max_retries: int = 10,
+                 captcha_solver=None):
+        self.base_url = (base_url or os.getenv('CFMMC_BASE_URL') or DEFAULT_BASE_URL).rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        # 默认与浏览器爬虫共用同一个验证码识别模型
+        self._captcha_solver = captcha_solver
+
+    def _solve_captcha(self, image: bytes) -> str:
+        if self._captcha_solver is not None:
+            return self._captcha_solver(image)
+        return cfmmc_crawler.ocr.classification(image)
+
+    async def get_position_data(self,
+                                trade_date: str,
+                                username: str,
+                                password: str) -> Optional[pd.DataFrame]:
+        """
+        获取指定日期的持仓数据（在线程中执行阻塞的 HTTP 请求）
+
+        参数:
+            trade_date: 交易日期，格式YYYY-MM-DD
+            username: CFMMC用户名
+            password: CFMMC密码
+
+        返回:
+            pd.DataFrame: 持仓数据，失败时返回None
+
+        抛出异常:
+            CFMMCCredentialsError: 用户名密码错误
+            CFMMCVerificationCodeError: 验证码错误
+            CFMMCLoginError: 其他登录错误
+        """
+        return await asyncio.to_thread(self.fetch_positions, trade_date, username, password)
+
+    def fetch_positions(self, trade_date: str, username: str, password: str) -> Optional[pd.DataFrame]:
+        """get_position_data 的同步版本"""
+        import requests
+
+        with requests.Session() as session:
+            try:
+                page = self._login(session, username, password)
+                content = self._download_statement(session, page, trade_date)
+                if content is None:
+                    return None
+                return parse_position_workbook(io.BytesIO(content))
+
+            except (CFMMCCredentialsError, CFMMCVerificationCodeError, CFMMCLoginError):
+                raise
+            except Exception as client_error:
+                logger.error(f"获取持仓数据时出现异常: {client_error}")
+                return None
+
+            finally:
+                try:
+                    session.get(self.base_url + LOGOUT_PATH, timeout=self.timeout)
+                except Exception:
+                    pass
+
+    # ========== 登录 ==========
+
+    def _login(self, session: requests.Session, username: str, password: str) -> str:
+        """带重试的登录流程，成功时返回登录后的页面"""
+        verification_failed = False
+        for attempt in range(self.max_retries):
+            try:
+                login_page = session.get(self.base_url + LOGIN_PATH, timeout=self.timeout)
+                login_page.raise_for_status()
+                token = _form_token(login_page.text)
+
+                captcha = session.get(self.base_url + CAPTCHA_PATH,
+                                      params={'t': int(time.time() * 1000)}, timeout=self.timeout)
+                captcha.raise_for_status()
+                code = (self._solve_captcha(captcha.content) or '').strip()
+                if not code:
+                    verification_failed = True
+                    continue
+
+                response = session.post(self.base_url + LOGIN_PATH, timeout=self.timeout, data={
+                    TOKEN_FIELD: token,
+                    'showSaveCookies': '',
+                    'userID': username,
+                    'password': password,
+                    'vericode': code,
+                })
+                response.raise_for_status()
+                page = response.text
+
+                if any(error in page for error in CREDENTIALS_ERRORS):
+                    raise CFMMCCredentialsError("用户名或密码错误")
+                if any(error in page for error in VERIFICATION_ERRORS):
+                    verification_failed = True
+                    continue
+                if _is_logged_in(page):
+                    return page
+                verification_failed = False
+
+            except CFMMCCredentialsError:
+                raise
+            except Exception as login_error:
+                if attempt >= self.max_retries - 1:
+                    raise CFMMCLoginError(f"登录过程出现异常: {login_error}")
+                time.sleep(1)
+
+        if verification_failed:
+            raise CFMMCVerificationCodeError("验证码识别失败，重试次数已达上限")
+        raise CFMMCLoginError("登录失败，已达到最大重试次数")
+
+    # ========== 下载 ==========
+
+    def _download_statement(self, session: requests.Session, page: str, trade_date: str) -> Optional[bytes]:
+        """提交查询日期并流式下载结算单，返回文件内容"""
+        response = session.post(self.base_url + PARAMETER_PATH, timeout=self.timeout, data={
+            TOKEN_FIELD: _form_token(page),
+            'tradeDate': trade_date,
+            'byType': 'trade',
+        })
+        response.raise_for_status()
+
+        with session.get(self.base_url + DOWNLOAD_PATH, stream=True, timeout=self.timeout) as download:
+            return read_statement(download)
+
+    # ========== 批量 ==========
+
+    async def crawl_batch(self, jobs: List[CrawlJob], max_concurrency: int = 8) -> List[CrawlResult]:
+        """
+        并发获取多个账户的持仓，单个任务失败不影响其他任务
+
+        返回:
+            List[CrawlResult]: 与 jobs 顺序一致的结果
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(job: CrawlJob) -> CrawlResult:
+            async with semaphore:
+                started = time.time()
+                try:
+                    data = await self.get_position_data(job.trade_date, job.username, job.password)
+                    error = None if data is not None else CFMMCLoginError("未能获取持仓文件")
+                    return CrawlResult(job, data, error, time.time() - started)
+                except Exception as job_error:
+                    logger.warning(f"账户 {job.key} 持仓获取失败: {job_error}", extra={'job_id': job.key})
+                    return CrawlResult(job, None, job_error, time.time() - started)
+
+        results = await asyncio.gather(*(run(job) for job in jobs))
+        logger.info(f"批量获取完成：{sum(result.ok for result in results)}/{len(jobs)} 个任务成功")
+        return list(results)
+
+
+def read_statement(response) -> Optional[bytes]:
+    """
+    将结算单响应流式读入内存
+
+    返回:
+        bytes: 文件内容；响应是网页（未登录或无数据）时返回None
+
+    异常:
+        ValueError: 文件超过 MAX_DOWNLOAD_BYTES
+    """
+    response.raise_for_status()
+    if 'html' in response.headers.get('Content-Type', ''):
+        return None
+
+    buffer = io.BytesIO()
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        buffer.write(chunk)
+        if buffer.tell() > MAX_DOWNLOAD_BYTES:
+            raise ValueError("结算单大小超过上限")
+    return buffer.getvalue()
+
+
+def download_with_cookies(url: str, cookies: dict, user_agent: str = None,
+                          timeout: float = 15.0) -> Optional[bytes]:
+    """使用浏览器会话的 Cookie 直接下载结算单到内存"""
+    import requests
+
+    headers = {'User-Agent': user_agent} if user_agent else {}
+    with requests.get(url, cookies=cookies, headers=headers, stream=True, timeout=timeout) as response:
+        return read_statement(response)
+
+
+def _form_token(html: str) -> str:
+    """读取页面表单中的防重复提交令牌，没有时返回空字符串"""
+    from bs4 import BeautifulSoup
+
+    field = BeautifulSoup(html, 'html.parser').find('input', attrs={'name': TOKEN_FIELD})
+    return field.get('value', '') if field else ''
+
+
+def _is_logged_in(html: str) -> bool:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    return soup.find(attrs={'name': 'logout'}) is not None or soup.find(id='myDownload') is not None
+
+
+# 创建全局 HTTP 客户端实例（不发起任何请求）
+cfmmc_http_client = CFMMCHttpClient()
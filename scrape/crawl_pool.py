@@ -0,0 +1,393 @@
+"""
+持仓爬取工作进程池
+
+浏览器控制、验证码识别与结算单解析都在独立的工作进程中执行，与 Bot 进程只通过进程间队列通信，
+不再与 Telegram 处理器争用 GIL 和内存；浏览器崩溃只会导致对应工作进程退出。
+
+监督线程负责：把任务分派给空闲的工作进程、回收结果并唤醒等待的协程、重启退出的工作进程
+（其正在执行的任务重试一次）、终止超时或内存超限的工作进程。工作进程在每个任务完成后检查自身内存，
+超过上限时主动退出并由监督线程重启。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from typing import List, Optional, TYPE_CHECKING
+
+from scrape.cfmmc_crawler import CFMMCLoginError, CrawlJob, CrawlResult
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 工作进程正在执行的任务最多尝试的次数（工作进程崩溃时重试）
+MAX_TASK_ATTEMPTS = 2
+# 内存超过上限的该倍数时，监督线程直接终止正在执行任务的工作进程
+HARD_RSS_FACTOR = 1.5
+# 短时间内连续重启时的等待时间上限（秒）
+MAX_RESTART_DELAY = 30.0
+SUPERVISOR_INTERVAL = 0.2
+
+
+class CrawlWorkerError(CFMMCLoginError):
+    """工作进程异常退出、超时或内存超限，任务未能完成"""
+    pass
+
+
+def _rss_bytes(pid: int) -> int:
+    """读取进程的常驻内存（字节），无法读取时返回0"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _portable_error(error: Optional[Exception]) -> Optional[Exception]:
+    """无法跨进程传递的异常转换为 CFMMCLoginError"""
+    if error is None:
+        return None
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return CFMMCLoginError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(slot: int, inbox, outbox, max_rss: int, log_level: int):
+    """工作进程入口：依次执行收件队列中的任务，结果与日志写入发件队列"""
+    # 独立进程组，终止工作进程时可以一并终止其启动的浏览器
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    # Ctrl+C 只由 Bot 进程处理，工作进程由监督线程停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(outbox)]
+    root.setLevel(log_level)
+
+    from scrape.cfmmc_crawler import cfmmc_crawler, get_direct_client
+
+    client = get_direct_client()
+    try:
+        # 预先加载验证码模型，避免计入第一个任务的耗时
+        _ = cfmmc_crawler.ocr
+    except Exception as ocr_error:
+        logger.warning(f"工作进程 {slot} 加载验证码模型失败: {ocr_error}")
+
+    outbox.put(('ready', slot, os.getpid()))
+    while True:
+        task = inbox.get()
+        if task is None:
+            break
+
+        task_id, jobs = task
+        try:
+            results = asyncio.run(client.crawl_batch(jobs, max_concurrency=len(jobs)))
+            payload = [(result.data, _portable_error(result.error), result.elapsed) for result in results]
+        except Exception as batch_error:
+            payload = [(None, _portable_error(batch_error), 0.0) for _ in jobs]
+        outbox.put(('result', slot, task_id, payload))
+
+        rss = _rss_bytes(os.getpid())
+        if max_rss and rss > max_rss:
+            outbox.put(('recycle', slot, rss))
+            break
+
+
+class _Worker:
+    """监督线程记录的单个工作进程状态"""
+
+    def __init__(self, slot: int, process, inbox):
+        self.slot = slot
+        self.process = process
+        self.inbox = inbox
+        self.ready = False
+        self.task = None
+        self.task_started = 0.0
+        self.exited = None
+
+
+class _Task:
+    """一组在同一工作进程中执行的爬取任务"""
+
+    def __init__(self, loop, future, jobs: List[CrawlJob]):
+        self.loop = loop
+        self.future = future
+        self.jobs = jobs
+        self.attempts = 0
+        self.submitted = time.monotonic()
+
+
+class CrawlWorkerPool:
+    """
+    持仓爬取工作进程池，提供与 CFMMCCrawler 相同的 get_position_data / crawl_batch 接口
+
+    参数:
+        workers: 工作进程数，默认读取环境变量 CRAWL_WORKERS（默认2）
+        max_rss_mb: 单个工作进程的内存上限（MB），默认读取 CRAWL_WORKER_MAX_RSS_MB（默认1024，0 表示不限制）
+        task_timeout: 单个任务的超时时间（秒），默认读取 CRAWL_TASK_TIMEOUT（默认600）
+        jobs_per_task: 每个任务包含的最大账户数（同一工作进程中并发爬取）
+    """
+
+    def __init__(self, workers: int = None, max_rss_mb: float = None, task_timeout: float = None,
+                 jobs_per_task: int = 4):
+        self.workers = max(1, workers if workers is not None else int(os.getenv('CRAWL_WORKERS', '2')))
+        max_rss_mb = max_rss_mb if max_rss_mb is not None else float(os.getenv('CRAWL_WORKER_MAX_RSS_MB', '1024'))
+        self.max_rss = int(max_rss_mb * 2 ** 20)
+        self.task_timeout = task_timeout or float(os.getenv('CRAWL_TASK_TIMEOUT', '600'))
+        self.jobs_per_task = max(1, jobs_per_task)
+        self.restarts = 0
+
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._outbox = None
+        self._workers = []
+        self._backlog = deque()
+        self._pending = {}
+        self._next_task = 0
+        self._crashes = deque(maxlen=5)
+        self._thread = None
+        self._stopping = threading.Event()
+
+    # ========== 对外接口 ==========
+
+    async def get_position_data(self,
+                                trade_date: str,
+                                username: str,
+                                password: str) -> Optional[pd.DataFrame]:
+        """
+        在工作进程中获取指定日期的持仓数据
+
+        抛出异常:
+            CFMMCCredentialsError: 用户名密码错误
+            CFMMCVerificationCodeError: 验证码错误
+            CFMMCLoginError: 其他登录错误（含工作进程异常）
+        """
+        result, = await self.crawl_batch([CrawlJob(0, trade_date, username, password)])
+        if isinstance(result.error, CFMMCLoginError):
+            raise result.error
+        return result.data
+
+    async def crawl_batch(self, jobs: List[CrawlJob], max_concurrency: int = 4) -> List[CrawlResult]:
+        """
+        将任务分发到工作进程并发爬取，单个任务失败不影响其他任务
+
+        max_concurrency 为各工作进程同时爬取的账户总数。
+
+        返回:
+            List[CrawlResult]: 与 jobs 顺序一致的结果
+        """
+        if not jobs:
+            return []
+
+        per_task = max(1, min(self.jobs_per_task, -(-max_concurrency // self.workers)))
+        loop = asyncio.get_running_loop()
+        futures = [self._submit(loop, jobs[i:i + per_task]) for i in range(0, len(jobs), per_task)]
+        results = [result for chunk in await asyncio.gather(*futures) for result in chunk]
+
+        succeeded = sum(result.ok for result in results)
+        logger.info(f"工作进程批量爬取完成：{succeeded}/{len(jobs)} 个任务成功")
+        return results
+
+    def shutdown(self, timeout: float = 5.0):
+        """停止监督线程与所有工作进程，未完成的任务以 CrawlWorkerError 结束"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+        with self._lock:
+            for worker in self._workers:
+                try:
+                    worker.inbox.put(None)
+                except Exception:
+                    pass
+            deadline = time.monotonic() + timeout
+            for worker in self._workers:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    self._kill(worker)
+            self._workers = []
+            for task_id in list(self._pending):
+                self._fail(task_id, CrawlWorkerError("工作进程池已关闭"))
+            self._backlog.clear()
+        self._stopping.clear()
+
+    def stats(self) -> dict:
+        """各工作进程的状态（pid、内存、正在执行的任务）"""
+        with self._lock:
+            return {
+                'workers': [{'slot': worker.slot, 'pid': worker.process.pid, 'ready': worker.ready,
+                             'busy': worker.task is not None, 'rss': _rss_bytes(worker.process.pid)}
+                            for worker in self._workers],
+                'backlog': len(self._backlog),
+                'restarts': self.restarts,
+            }
+
+    # ========== 任务提交 ==========
+
+    def _submit(self, loop, jobs: List[CrawlJob]) -> asyncio.Future:
+        future = loop.create_future()
+        with self._lock:
+            self._ensure_started()
+            task_id = self._next_task
+            self._next_task += 1
+            self._pending[task_id] = _Task(loop, future, jobs)
+            self._backlog.append(task_id)
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        self._outbox = self._context.Queue()
+        self._workers = [self._spawn(slot) for slot in range(self.workers)]
+        self._thread = threading.Thread(target=self._supervise, daemon=True, name='crawl-supervisor')
+        self._thread.start()
+
+    def _spawn(self, slot: int) -> _Worker:
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main, name=f'crawl-worker-{slot}', daemon=True,
+            args=(slot, inbox, self._outbox, self.max_rss, logging.getLogger().getEffectiveLevel()))
+        process.start()
+        logger.info(f"爬取工作进程 {slot} 已启动 (pid {process.pid})")
+        return _Worker(slot, process, inbox)
+
+    # ========== 监督线程 ==========
+
+    def _supervise(self):
+        while not self._stopping.is_set():
+            try:
+                message = self._outbox.get(timeout=SUPERVISOR_INTERVAL)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                if message is not None:
+                    self._handle(message)
+                self._check_workers()
+                self._dispatch()
+
+    def _handle(self, message):
+        if isinstance(message, logging.LogRecord):
+            logging.getLogger(message.name).handle(message)
+            return
+
+        kind, slot = message[0], message[1]
+        worker = self._workers[slot]
+        if kind == 'ready':
+            worker.ready = True
+        elif kind == 'result':
+            task_id, payload = message[2], message[3]
+            if worker.task == task_id:
+                worker.task = None
+            self._resolve(task_id, payload)
+        elif kind == 'recycle':
+            logger.info(f"爬取工作进程 {slot} 内存 {message[2] / 2 ** 20:.0f}MB 超过上限，重启")
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in self._workers:
+            if not worker.process.is_alive():
+                self._restart(worker, now)
+            elif worker.task is None:
+                continue
+            elif now - worker.task_started > self.task_timeout:
+                logger.warning(f"爬取工作进程 {worker.slot} 任务超时，终止")
+                self._kill(worker)
+            elif self.max_rss and _rss_bytes(worker.process.pid) > self.max_rss * HARD_RSS_FACTOR:
+                logger.warning(f"爬取工作进程 {worker.slot} 内存超限，终止")
+                self._kill(worker)
+
+        # 工作进程持续无法启动时，排队过久的任务直接失败
+        for task_id in list(self._backlog):
+            if now - self._pending[task_id].submitted > self.task_timeout:
+                self._fail(task_id, CrawlWorkerError("等待工作进程超时"))
+
+    def _restart(self, worker: _Worker, now: float):
+        exitcode = worker.process.exitcode
+        if worker.exited is None:
+            worker.exited = now
+            if exitcode != 0:
+                self._crashes.append(now)
+                logger.warning(f"爬取工作进程 {worker.slot} 异常退出（退出码 {exitcode}）")
+
+            if worker.task is not None:
+                task = self._pending.get(worker.task)
+                if task is not None:
+                    task.attempts += 1
+                    if task.attempts < MAX_TASK_ATTEMPTS:
+                        self._backlog.appendleft(worker.task)
+                    else:
+                        self._fail(worker.task, CrawlWorkerError(f"工作进程异常退出（退出码 {exitcode}）"))
+                worker.task = None
+
+        # 一分钟内连续崩溃时逐步拉长重启间隔，避免反复拉起
+        recent = sum(1 for crashed in self._crashes if now - crashed < 60) if exitcode != 0 else 0
+        delay = min(MAX_RESTART_DELAY, 0.5 * 2 ** (recent - 2)) if recent > 1 else 0.0
+        if now - worker.exited < delay:
+            return
+
+        worker.process.join(0)
+        self._workers[worker.slot] = self._spawn(worker.slot)
+        self.restarts += 1
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if not self._backlog:
+                return
+            if worker.ready and worker.task is None and worker.process.is_alive():
+                task_id = self._backlog.popleft()
+                worker.task = task_id
+                worker.task_started = time.monotonic()
+                worker.inbox.put((task_id, self._pending[task_id].jobs))
+
+    @staticmethod
+    def _kill(worker: _Worker):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(worker.process.pid, signal.SIGKILL)
+            else:
+                worker.process.kill()
+        except (ProcessLookupError, PermissionError):
+            worker.process.kill()
+        worker.process.join(1)
+
+    # ========== 结果 ==========
+
+    def _resolve(self, task_id: int, payload: list):
+        task = self._pending.pop(task_id, None)
+        if task is None:
+            return
+        if task_id in self._backlog:
+            self._backlog.remove(task_id)
+        results = [CrawlResult(job, data, error, elapsed) for job, (data, error, elapsed) in zip(task.jobs, payload)]
+        task.loop.call_soon_threadsafe(_set_result, task.future, results)
+
+    def _fail(self, task_id: int, error: Exception):
+        task = self._pending.get(task_id)
+        if task is not None:
+            self._resolve(task_id, [(None, error, 0.0)] * len(task.jobs))
+
+
+def _set_result(future: asyncio.Future, results):
+    if not future.done():
+        future.set_result(results)
+
+
+# 创建全局工作进程池（首次提交任务时才启动进程）
+crawl_pool = CrawlWorkerPool()
@@ -0,0 +1,293 @@
+"""
+本地模拟的 CFMMC 查询站点，用于开发与联调 CFMMCHttpClient（不连接真实站点）
+
+模拟登录页（含 Struts 令牌）、验证码图片、登录表单、查询日期提交与结算单下载，
+页面元素名称与真实站点一致。用法：
+
+    python -m scrape.fake_cfmmc --port 8765
+
+然后设置 CFMMC_CLIENT=http、CFMMC_BASE_URL=http://127.0.0.1:8765，使用账户 demo / demo123。
+
+自检（用 CFMMCHttpClient 走完登录、下载与批量流程，失败时以非零状态退出）：
+
+    python -m scrape.fake_cfmmc --check
+"""
+import io
+import logging
+import random
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from scrape.cfmmc_http import (CAPTCHA_PATH, DOWNLOAD_PATH, LOGIN_PATH, LOGOUT_PATH,
+                               PARAMETER_PATH, TOKEN_FIELD)
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = 'JSESSIONID'
+CAPTCHA_CHARS = '0123456789'
+
+DEFAULT_ACCOUNTS = {'demo': 'demo123'}
+DEFAULT_POSITIONS = [
+    # 合约, 买/卖, 持仓量, 开仓价, 结算价
+    ('rb2510', '买', 2, 3200.0, 3250.0),
+    ('SR509', '卖', 1, 5900.0, 5880.0),
+    ('i2509', '买', 3, 780.0, 792.5),
+]
+
+
+def render_captcha(code: str) -> bytes:
+    """生成验证码图片（PNG）"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new('RGB', (100, 36), 'white')
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=26)
+    except TypeError:
+        font = ImageFont.load_default()
+    draw.text((12, 3), code, fill='black', font=font)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def build_statement(positions) -> bytes:
+    """生成结算单（xlsx），持仓明细表前有 9 行表头说明，与真实结算单一致"""
+    import pandas as pd
+
+    rows = list(positions) + [('合计', None, sum(row[2] for row in positions), None, None)]
+    frame = pd.DataFrame(rows, columns=['合约', '买/卖', '持仓量', '开仓价', '结算价'])
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        frame.to_excel(writer, sheet_name='持仓明细', startrow=9, index=False)
+    return buffer.getvalue()
+
+
+def _page(body: str) -> bytes:
+    return f"<html><head><meta charset='utf-8'></head><body>{body}</body></html>".encode('utf-8')
+
+
+class FakeCFMMCServer:
+    """
+    模拟站点
+
+    参数:
+        accounts: {用户名: 密码}
+        positions: 结算单中的持仓行
+        port: 监听端口，0 表示自动分配
+        check_captcha: 是否校验验证码
+        latency: 每个请求的模拟延迟（秒）
+    """
+
+    def __init__(self, accounts: dict = None, positions=None, port: int = 0,
+                 check_captcha: bool = True, latency: float = 0.0):
+        self.accounts = accounts or DEFAULT_ACCOUNTS
+        self.positions = positions or DEFAULT_POSITIONS
+        self.check_captcha = check_captcha
+        self.latency = latency
+        self.sessions = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._statement = None
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name='fake-cfmmc')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def statement(self) -> bytes:
+        if self._statement is None:
+            self._statement = build_statement(self.positions)
+        return self._statement
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+            def _session(self):
+                cookie = SimpleCookie(self.headers.get('Cookie', ''))
+                session_id = cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+                with server._lock:
+                    server.requests += 1
+                    if session_id not in server.sessions:
+                        session_id = secrets.token_hex(8)
+                        server.sessions[session_id] = {'logged_in': False}
+                    return session_id, server.sessions[session_id]
+
+            def _send(self, session_id, body: bytes, content_type='text/html; charset=utf-8', status=200):
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Set-Cookie', f'{SESSION_COOKIE}={session_id}; Path=/')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _form(self) -> dict:
+                length = int(self.headers.get('Content-Length', 0))
+                fields = parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+                return {key: values[0] for key, values in fields.items()}
+
+            @staticmethod
+            def _new_token(session) -> str:
+                session['token'] = secrets.token_hex(16)
+                return session['token']
+
+            def _login_page(self, session, message='') -> bytes:
+                return _page(
+                    f"<div class='error'>{message}</div>"
+                    f"<form method='post' action='{LOGIN_PATH}'>"
+                    f"<input type='hidden' name='{TOKEN_FIELD}' value='{self._new_token(session)}'>"
+                    "<input name='userID'><input type='password' name='password'>"
+                    f"<input name='vericode'><img id='imgVeriCode' src='{CAPTCHA_PATH}'>"
+                    "<input type='submit' value='登录'></form>")
+
+            def _account_page(self, session) -> bytes:
+                return _page(
+                    f"<form method='post' action='{PARAMETER_PATH}'>"
+                    f"<input type='hidden' name='{TOKEN_FIELD}' value='{self._new_token(session)}'>"
+                    f"<input name='tradeDate' value='{session.get('trade_date', '')}'>"
+                    "<input type='submit' value='提交'></form>"
+                    f"<a id='myDownload' href='{DOWNLOAD_PATH}'>下载</a>"
+                    "<input type='button' name='logout' value='退出'>")
+
+            def do_GET(self):
+                session_id, session = self._session()
+                path = urlparse(self.path).path
+
+                if path == LOGIN_PATH:
+                    self._send(session_id, self._login_page(session))
+                elif path == CAPTCHA_PATH:
+                    session['captcha'] = ''.join(random.choices(CAPTCHA_CHARS, k=4))
+                    self._send(session_id, render_captcha(session['captcha']), 'image/png')
+                elif path == DOWNLOAD_PATH and session['logged_in'] and session.get('trade_date'):
+                    self._send(session_id, server.statement(),
+                               'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                elif path == DOWNLOAD_PATH:
+                    self._send(session_id, _page("请先登录"))
+                elif path == LOGOUT_PATH:
+                    with server._lock:
+                        server.sessions.pop(session_id, None)
+                    self._send(session_id, _page("已退出"))
+                else:
+                    self._send(session_id, _page("Not Found"), status=404)
+
+            def do_POST(self):
+                session_id, session = self._session()
+                path = urlparse(self.path).path
+                form = self._form()
+
+                if form.get(TOKEN_FIELD) != session.get('token'):
+                    self._send(session_id, _page("重复提交或页面已过期"))
+                elif path == LOGIN_PATH:
+                    expected = session.pop('captcha', None)
+                    if server.check_captcha and form.get('vericode', '').lower() != (expected or '').lower():
+                        self._send(session_id, self._login_page(session, "验证码错误"))
+                    elif server.accounts.get(form.get('userID')) != form.get('password'):
+                        self._send(session_id, self._login_page(session, "用户名或密码错误"))
+                    else:
+                        session['logged_in'] = True
+                        self._send(session_id, self._account_page(session))
+                elif path == PARAMETER_PATH and session['logged_in']:
+                    session['trade_date'] = form.get('tradeDate')
+                    self._send(session_id, self._account_page(session))
+                else:
+                    self._send(session_id, _page("请先登录"))
+
+        return Handler
+
+
+def self_check() -> list:
+    """
+    用 CFMMCHttpClient 对模拟站点做端到端检查（不校验验证码）
+
+    覆盖：单个账户成功获取持仓、密码错误时抛出 CFMMCCredentialsError、批量任务中失败的任务不影响其他任务。
+
+    返回:
+        list: 各项检查的说明
+
+    异常:
+        AssertionError: 任一检查不通过
+    """
+    import asyncio
+
+    from scrape.cfmmc_crawler import CFMMCCredentialsError, CrawlJob
+    from scrape.cfmmc_http import CFMMCHttpClient
+
+    passed = []
+    with FakeCFMMCServer(check_captcha=False) as fake:
+        client = CFMMCHttpClient(fake.url, timeout=5.0, max_retries=2, captcha_solver=lambda image: '0000')
+
+        data = client.fetch_positions('2025-06-12', 'demo', 'demo123')
+        assert data is not None, "未获取到持仓"
+        contracts = [row[0] for row in fake.positions]
+        assert data['合约'].tolist()[:len(contracts)] == contracts, f"持仓不一致: {data['合约'].tolist()}"
+        passed.append(f"fetch_positions: 获取 {len(contracts)} 个持仓")
+
+        try:
+            client.fetch_positions('2025-06-12', 'demo', 'wrong')
+        except CFMMCCredentialsError:
+            passed.append("密码错误: 抛出 CFMMCCredentialsError")
+        else:
+            raise AssertionError("密码错误时未抛出 CFMMCCredentialsError")
+
+        jobs = [CrawlJob(1, '2025-06-12', 'demo', 'demo123'),
+                CrawlJob(2, '2025-06-12', 'demo', 'wrong'),
+                CrawlJob(3, '2025-06-12', 'nobody', 'demo123'),
+                CrawlJob(4, '2025-06-12', 'demo', 'demo123')]
+        results = asyncio.run(client.crawl_batch(jobs, max_concurrency=4))
+        assert [result.key for result in results] == [1, 2, 3, 4], "批量结果顺序与任务不一致"
+        assert [result.ok for result in results] == [True, False, False, True], f"批量结果错误: {results}"
+        assert all(isinstance(results[i].error, CFMMCCredentialsError) for i in (1, 2)), f"失败原因错误: {results}"
+        passed.append("crawl_batch: 2 个失败任务不影响其余 2 个任务")
+    return passed
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地模拟 CFMMC 查询站点')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-captcha', action='store_true', help='不校验验证码')
+    parser.add_argument('--check', action='store_true', help='运行客户端自检后退出')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.check:
+        for line in self_check():
+            print(f"通过 {line}")
+        raise SystemExit(0)
+
+    fake = FakeCFMMCServer(port=args.port, check_captcha=not args.no_captcha)
+    print(f"模拟站点已启动: {fake.url}（账户 demo / demo123）")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
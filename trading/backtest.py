@@ -0,0 +1,208 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from trading.contracts import contract_multipliers
+from trading.indicators import rolling_moments
+from trading.signal import pick_main_rows
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def build_main_panel(data: pd.DataFrame) -> dict:
+    """
+    将日线数据整理为按品种主力合约拼接的价格面板
+
+    每个交易日取持仓量最大的合约为主力。换月当天的盈亏按前一日主力合约自身的价格变化计算，
+    避免把新旧合约的价差计入盈亏。
+
+    参数:
+    data (pd.DataFrame): fetch_raw_data 返回的日线数据
+
+    返回:
+    dict: dates (T,)、varieties (N,)、close (T, N) 主力收盘价、
+          change (T, N) 持有前一日主力合约一手的价格变化、multipliers (N,) 合约乘数
+    """
+    frame = data[['date', 'variety', 'symbol', 'close', 'open_interest']].dropna(subset=['close'])
+    frame = frame.assign(variety=frame['variety'].astype(str), symbol=frame['symbol'].astype(str),
+                         close=frame['close'].astype(np.float64))
+
+    main = (pick_main_rows(frame, ['date', 'variety'])
+            .sort_values(['variety', 'date'])[['date', 'variety', 'symbol', 'close']])
+    by_variety = main.groupby('variety')
+    main['prev_symbol'] = by_variety['symbol'].shift()
+    main['prev_close'] = by_variety['close'].shift()
+
+    # 前一日主力合约在今天的收盘价
+    carry = frame[['date', 'symbol', 'close']].rename(columns={'symbol': 'prev_symbol', 'close': 'carry_close'})
+    main = main.merge(carry, on=['date', 'prev_symbol'], how='left')
+    main['change'] = (main['carry_close'] - main['prev_close']).fillna(0.0)
+
+    close = main.pivot(index='date', columns='variety', values='close').sort_index()
+    change = main.pivot(index='date', columns='variety', values='change').reindex_like(close).fillna(0.0)
+
+    varieties = [v for v in close.columns if v in contract_multipliers]
+    unknown = sorted(set(close.columns) - set(varieties))
+    if unknown:
+        logger.warning(f"以下品种缺少合约乘数，回测时忽略: {', '.join(unknown)}")
+
+    return {
+        'dates': close.index.to_numpy(),
+        'varieties': np.array(varieties),
+        'close': close[varieties].to_numpy(dtype=np.float64),
+        'change': change[varieties].to_numpy(dtype=np.float64),
+        'multipliers': np.array([contract_multipliers[v] for v in varieties], dtype=np.float64),
+    }
+
+
+def _forward_fill(values: np.ndarray, axis: int = 0) -> np.ndarray:
+    """沿时间轴前向填充 NaN（向量化）"""
+    shape = [1] * values.ndim
+    shape[axis] = values.shape[axis]
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[axis]).reshape(shape))
+    np.maximum.accumulate(index, axis=axis, out=index)
+    return np.take_along_axis(values, index, axis=axis)
+
+
+def _prepare_closes(close: np.ndarray, period: int):
+    """
+    填补停牌/未上市造成的缺口，并标记数据足够计算布林带的位置
+
+    返回:
+    tuple: (填补后的收盘价, 可用掩码)
+    """
+    observed = ~np.isnan(close)
+    filled = np.nan_to_num(_forward_fill(close), nan=0.0)
+    # 上市前的位置填 0 会污染滚动窗口，只有累计观测数达到 period 且窗口内无上市前数据时才可用
+    listed = np.cumsum(observed, axis=0)
+    usable = (listed >= period) & observed
+    return filled, usable
+
+
+def _positions(close: np.ndarray, middle: np.ndarray, upper: np.ndarray,
+               lower: np.ndarray, usable: np.ndarray) -> np.ndarray:
+    """
+    计算突破策略的持仓方向（向量化，数组形状为 (参数, 时间, 品种)）
+
+    收盘价突破上轨开多、跌破下轨开空，穿越中轨时平仓；其余时间维持原持仓。
+    """
+    side = np.sign(close - middle)
+    crossed = np.zeros(np.broadcast_shapes(side.shape, upper.shape), dtype=bool)
+    crossed[:, 1:, :] = side[:, 1:, :] != side[:, :-1, :]
+
+    events = np.where(close > upper, 1.0,
+                      np.where(close < lower, -1.0,
+                               np.where(crossed, 0.0, np.nan)))
+    events = np.where(usable, events, 0.0)
+    return np.nan_to_num(_forward_fill(events, axis=1), nan=0.0)
+
+
+def backtest_period(panel: dict, period: int, stds) -> dict:
+    """
+    对同一周期的多个标准差倍数进行回测，中轨与标准差只计算一次
+
+    返回:
+    dict: {(period, std): (每日组合盈亏 (T,), 开平仓次数)}
+    """
+    close, usable = _prepare_closes(panel['close'], period)
+    middle, sd = rolling_moments(close, period)
+
+    stds = np.asarray(list(stds), dtype=np.float64)
+    k = stds[:, None, None]
+    positions = _positions(close[None], middle[None], middle + k * sd, middle - k * sd,
+                           usable[None] & ~np.isnan(sd)[None])
+
+    # 收盘时产生信号，持有至下一交易日收盘
+    held = np.zeros_like(positions)
+    held[:, 1:, :] = positions[:, :-1, :]
+    daily_pnl = (held * panel['change'][None] * panel['multipliers']).sum(axis=2)
+    trades = (np.abs(np.diff(positions, axis=1)) > 0).sum(axis=(1, 2))
+
+    return {(period, float(std)): (daily_pnl[i], int(trades[i])) for i, std in enumerate(stds)}
+
+
+def summarize(daily_pnl: np.ndarray, trades: int) -> dict:
+    """根据每日盈亏计算汇总指标"""
+    equity = np.cumsum(daily_pnl)
+    drawdown = np.maximum.accumulate(equity) - equity
+    volatility = daily_pnl.std()
+    active = daily_pnl[daily_pnl != 0]
+
+    return {
+        'total_pnl': float(equity[-1]) if len(equity) else 0.0,
+        'sharpe': float(daily_pnl.mean() / volatility * np.sqrt(TRADING_DAYS_PER_YEAR)) if volatility > 0 else 0.0,
+        'max_drawdown': float(drawdown.max()) if len(drawdown) else 0.0,
+        'win_rate': float((active > 0).mean()) if len(active) else 0.0,
+        'trades': trades,
+    }
+
+
+# 工作进程内共享的行情面板（通过进程池初始化函数传入一次）
+_worker_panel = None
+
+
+def _init_worker(panel: dict):
+    global _worker_panel
+    _worker_panel = panel
+
+
+def _run_period(period: int, stds) -> dict:
+    return backtest_period(_worker_panel, period, stds)
+
+
+def load_backtest_data(start_date: str, end_date: str, markets=None) -> pd.DataFrame:
+    """从本地行情存储读取回测区间的日线数据"""
+    from trading.bar_store import bar_store
+
+    return bar_store.load_frame(start_date, end_date, markets)
+
+
+def run_backtest_grid(data: pd.DataFrame, periods, stds, max_workers: int = None):
+    """
+    对 (周期, 标准差倍数) 参数网格回测布林带突破策略
+
+    每个品种每次交易一手，按 contract_multipliers 计算盈亏。同一周期的所有倍数在一个任务中
+    向量化计算，不同周期分发到进程池并行执行。
+
+    参数:
+    data (pd.DataFrame): 日线数据
+    periods: 布林带周期列表
+    stds: 标准差倍数列表
+    max_workers (int, optional): 进程数，默认为 CPU 核数；为 1 时在当前进程计算
+
+    返回:
+    tuple: (summary, equity)
+        summary (pd.DataFrame): 以 (period, std) 为索引的汇总指标
+        equity (pd.DataFrame): 以日期为索引、(period, std) 为列的权益曲线
+    """
+    panel = build_main_panel(data)
+    periods = sorted(set(int(p) for p in periods))
+    stds = sorted(set(float(s) for s in stds))
+
+    results = {}
+    if max_workers == 1 or len(periods) == 1:
+        for period in periods:
+            results.update(backtest_period(panel, period, stds))
+    else:
+        with ProcessPoolExecutor(max_workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(panel,)) as pool:
+            for partial in pool.map(_run_period, periods, [stds] * len(periods)):
+                results.update(partial)
+
+    keys = list(product(periods, stds))
+    summary = pd.DataFrame([summarize(*results[key]) for key in keys],
+                           index=pd.MultiIndex.from_tuples(keys, names=['period', 'std']))
+    equity = pd.DataFrame(np.cumsum(np.column_stack([results[key][0] for key in keys]), axis=0),
+                          index=pd.Index(panel['dates'], name='date'),
+                          columns=summary.index)
+
+    logger.info(f"回测完成：{len(panel['varieties'])} 个品种，{len(panel['dates'])} 个交易日，{len(keys)} 组参数")
+    return summary, equity
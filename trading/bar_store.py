@@ -0,0 +1,428 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只在进程内加锁
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from trading.contracts import exchanges
+from trading.schema import COUNT_COLUMNS, concat_bars, normalize_bars
+
+logger = logging.getLogger(__name__)
+
+# 行情字段及其存储类型，每个字段一个 .npy 文件。价格列在 float32 足够精确时以 float32 存储，
+# 成交量与持仓量以整数存储（取值允许时为 int32），-1 表示缺失
+BAR_FIELDS = {
+    'date': np.int32,  # YYYYMMDD
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.int64,
+    'open_interest': np.int64,
+    'turnover': np.float64,
+    'settle': np.float64,
+    'pre_settle': np.float64,
+}
+MISSING_COUNT = -1
+
+INDEX_FILE = 'index.json'
+# 复合键 合约序号 * DATE_KEY_SPAN + 日期，按 (合约, 日期) 排序后全局有序
+DATE_KEY_SPAN = 10 ** 8
+# 已完整获取的交易日（含无成交数据的交易日），int32 YYYYMMDD，已排序
+COVERAGE_FILE = 'coverage.npy'
+# 写入替换目录的间隙，读者重试的次数与间隔（秒）
+OPEN_RETRIES = 5
+OPEN_RETRY_DELAY = 0.01
+
+
+def default_store_dir() -> Path:
+    """默认存储目录，可通过环境变量 BAR_STORE_DIR 指定"""
+    return Path(os.getenv('BAR_STORE_DIR', Path(__file__).resolve().parent.parent / 'data' / 'bars'))
+
+
+class ExchangeBars:
+    """
+    单个交易所的只读行情数据
+
+    各字段以 numpy.memmap 打开，按 (合约, 日期) 排序；index.json 记录每个合约在数组中的
+    [start, stop) 区间。切片返回 memmap 视图，不复制、不解析，多个进程打开同一组文件时共享页缓存。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path / INDEX_FILE, encoding='utf-8') as f:
+            index = json.load(f)
+
+        self.version = index['version']
+        self.coverage = _load_coverage(path)
+        self.symbols = index['symbols']
+        self.varieties = index['varieties']
+        self.starts = np.asarray(index['starts'], dtype=np.int64)
+        self.stops = np.asarray(index['stops'], dtype=np.int64)
+        self._positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._keys = None
+
+        self.fields = {}
+        for field in BAR_FIELDS:
+            file_path = path / f'{field}.npy'
+            if file_path.exists():
+                self.fields[field] = np.load(file_path, mmap_mode='r')
+
+    def __len__(self):
+        return int(self.stops[-1]) if len(self.stops) else 0
+
+    def __contains__(self, symbol):
+        return symbol in self._positions
+
+    def symbol_slice(self, symbol: str, start_date: int = None, end_date: int = None) -> slice:
+        """合约在 [start_date, end_date] 内的行区间（日期为 YYYYMMDD 整数）"""
+        i = self._positions[symbol]
+        start, stop = int(self.starts[i]), int(self.stops[i])
+        if start_date is not None or end_date is not None:
+            dates = self.fields['date'][start:stop]
+            lo = np.searchsorted(dates, start_date, side='left') if start_date is not None else 0
+            hi = np.searchsorted(dates, end_date, side='right') if end_date is not None else stop - start
+            start, stop = start + int(lo), start + int(hi)
+        return slice(start, stop)
+
+    def history(self, symbol: str, start_date: int = None, end_date: int = None) -> dict:
+        """合约的历史行情，返回 {字段: memmap 视图}"""
+        rows = self.symbol_slice(symbol, start_date, end_date)
+        return {field: values[rows] for field, values in self.fields.items()}
+
+    def window_rows(self, start_date: int = None, end_date: int = None) -> np.ndarray:
+        """所有合约落在日期区间内的行号"""
+        pieces = []
+        for symbol in self.symbols:
+            rows = self.symbol_slice(symbol, start_date, end_date)
+            if rows.stop > rows.start:
+                pieces.append(np.arange(rows.start, rows.stop))
+        return np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+
+    def symbol_column(self) -> np.ndarray:
+        """逐行的合约序号（按需生成）"""
+        return np.repeat(np.arange(len(self.symbols)), self.stops - self.starts)
+
+    def sorted_keys(self) -> np.ndarray:
+        """(合约, 日期) 复合键，整体有序，打开后首次查询时生成一次"""
+        if self._keys is None:
+            self._keys = self.symbol_column().astype(np.int64) * DATE_KEY_SPAN + self.fields['date']
+        return self._keys
+
+    def as_of_rows(self, as_of: int, bars: int, since: int = None) -> np.ndarray:
+        """
+        每个合约截至 as_of（含）的最后 bars 行的行号
+
+        对所有合约一次二分查找复合键，不扫描历史数据。
+
+        参数:
+        as_of (int): 截止日期 YYYYMMDD
+        bars (int): 每个合约最多取的行数
+        since (int, optional): 只保留最后一根K线不早于该日期的合约，排除早已到期的合约
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        targets = np.arange(len(self.symbols), dtype=np.int64) * DATE_KEY_SPAN + as_of
+        stops = np.searchsorted(self.sorted_keys(), targets, side='right')
+        starts = np.maximum(stops - bars, self.starts)
+
+        keep = stops > starts
+        if since is not None:
+            keep &= self.fields['date'][np.maximum(stops - 1, 0)] >= since
+        return _concat_ranges(starts[keep], stops[keep])
+
+
+class BarStore:
+    """
+    基于内存映射的列式日线存储
+
+    目录结构：<root>/<交易所>/{date,open,...}.npy + index.json + coverage.npy。写入时整体重写交易所目录并
+    原子替换，已打开的映射仍指向旧文件，读者不受影响。coverage.npy 按交易日记录已完整获取的日期，
+    因此"交易日无数据"与"未获取"可以区分，休市日不需要记录。
+
+    同一交易所的"读取-合并-写入"在线程锁与 <root>/<交易所>.lock 文件锁内进行，
+    多个线程或多个进程（分片工作进程）同时写入时不会互相覆盖。
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root is not None else default_store_dir()
+        self._opened = {}
+        self._lock = threading.Lock()
+        self._write_locks = {}
+
+    # ========== 读取 ==========
+
+    def exchanges(self) -> list:
+        """已存储的交易所"""
+        return [ex for ex in exchanges if ex in self._opened or (self.root / ex / INDEX_FILE).exists()]
+
+    def open(self, exchange: str):
+        """
+        打开交易所数据；文件更新后自动重新映射。不存在时返回 None
+
+        写入方替换目录的间隙中目录短暂缺失，此时稍后重试，仍缺失则返回已打开的映射
+        """
+        path = self.root / exchange
+        with self._lock:
+            cached = self._opened.get(exchange)
+
+        for attempt in range(OPEN_RETRIES):
+            try:
+                stat = (path / INDEX_FILE).stat()
+                mtime = (stat.st_ino, stat.st_mtime_ns)
+                if cached is not None and cached[0] == mtime:
+                    return cached[1]
+                bars = ExchangeBars(path)
+            except FileNotFoundError:
+                if cached is None and not (self.root / f'{exchange}.lock').exists():
+                    # 从未写入过：交易所尚未缓存
+                    return None
+                time.sleep(OPEN_RETRY_DELAY)
+                continue
+
+            with self._lock:
+                self._opened[exchange] = (mtime, bars)
+            return bars
+        return cached[1] if cached is not None else None
+
+    def find(self, symbol: str):
+        """查找合约所在的交易所数据"""
+        for exchange in self.exchanges():
+            bars = self.open(exchange)
+            if symbol in bars:
+                return bars
+        return None
+
+    def history(self, symbol: str, start_date: str = None, end_date: str = None) -> dict:
+        """
+        获取单个合约的历史行情（零拷贝）
+
+        参数:
+        symbol (str): 合约代码
+        start_date (str, optional): 开始日期，格式为YYYYMMDD
+        end_date (str, optional): 结束日期，格式为YYYYMMDD
+
+        返回:
+        dict: {字段: memmap 视图}；合约不存在时返回空字典
+        """
+        bars = self.find(symbol)
+        if bars is None:
+            return {}
+        return bars.history(symbol, _to_int_date(start_date), _to_int_date(end_date))
+
+    @property
+    def data_version(self) -> tuple:
+        """各交易所数据版本，任一交易所写入后变化"""
+        return tuple((ex, self.open(ex).version) for ex in self.exchanges())
+
+    def coverage(self, exchange: str) -> np.ndarray:
+        """交易所已完整获取的交易日（int32 YYYYMMDD）；未缓存时为空数组"""
+        bars = self.open(exchange)
+        return bars.coverage if bars is not None else np.empty(0, dtype=np.int32)
+
+    def missing_sessions(self, exchange: str, sessions: np.ndarray) -> np.ndarray:
+        """给定交易日中尚未缓存的部分"""
+        sessions = np.asarray(sessions, dtype=np.int32)
+        return sessions[~np.isin(sessions, self.coverage(exchange))]
+
+    def covers(self, start_date: str, end_date: str, markets=None) -> bool:
+        """指定交易所是否都已缓存区间内所有已可获取日线的交易日"""
+        from trading.trade_calendar import trading_calendar
+
+        end = min(int(end_date), trading_calendar.latest_settled_session())
+        sessions = trading_calendar.sessions(start_date, end) if int(start_date) <= end else []
+        return all(len(self.missing_sessions(exchange, sessions)) == 0 for exchange in markets or exchanges)
+
+    def _frame(self, exchange: str, bars: ExchangeBars, rows: np.ndarray) -> pd.DataFrame:
+        """按行号复制行情；合约、品种、交易所直接由索引编码构造分类列，不做字符串解析"""
+        symbol_codes = bars.symbol_column()[rows]
+        variety_names, variety_codes = np.unique(np.asarray(bars.varieties), return_inverse=True)
+
+        columns = {'symbol': pd.Categorical.from_codes(symbol_codes, categories=bars.symbols)}
+        for field, values in bars.fields.items():
+            if field in COUNT_COLUMNS:
+                counts = values[rows]
+                columns[field] = pd.arrays.IntegerArray(counts, counts == MISSING_COUNT)
+            else:
+                columns[field] = values[rows]
+        columns['variety'] = pd.Categorical.from_codes(variety_codes[symbol_codes], categories=variety_names)
+        columns['exchange'] = pd.Categorical.from_codes(
+            np.full(len(rows), exchanges.index(exchange), dtype=np.int8), categories=exchanges)
+        return pd.DataFrame(columns, copy=False)
+
+    def _collect(self, markets, select) -> pd.DataFrame:
+        frames = []
+        for exchange in markets or self.exchanges():
+            bars = self.open(exchange)
+            if bars is None or len(bars) == 0:
+                continue
+
+            rows = select(bars)
+            if len(rows):
+                frames.append(self._frame(exchange, bars, rows))
+        return concat_bars(frames)
+
+    def load_frame(self, start_date: str = None, end_date: str = None, markets=None) -> pd.DataFrame:
+        """
+        读取日期区间内的行情为 DataFrame（结构见 trading.schema），只复制落在区间内的行
+        """
+        return self._collect(markets, lambda bars: bars.window_rows(_to_int_date(start_date),
+                                                                    _to_int_date(end_date)))
+
+    def as_of(self, as_of_date: str, bars: int, markets=None, since: str = None) -> pd.DataFrame:
+        """
+        读取每个合约截至某日（含）的最后 bars 根K线
+
+        各交易所数据常驻内存映射，不同截止日期的查询共用同一份数据，每次只复制结果行。
+
+        参数:
+        as_of_date (str): 截止日期，格式为YYYYMMDD
+        bars (int): 每个合约的K线数
+        markets (list, optional): 交易所列表，默认为全部已存储的交易所
+        since (str, optional): 只返回最后一根K线不早于该日期的合约
+
+        返回:
+        pd.DataFrame: 规范化后的日线数据
+        """
+        as_of, since = int(as_of_date), _to_int_date(since)
+        return self._collect(markets, lambda data: data.as_of_rows(as_of, bars, since))
+
+    # ========== 写入 ==========
+
+    def write(self, data: pd.DataFrame, coverage: dict = None):
+        """
+        写入行情数据，与已有数据按 (合约, 日期) 合并，新数据覆盖旧数据
+
+        参数:
+        data (pd.DataFrame): fetch_raw_data 返回的数据（需包含 exchange 列）
+        coverage (dict, optional): {交易所: 本次完整获取的交易日}，无行情的交易日也会记为已缓存
+        """
+        coverage = coverage or {}
+        parts = {str(exchange): part for exchange, part in data.groupby('exchange', observed=True)} \
+            if not data.empty else {}
+
+        for exchange in [ex for ex in exchanges if ex in parts or ex in coverage]:
+            with self._exchange_lock(exchange):
+                part = parts.get(exchange)
+                existing = self.load_frame(markets=[exchange])
+                if part is None:
+                    part = existing
+                elif not existing.empty:
+                    part = pd.concat([existing, part], ignore_index=True)
+                self._write_exchange(exchange, part, coverage.get(exchange))
+
+    @contextmanager
+    def _exchange_lock(self, exchange: str):
+        """同一交易所的写入互斥：进程内用线程锁，进程间用 <root>/<交易所>.lock 文件锁"""
+        with self._lock:
+            lock = self._write_locks.setdefault(exchange, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / f'{exchange}.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_exchange(self, exchange: str, data: pd.DataFrame, sessions=None):
+        if not data.empty:
+            data = normalize_bars(data)
+            data = data.assign(symbol=data['symbol'].astype(str), variety=data['variety'].astype(str))
+            data = (data.drop_duplicates(['symbol', 'date'], keep='last')
+                    .sort_values(['symbol', 'date'], kind='stable')
+                    .reset_index(drop=True))
+
+        if data.empty:
+            starts = stops = np.empty(0, dtype=np.int64)
+        else:
+            boundaries = np.flatnonzero(data['symbol'].to_numpy()[1:] != data['symbol'].to_numpy()[:-1]) + 1
+            starts = np.concatenate([[0], boundaries]).astype(np.int64)
+            stops = np.concatenate([boundaries, [len(data)]]).astype(np.int64)
+
+        previous = self.open(exchange)
+        coverage = previous.coverage if previous is not None else np.empty(0, dtype=np.int32)
+        if sessions is not None:
+            coverage = np.union1d(coverage, np.asarray(sessions, dtype=np.int32)).astype(np.int32)
+        index = {
+            'version': (previous.version + 1) if previous is not None else 1,
+            'symbols': data['symbol'].to_numpy()[starts].tolist() if len(starts) else [],
+            'varieties': data['variety'].to_numpy()[starts].tolist() if len(starts) else [],
+            'starts': starts.tolist(),
+            'stops': stops.tolist(),
+        }
+
+        target = self.root / exchange
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f'.{exchange}.', suffix='.tmp', dir=self.root))
+        try:
+            self._save_fields(staging, data, coverage, index)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        # 先移走旧目录再换入新目录；已映射旧文件的读者不受影响，正在打开的读者会短暂重试
+        retired = staging.with_suffix('.old')
+        if target.exists():
+            os.replace(target, retired)
+        os.replace(staging, target)
+        shutil.rmtree(retired, ignore_errors=True)
+
+        logger.info(f"{exchange} 行情已写入 {target}，共 {len(data)} 条，{len(starts)} 个合约，"
+                    f"已缓存 {len(coverage)} 个交易日")
+
+    @staticmethod
+    def _save_fields(staging: Path, data: pd.DataFrame, coverage: np.ndarray, index: dict):
+        for field, dtype in BAR_FIELDS.items():
+            if data.empty:
+                values = np.empty(0, dtype=dtype)
+            elif field not in data:
+                continue
+            elif field in COUNT_COLUMNS:
+                values = data[field].to_numpy(dtype=data[field].dtype.numpy_dtype, na_value=MISSING_COUNT)
+            elif data[field].dtype == np.float32:
+                values = data[field].to_numpy()
+            else:
+                values = data[field].to_numpy(dtype=dtype)
+            np.save(staging / f'{field}.npy', values)
+        np.save(staging / COVERAGE_FILE, coverage)
+        with open(staging / INDEX_FILE, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+
+
+def _concat_ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """拼接多个 [start, stop) 区间的行号（向量化）"""
+    lengths = stops - starts
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+
+
+def _to_int_date(value):
+    return int(value) if value is not None else None
+
+
+def _load_coverage(path: Path) -> np.ndarray:
+    """读取已缓存交易日"""
+    if (path / COVERAGE_FILE).exists():
+        return np.load(path / COVERAGE_FILE)
+    return np.empty(0, dtype=np.int32)
+
+
+# 创建全局行情存储实例（不做任何 IO）
+bar_store = BarStore()
@@ -0,0 +1,177 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def render_bollinger_png(symbol: str, dates, closes, period: int, std: float) -> bytes:
+    """
+    绘制收盘价与布林带，返回 PNG 字节（在子进程中执行）
+
+    参数:
+    symbol (str): 合约代码
+    dates: 日期序列，格式为YYYYMMDD
+    closes: 收盘价序列
+    period (int): 布林带周期
+    std (float): 布林带标准差倍数
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from trading.indicators import bollinger_bands
+
+    middle, upper, lower = bollinger_bands(closes, period, std)
+    x = range(len(dates))
+
+    fig, ax = plt.subplots(figsize=(10, 5), dpi=100)
+    try:
+        ax.fill_between(x, lower, upper, color='tab:blue', alpha=0.12)
+        ax.plot(x, upper, color='tab:blue', linewidth=1, label=f'Upper ({period}, {std})')
+        ax.plot(x, middle, color='tab:orange', linewidth=1, label='Middle')
+        ax.plot(x, lower, color='tab:blue', linewidth=1, label='Lower')
+        ax.plot(x, closes, color='black', linewidth=1.2, label='Close')
+
+        step = max(1, len(dates) // 8)
+        ax.set_xticks(list(x)[::step])
+        ax.set_xticklabels(list(dates)[::step], rotation=30)
+        ax.set_title(f"{symbol}  {dates[-1]}")
+        ax.grid(alpha=0.3)
+        ax.legend(loc='upper left', fontsize=8)
+        fig.tight_layout()
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class ChartService:
+    """
+    布林带图表服务
+
+    渲染在进程池中执行，不阻塞事件循环；图片按 (合约, 周期, 倍数, 最后K线日期, 数据版本) 缓存，
+    同一合约每天只渲染一次。并发的相同请求共用同一次渲染。
+    与 SignalService 相同，行情不完整（fetch_report 未完成）时行情与图片都不缓存，下次请求重新取数。
+
+    参数:
+    data_version: 返回当前数据版本的函数（通常为 SignalService.data_version），版本变化后缓存失效
+    """
+
+    def __init__(self, bar_loader=None, max_workers: int = 2,
+                 cache_size: int = 256, history_bars: int = 120, data_version=None):
+        from trading.signal import load_history_bars
+
+        self._bar_loader = bar_loader or load_history_bars
+        self._data_version = data_version or (lambda: 0)
+        self._max_workers = max_workers
+        self._pool = None
+        self._images = OrderedDict()
+        self._cache_size = cache_size
+        self._pending = {}
+        self._bars = OrderedDict()  # (signal_date, bars, 数据版本) -> 行情数据
+        self._bars_lock = threading.Lock()
+        self.history_bars = history_bars
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 使用 spawn 避免 fork 继承事件循环与线程状态
+            self._pool = ProcessPoolExecutor(self._max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def shutdown(self):
+        """关闭渲染进程池"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _load_series(self, symbol: str, period: int, signal_date: str):
+        """
+        取出合约在信号日之前的收盘价序列（在线程中执行）
+
+        symbol 可以是合约代码，也可以是品种代码（此时使用信号日的主力合约）
+
+        返回:
+        tuple: (合约代码, 日期列表, 收盘价, 数据版本)，行情不完整时数据版本为None（结果不应缓存）；
+               找不到合约数据时返回None
+        """
+        from trading.schema import date_key
+        from trading.signal import select_main_contracts
+
+        bars = self.history_bars + period
+        key = (signal_date, bars, self._data_version())
+        with self._bars_lock:
+            data = self._bars.get(key)
+        if data is None:
+            data = self._bar_loader(signal_date, bars)
+        report = data.attrs.get('fetch_report')
+        version = key[2] if report is None or report.complete else None
+        if version is not None:
+            with self._bars_lock:
+                self._bars[key] = data
+                self._bars.move_to_end(key)
+                while len(self._bars) > 4:
+                    self._bars.popitem(last=False)
+
+        if data.empty:
+            return None
+
+        code = symbol.upper()
+        if code in set(data['variety'].astype(str)):
+            main = select_main_contracts(data, signal_date)
+            matched = main.loc[main['variety'] == code, 'symbol']
+            if matched.empty:
+                return None
+            code = str(matched.iloc[0])
+
+        history = data[(data['symbol'].astype(str).str.upper() == code) & (data['date'] <= date_key(signal_date))]
+        history = history.sort_values('date').tail(bars)
+        if history.empty:
+            return None
+
+        return code, history['date'].astype(str).tolist(), history['close'].to_numpy(), version
+
+    async def get_chart(self, symbol: str, period: int, std: float, signal_date: str):
+        """
+        获取布林带图表
+
+        返回:
+        tuple: (合约代码, PNG字节)；找不到合约数据时返回 None
+        """
+        loop = asyncio.get_running_loop()
+        series = await loop.run_in_executor(None, self._load_series, symbol, period, signal_date)
+        if series is None:
+            return None
+
+        code, dates, closes, version = series
+        key = (code, period, std, dates[-1], version)
+
+        if key in self._images:
+            self._images.move_to_end(key)
+            return code, self._images[key]
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = loop.run_in_executor(self._get_pool(), render_bollinger_png,
+                                           code, dates, closes, period, std)
+            self._pending[key] = pending
+            try:
+                image = await pending
+            finally:
+                self._pending.pop(key, None)
+
+            if version is not None:
+                self._images[key] = image
+                while len(self._images) > self._cache_size:
+                    self._images.popitem(last=False)
+            logger.info(f"渲染布林带图表 {key}")
+            return code, image
+
+        return code, await pending
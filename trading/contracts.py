@@ -1,25 +1,412 @@
-# 期货合约代码与乘数对应字典
-contract_multipliers = {
-    # 国债
-    'T': 10000, 'TF': 10000, 'TL': 10000, 'TS': 20000,
-    # 金属
-    'AG': 15, 'AL': 5, 'AU': 1000, 'CU': 5, 'NI': 1, 'PB': 5, 'SN': 1, 'ZN': 5, 'AO': 20,
-    # 能源化工
-    'BC': 5, 'BU': 10, 'EB': 5, 'EG': 10, 'FU': 10, 'L': 5, 'LU': 10, 'MA': 10, 'PF': 5,
-    'PG': 20, 'PP': 5, 'PX': 5, 'RU': 10, 'SC': 1000, 'TA': 5, 'UR': 20, 'V': 5, 'BR': 5,
-    'PR': 15,
-    # 农产品
-    'A': 10, 'AP': 10, 'B': 10, 'C': 10, 'CF': 5, 'CS': 10, 'JD': 10, 'M': 10, 'OI': 10,
-    'P': 10, 'PK': 5, 'RM': 10, 'SR': 10, 'Y': 10, 'LH': 16,
-    # 工业品
-    'CJ': 5, 'FG': 20, 'HC': 10, 'I': 100, 'J': 100, 'JM': 60, 'LG': 90, 'NR': 10,
-    'RB': 10, 'SA': 20, 'SF': 5, 'SM': 5, 'SP': 10, 'SS': 5, 'LC': 1, 'SH': 30, 'SI': 5,
-    # 期指
-    'IF': 300,
-    # 其他 
-    'EC': 50,
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 内置合约参数：交易所 -> 品种 -> (合约乘数, 最小变动价位, 交易所保证金比例)
+# 保证金为近似的交易所标准（占合约价值），交易所会不定期调整，期货公司通常在此基础上加收；
+# 运行时以 contract_registry 的快照为准，此表只作为没有快照时的基线
+BUILTIN_SPECS = {
+    'CFFEX': {
+        # 国债
+        'T': (10000, 0.005, 0.02), 'TF': (10000, 0.005, 0.012), 'TL': (10000, 0.01, 0.035),
+        'TS': (20000, 0.002, 0.005),
+        # 股指
+        'IF': (300, 0.2, 0.12), 'IH': (300, 0.2, 0.12), 'IC': (200, 0.2, 0.12), 'IM': (200, 0.2, 0.12),
+    },
+    'SHFE': {
+        'AG': (15, 1, 0.12), 'AL': (5, 5, 0.09), 'AU': (1000, 0.02, 0.12), 'CU': (5, 10, 0.09),
+        'NI': (1, 10, 0.12), 'PB': (5, 5, 0.09), 'SN': (1, 10, 0.12), 'ZN': (5, 5, 0.09),
+        'AO': (20, 1, 0.09), 'BU': (10, 1, 0.10), 'FU': (10, 1, 0.10), 'RU': (10, 5, 0.08),
+        'BR': (5, 5, 0.10), 'HC': (10, 1, 0.07), 'RB': (10, 1, 0.07), 'SP': (10, 2, 0.07),
+        'SS': (5, 5, 0.07), 'WR': (10, 1, 0.09),
+    },
+    'INE': {
+        'SC': (1000, 0.1, 0.10), 'LU': (10, 1, 0.10), 'NR': (10, 5, 0.10), 'BC': (5, 10, 0.09),
+        'EC': (50, 0.1, 0.18),
+    },
+    'DCE': {
+        'A': (10, 1, 0.08), 'B': (10, 1, 0.08), 'C': (10, 1, 0.07), 'CS': (10, 1, 0.07),
+        'JD': (10, 1, 0.08), 'M': (10, 1, 0.07), 'P': (10, 2, 0.08), 'Y': (10, 2, 0.07),
+        'LH': (16, 5, 0.12), 'RR': (10, 1, 0.06), 'EB': (5, 1, 0.08), 'EG': (10, 1, 0.08),
+        'L': (5, 1, 0.07), 'PG': (20, 1, 0.08), 'PP': (5, 1, 0.07), 'V': (5, 1, 0.07),
+        'I': (100, 0.5, 0.11), 'J': (100, 0.5, 0.15), 'JM': (60, 0.5, 0.15), 'LG': (90, 0.5, 0.08),
+        'BB': (500, 0.05, 0.40), 'FB': (10, 0.5, 0.10),
+    },
+    'CZCE': {
+        'AP': (10, 1, 0.10), 'CF': (5, 5, 0.07), 'CJ': (5, 5, 0.12), 'OI': (10, 1, 0.09),
+        'PK': (5, 2, 0.08), 'RM': (10, 1, 0.09), 'SR': (10, 1, 0.07), 'CY': (5, 5, 0.07),
+        'WH': (20, 1, 0.15), 'PM': (50, 1, 0.15), 'RI': (20, 1, 0.15), 'JR': (20, 1, 0.15),
+        'LR': (20, 1, 0.15), 'RS': (10, 1, 0.20),
+        'MA': (10, 1, 0.07), 'PF': (5, 2, 0.07), 'PX': (5, 2, 0.08), 'TA': (5, 2, 0.07),
+        'UR': (20, 1, 0.08), 'PR': (15, 2, 0.07), 'SH': (30, 1, 0.10), 'FG': (20, 1, 0.09),
+        'SA': (20, 1, 0.09), 'SF': (5, 2, 0.12), 'SM': (5, 2, 0.12), 'ZC': (100, 0.2, 0.50),
+    },
+    'GFEX': {
+        'SI': (5, 5, 0.09), 'LC': (1, 20, 0.09), 'PS': (3, 5, 0.09),
+    },
 }
+# 内置参数的生效日期，任何刷新得到的快照都比它新
+BUILTIN_EFFECTIVE_DATE = 20250101
+
+# 期货合约代码与乘数对应字典（与 contract_registry 当前快照保持同步）
+contract_multipliers = {variety: spec[0] for table in BUILTIN_SPECS.values() for variety, spec in table.items()}
+
+# 交易所保证金比例（与 contract_registry 当前快照保持同步）
+margin_rates = {variety: spec[2] for table in BUILTIN_SPECS.values() for variety, spec in table.items()}
+# 未列出的品种按此比例估算
+DEFAULT_MARGIN_RATE = 0.10
+
 #交易所列表
 exchanges = ["CFFEX", "INE", "CZCE", "DCE", "SHFE", "GFEX"]
 
 
+
+
+# 合约代码：品种字母 + 3 位（郑商所）或 4 位年月
+CONTRACT_CODE_PATTERN = r'^\s*([A-Za-z]+)(\d{3,4})\s*$'
+
+
+def normalize_contract_code(code: str, reference_year: int) -> tuple:
+    """
+    将合约代码规范化为 (品种, 合约)，如 rb2505 -> ('RB', 'RB2505')，SR505 -> ('SR', 'SR2505')
+
+    郑商所合约只有一位年份，按参考年份补全为距其最近且不早于前一年的年份。
+    无法识别时返回 (None, None)。
+    """
+    match = re.match(CONTRACT_CODE_PATTERN, str(code))
+    if not match:
+        return None, None
+
+    variety, digits = match.group(1).upper(), match.group(2)
+    if len(digits) == 3:
+        year = reference_year // 10 * 10 + int(digits[0])
+        if year < reference_year - 1:
+            year += 10
+        digits = f"{year % 100:02d}{digits[1:]}"
+    return variety, variety + digits
+
+
+# ========== 合约参数登记表 ==========
+
+# 单个品种的合约参数
+ContractSpec = namedtuple('ContractSpec', ['variety', 'exchange', 'multiplier', 'tick', 'margin', 'name'])
+
+# 国泰君安交易日历中的交易所名称
+EXCHANGE_NAMES = {
+    '中金所': 'CFFEX', '中国金融期货交易所': 'CFFEX',
+    '上期所': 'SHFE', '上海期货交易所': 'SHFE',
+    '上期能源': 'INE', '能源中心': 'INE', '上海国际能源交易中心': 'INE',
+    '大商所': 'DCE', '大连商品交易所': 'DCE',
+    '郑商所': 'CZCE', '郑州商品交易所': 'CZCE',
+    '广期所': 'GFEX', '广州期货交易所': 'GFEX',
+}
+
+# 快照超过此天数未核对时，启动后在后台刷新（CONTRACT_REFRESH_DAYS=0 表示不自动刷新）
+DEFAULT_REFRESH_DAYS = 7
+
+VARIETY_PATTERN = re.compile(r'^\s*([A-Za-z]+)')
+
+
+def default_specs_dir() -> Path:
+    """合约参数快照目录，可通过环境变量 CONTRACT_SPECS_DIR 指定"""
+    return Path(os.getenv('CONTRACT_SPECS_DIR') or Path(__file__).resolve().parent.parent / 'data' / 'contracts')
+
+
+def builtin_specs() -> dict:
+    """内置合约参数，返回 {品种: ContractSpec}"""
+    return {variety: ContractSpec(variety, exchange, multiplier, tick, margin, '')
+            for exchange, table in BUILTIN_SPECS.items()
+            for variety, (multiplier, tick, margin) in table.items()}
+
+
+def _number(value):
+    """整数值保存为 int，便于快照比较与阅读；缺失值返回 None"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value != value:
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def parse_rule_frame(frame, known: dict = None) -> dict:
+    """
+    解析 akshare futures_rule（国泰君安交易日历）返回的表格
+
+    参数:
+    frame (pd.DataFrame): 含 交易所、品种、代码、合约乘数、最小变动价位、交易保证金比例 列
+    known (dict, optional): 已有的 {品种: ContractSpec}，表中缺失的字段沿用其中的值
+
+    返回:
+    dict: {品种: ContractSpec}，无法识别的行（期权、缺少合约乘数等）被忽略
+    """
+    known = known or {}
+    specs = {}
+    columns = ['交易所', '品种', '代码', '合约乘数', '最小变动价位', '交易保证金比例']
+    for exchange_name, name, code, multiplier, tick, margin in frame[columns].itertuples(index=False):
+        variety = str(code).strip().upper()
+        if not re.fullmatch(r'[A-Z]+', variety):
+            continue
+        previous = known.get(variety)
+        exchange = EXCHANGE_NAMES.get(str(exchange_name).strip()) or (previous.exchange if previous else None)
+        multiplier = _number(multiplier) or (previous.multiplier if previous else None)
+        if exchange is None or multiplier is None:
+            continue
+        tick = _number(tick) or (previous.tick if previous else None)
+        margin = _number(margin)
+        margin = round(margin / 100, 6) if margin else (previous.margin if previous else DEFAULT_MARGIN_RATE)
+        name = str(name).strip() if isinstance(name, str) else (previous.name if previous else '')
+        specs[variety] = ContractSpec(variety, exchange, multiplier, tick, margin, name)
+    return specs
+
+
+class ContractRegistry:
+    """
+    合约参数登记表：合约乘数、最小变动价位、保证金比例与交易所
+
+    参数以快照形式保存在本地（每个生效日期一个 JSON 文件），没有快照时使用内置参数。
+    当前快照在首次查询或 warm() 时加载为按品种索引的字典，查询均为 O(1)；
+    加载与刷新后同步更新 contract_multipliers / margin_rates，沿用这两个字典的代码无需修改。
+    """
+
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir is not None else default_specs_dir()
+        self._lock = threading.Lock()
+        self._versions = None
+        self._snapshots = {}
+        self._current = None
+        self._version = None
+
+    # ========== 快照读写 ==========
+
+    def _snapshot_path(self, version: int) -> Path:
+        return self.snapshot_dir / f"{version}.json"
+
+    def _scan(self) -> list:
+        """快照目录中的全部生效日期，已排序"""
+        if self._versions is None:
+            versions = []
+            if self.snapshot_dir.is_dir():
+                versions = [int(path.stem) for path in self.snapshot_dir.glob('*.json')
+                            if re.fullmatch(r'\d{8}', path.stem)]
+            self._versions = sorted(versions)
+        return self._versions
+
+    def _read(self, version: int) -> dict:
+        """读取某个生效日期的快照，读取失败返回 None"""
+        if version in self._snapshots:
+            return self._snapshots[version]
+        try:
+            with open(self._snapshot_path(version), encoding='utf-8') as f:
+                contracts = json.load(f)['contracts']
+            specs = {variety: ContractSpec(variety, item['exchange'], item['multiplier'], item.get('tick'),
+                                           item.get('margin', DEFAULT_MARGIN_RATE), item.get('name', ''))
+                     for variety, item in contracts.items()}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"读取合约参数快照 {version} 失败: {e}")
+            return None
+        self._snapshots[version] = specs
+        return specs
+
+    def _write(self, version: int, specs: dict, source: str):
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        payload = {
+            'effective_date': str(version),
+            'source': source,
+            'contracts': {variety: {'exchange': spec.exchange, 'multiplier': spec.multiplier, 'tick': spec.tick,
+                                    'margin': spec.margin, 'name': spec.name}
+                          for variety, spec in sorted(specs.items())},
+        }
+        # 先写临时文件再替换，避免其他进程读到写了一半的快照
+        path = self._snapshot_path(version)
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+    def _latest(self, until: int = None):
+        """不晚于 until 的最新可读快照，返回 (生效日期, 参数)；没有时返回内置参数"""
+        versions = self._scan()
+        index = len(versions) if until is None else bisect.bisect_right(versions, until)
+        for version in reversed(versions[:index]):
+            specs = self._read(version)
+            if specs is not None:
+                return version, specs
+        return BUILTIN_EFFECTIVE_DATE, builtin_specs()
+
+    def _activate(self, version: int, specs: dict):
+        self._current = specs
+        self._version = version
+        contract_multipliers.update({variety: spec.multiplier for variety, spec in specs.items()})
+        margin_rates.update({variety: spec.margin for variety, spec in specs.items()})
+
+    # ========== 加载与刷新 ==========
+
+    def warm(self, force: bool = False):
+        """加载当前快照并建立索引（Bot 启动时调用一次），返回自身"""
+        if self._current is not None and not force:
+            return self
+        with self._lock:
+            if self._current is None or force:
+                if force:
+                    self._versions = None
+                    self._snapshots.clear()
+                version, specs = self._latest()
+                self._activate(version, specs)
+                logger.info(f"已加载合约参数 {version}，共 {len(specs)} 个品种")
+        return self
+
+    def refresh(self, trade_date: str = None) -> bool:
+        """
+        从 akshare（国泰君安交易日历）获取最新合约参数，有变化时保存为新的快照
+
+        参数:
+        trade_date (str, optional): 参数生效的交易日（YYYYMMDD），默认为最近的交易日
+
+        返回:
+        bool: 获取成功返回 True（参数无变化时不写入新快照）
+        """
+        if trade_date is None:
+            from trading.trade_calendar import trading_calendar
+
+            today = date.today()
+            trade_date = str(trading_calendar.sessions(today - timedelta(days=15), today)[-1])
+
+        current = self.warm()._current
+        try:
+            import akshare as ak
+            from trading.fetch_guard import fetch_guard
+
+            frame = fetch_guard.call('GTJA', ak.futures_rule, date=trade_date, timeout=30)
+            fetched = parse_rule_frame(frame, known=current)
+        except Exception as e:
+            logger.warning(f"刷新合约参数失败: {e}")
+            return False
+        if not fetched:
+            logger.warning(f"刷新合约参数失败: {trade_date} 没有可识别的品种")
+            return False
+
+        # 表中暂未列出的品种（如临时停牌）沿用已有参数
+        version = int(trade_date)
+        with self._lock:
+            _, base = self._latest(until=version)
+            specs = dict(base, **fetched)
+            if specs == base:
+                # 参数未变化：更新最新快照的修改时间，记录本次核对
+                if self._versions:
+                    os.utime(self._snapshot_path(self._versions[-1]))
+                else:
+                    self._write(version, specs, 'akshare.futures_rule')
+                    self._versions = [version]
+                logger.info(f"合约参数无变化（{trade_date}）")
+                return True
+
+            self._write(version, specs, 'akshare.futures_rule')
+            self._snapshots[version] = specs
+            if version not in self._scan():
+                bisect.insort(self._versions, version)
+            if version >= self._version:
+                self._activate(version, specs)
+
+        added = sorted(set(specs) - set(base))
+        logger.info(f"合约参数已更新至 {trade_date}，共 {len(specs)} 个品种"
+                    + (f"，新增 {', '.join(added)}" if added else ''))
+        return True
+
+    def refresh_if_stale(self, max_age_days: float = None) -> bool:
+        """
+        快照超过 max_age_days 天未核对时刷新
+
+        参数:
+        max_age_days (float, optional): 默认读取环境变量 CONTRACT_REFRESH_DAYS，为 0 时不刷新
+
+        返回:
+        bool: 是否执行了刷新并成功
+        """
+        if max_age_days is None:
+            max_age_days = float(os.getenv('CONTRACT_REFRESH_DAYS') or DEFAULT_REFRESH_DAYS)
+        if max_age_days <= 0:
+            return False
+
+        versions = self._scan()
+        if versions:
+            age = time.time() - self._snapshot_path(versions[-1]).stat().st_mtime
+            if age < max_age_days * 86400:
+                return False
+        return self.refresh()
+
+    # ========== 查询 ==========
+
+    @property
+    def version(self) -> int:
+        """当前快照的生效日期（YYYYMMDD）"""
+        self.warm()
+        return self._version
+
+    def spec(self, code: str):
+        """
+        品种或合约的参数，如 'RB'、'rb2510'
+
+        返回:
+        ContractSpec: 未登记的品种返回 None
+        """
+        specs = self._current if self._current is not None else self.warm()._current
+        found = specs.get(code)
+        if found is None and isinstance(code, str):
+            match = VARIETY_PATTERN.match(code)
+            if match:
+                found = specs.get(match.group(1).upper())
+        return found
+
+    def multiplier(self, code: str, default=None):
+        """合约乘数"""
+        found = self.spec(code)
+        return found.multiplier if found is not None else default
+
+    def tick_size(self, code: str, default=None):
+        """最小变动价位"""
+        found = self.spec(code)
+        return found.tick if found is not None and found.tick is not None else default
+
+    def margin_rate(self, code: str, default: float = DEFAULT_MARGIN_RATE) -> float:
+        """交易所保证金比例，未登记的品种返回 default"""
+        found = self.spec(code)
+        return found.margin if found is not None else default
+
+    def exchange(self, code: str, default=None):
+        """所属交易所代码，如 'SHFE'"""
+        found = self.spec(code)
+        return found.exchange if found is not None else default
+
+    def varieties(self, exchange: str = None) -> list:
+        """已登记的品种，可按交易所筛选"""
+        specs = self._current if self._current is not None else self.warm()._current
+        return sorted(variety for variety, spec in specs.items() if exchange is None or spec.exchange == exchange)
+
+    def as_of(self, day) -> dict:
+        """
+        某日生效的合约参数（回测按历史参数计算时使用）
+
+        参数:
+        day: 日期（YYYYMMDD 字符串、整数或日期对象）
+
+        返回:
+        dict: {品种: ContractSpec}，早于全部快照时返回内置参数
+        """
+        key = int(day.strftime('%Y%m%d')) if isinstance(day, date) else int(str(day).replace('-', ''))
+        with self._lock:
+            return dict(self._latest(until=key)[1])
+
+
+# 创建全局合约参数登记表（首次查询或启动时 warm() 加载）
+contract_registry = ContractRegistry()
@@ -1,84 +1,265 @@
-import akshare as ak
-import pandas as pd
+from __future__ import annotations
+
+import logging
+from collections import namedtuple
+from typing import TYPE_CHECKING
+
 from trading.contracts import contract_multipliers, exchanges
-import re
 
+# akshare 导入约需 1.5 秒、pandas 约 0.5 秒，推迟到首次取数时导入
+if TYPE_CHECKING:
+    import pandas as pd
 
-# 从ak接口获得原始数据
-def fetch_raw_data(start_date: str, end_date: str, market: str = None) -> pd.DataFrame:
+logger = logging.getLogger(__name__)
+
+# 单次接口调用最多包含的交易日数。akshare 在区间内逐日请求，分段不减少请求数，
+# 但失败时只需重试该段，且成功的分段可以立即记为已缓存
+MAX_CHUNK_SESSIONS = 60
+
+# 取数计划中的一段：交易所、起止日期（YYYYMMDD）、包含的交易日（int32 数组）
+FetchChunk = namedtuple('FetchChunk', ['exchange', 'start_date', 'end_date', 'sessions'])
+
+# 分段调用的截止时间：基础秒数 + 每个交易日的秒数
+CALL_TIMEOUT_BASE = 30.0
+CALL_TIMEOUT_PER_SESSION = 5.0
+
+
+def _validate_range(start_date: str, end_date: str):
+    from trading.trade_calendar import parse_date
+
+    # 严格校验日期格式为YYYYMMDD八位数字并验证日期有效性
+    parse_date(start_date, '开始日期')
+    parse_date(end_date, '结束日期')
+
+
+def _resolve_markets(market: str = None) -> list:
+    """确定要查询的交易所列表"""
+    if market is not None:
+        if market not in exchanges:
+            raise ValueError(f"指定的交易所 '{market}' 不在支持的交易所列表中: {exchanges}")
+        return [market]
+    return exchanges
+
+
+def plan_fetch(start_date: str, end_date: str, markets=None, store=None,
+               max_sessions: int = MAX_CHUNK_SESSIONS) -> list:
     """
-    获取期货日线数据
+    生成取数计划
+
+    只请求交易日；给定 store 时跳过已缓存的交易日，并且只计划日线已可获取的交易日。
+    每个交易所在交易日历上连续缺失的交易日合并为一段，超过 max_sessions 时再拆分。
 
     参数:
     start_date (str): 开始日期，格式为YYYYMMDD
     end_date (str): 结束日期，格式为YYYYMMDD
-    market (str, optional): 指定交易所，如果为None则获取所有交易所数据
+    markets (list, optional): 交易所列表，默认为全部交易所
+    store (BarStore, optional): 行情存储，用于跳过已缓存的交易日
+    max_sessions (int): 每段最多包含的交易日数
 
     返回:
-    pd.DataFrame: 拼接后的完整数据框
+    list: FetchChunk 列表
+    """
+    import numpy as np
 
-    异常:
-    ValueError: 当日期格式不正确时抛出
+    from trading.trade_calendar import trading_calendar
+
+    end = int(end_date)
+    if store is not None:
+        end = min(end, trading_calendar.latest_settled_session())
+    sessions = trading_calendar.sessions(start_date, end) if int(start_date) <= end else \
+        np.empty(0, dtype=np.int32)
+
+    chunks = []
+    for exchange in markets or exchanges:
+        missing = store.missing_sessions(exchange, sessions) if store is not None else sessions
+        if len(missing) == 0:
+            continue
+
+        # 缺失交易日在日历中的位置不连续处断开
+        positions = np.searchsorted(sessions, missing)
+        for run in np.split(missing, np.flatnonzero(np.diff(positions) != 1) + 1):
+            for i in range(0, len(run), max_sessions):
+                part = run[i:i + max_sessions]
+                chunks.append(FetchChunk(exchange, str(part[0]), str(part[-1]), part))
+    return chunks
+
+
+def _chunk_timeout(chunk: FetchChunk) -> float:
+    """分段调用的截止时间，akshare 逐日请求，按交易日数放宽"""
+    return CALL_TIMEOUT_BASE + CALL_TIMEOUT_PER_SESSION * len(chunk.sessions)
+
+
+def _fetch_chunks(chunks, normalize: bool = True):
     """
+    按取数计划调用接口（经 fetch_guard 限时、重试与熔断）
 
-    # 严格校验日期格式为YYYYMMDD八位数字
-    date_pattern = r'^\d{8}$'
-    if not re.match(date_pattern, start_date):
-        raise ValueError(f"开始日期格式错误，应为YYYYMMDD格式的八位数字，当前输入: {start_date}")
-    if not re.match(date_pattern, end_date):
-        raise ValueError(f"结束日期格式错误，应为YYYYMMDD格式的八位数字，当前输入: {end_date}")
-
-    # 验证日期的有效性
-    try:
-        pd.to_datetime(start_date, format='%Y%m%d')
-        pd.to_datetime(end_date, format='%Y%m%d')
-    except ValueError as e:
-        raise ValueError(f"日期无效: {e}")
-
-    # 确定要查询的交易所列表
-    if market is not None:
-        if market not in exchanges:
-            raise ValueError(f"指定的交易所 '{market}' 不在支持的交易所列表中: {exchanges}")
-        markets_to_query = [market]
-    else:
-        markets_to_query = exchanges
+    返回:
+    tuple: (数据列表, FetchReport)
+    """
+    import akshare as ak
 
-    # 存储所有数据的列表
-    all_data = []
+    from trading.fetch_guard import FetchReport, fetch_guard
+    from trading.schema import normalize_bars
 
-    # 遍历每个交易所获取数据
-    for exchange in markets_to_query:
+    all_data = []
+    report = FetchReport()
+    for chunk in chunks:
+        report.add_requested(chunk.exchange, chunk.sessions)
+        job = {'job_id': f"{chunk.exchange}:{chunk.start_date}-{chunk.end_date}"}
         try:
-            print(f"正在获取 {exchange} 交易所数据...")
+            logger.info(f"正在获取 {chunk.exchange} 交易所 {chunk.start_date}-{chunk.end_date} 数据...", extra=job)
 
             # 调用akshare接口获取期货日线数据
-            df = ak.get_futures_daily(
-                start_date=start_date,
-                end_date=end_date,
-                market=exchange
+            df = fetch_guard.call(
+                chunk.exchange,
+                ak.get_futures_daily,
+                timeout=_chunk_timeout(chunk),
+                start_date=chunk.start_date,
+                end_date=chunk.end_date,
+                market=chunk.exchange
             )
 
             if df is not None and not df.empty:
-                # 添加交易所标识列
-                df['exchange'] = exchange
+                if normalize:
+                    # 逐个交易所规范化，交易所标识直接编码为分类列
+                    df = normalize_bars(df, chunk.exchange)
+                else:
+                    # 添加交易所标识列
+                    df['exchange'] = chunk.exchange
                 all_data.append(df)
-                print(f"成功获取 {exchange} 数据，共 {len(df)} 条记录")
+                logger.info(f"成功获取 {chunk.exchange} 数据，共 {len(df)} 条记录", extra=job)
             else:
-                print(f"警告: {exchange} 交易所在指定日期范围内无数据")
+                logger.info(f"{chunk.exchange} 交易所在 {chunk.start_date}-{chunk.end_date} 内无数据", extra=job)
+            report.add_fetched(chunk.exchange, chunk.sessions)
 
         except Exception as e:
-            print(f"获取 {exchange} 交易所数据时出现错误: {str(e)}")
+            logger.error(f"获取 {chunk.exchange} 交易所数据时出现错误: {str(e)}", extra=job)
+            report.add_failure(chunk.exchange, chunk.start_date, chunk.end_date, e)
             continue
 
-    # 拼接所有数据
-    if all_data:
-        result_df = pd.concat(all_data, ignore_index=True)
-        print(f"数据获取完成，总共 {len(result_df)} 条记录")
-        return result_df
-    else:
-        print("警告: 未能获取到任何数据")
+    return all_data, report
+
+
+def _combine(all_data, normalize: bool = True) -> pd.DataFrame:
+    import pandas as pd
+
+    from trading.schema import concat_bars
+
+    if not all_data:
         return pd.DataFrame()
+    return concat_bars(all_data) if normalize else pd.concat(all_data, ignore_index=True)
+
+
+def fetch_with_report(start_date: str, end_date: str, market: str = None,
+                      normalize: bool = True):
+    """
+    获取期货日线数据，并返回完整性报告
+
+    参数同 fetch_raw_data
+
+    返回:
+    tuple: (pd.DataFrame, FetchReport)，报告列出未能获取的交易所与交易日
+
+    异常:
+    ValueError: 当日期格式不正确时抛出
+    """
+    _validate_range(start_date, end_date)
+    chunks = plan_fetch(start_date, end_date, _resolve_markets(market))
+
+    all_data, report = _fetch_chunks(chunks, normalize)
+    result_df = _combine(all_data, normalize)
+    if result_df.empty:
+        logger.warning("未能获取到任何数据")
+    else:
+        logger.info(f"数据获取完成，总共 {len(result_df)} 条记录")
+    if not report.complete:
+        logger.warning(report.summary())
+    return result_df, report
+
+
+# 从ak接口获得原始数据
+def fetch_raw_data(start_date: str, end_date: str, market: str = None,
+                   normalize: bool = True) -> pd.DataFrame:
+    """
+    获取期货日线数据（只请求交易日，区间内没有交易日时不调用接口）
+
+    参数:
+    start_date (str): 开始日期，格式为YYYYMMDD
+    end_date (str): 结束日期，格式为YYYYMMDD
+    market (str, optional): 指定交易所，如果为None则获取所有交易所数据
+    normalize (bool): 是否转换为 trading.schema 定义的紧凑结构，默认为True
+
+    返回:
+    pd.DataFrame: 拼接后的完整数据框；完整性报告见 df.attrs['fetch_report']
+
+    异常:
+    ValueError: 当日期格式不正确时抛出
+    """
+    result_df, report = fetch_with_report(start_date, end_date, market, normalize)
+    result_df.attrs['fetch_report'] = report
+    return result_df
+
+
+def ensure_bars(start_date: str, end_date: str, market: str = None, store=None):
+    """
+    确保本地行情存储缓存了区间内的所有交易日，只从接口获取未缓存的交易日
+
+    成功获取的交易日（包括无行情的交易日）写入存储后记为已缓存，之后不再请求；
+    失败的交易日不记录，下次调用时重新获取。
+
+    参数:
+    start_date (str): 开始日期，格式为YYYYMMDD
+    end_date (str): 结束日期，格式为YYYYMMDD
+    market (str, optional): 指定交易所，如果为None则处理所有交易所
+    store (BarStore, optional): 行情存储，默认为全局 bar_store
+
+    返回:
+    FetchReport: 本次取数的完整性报告（无需取数时为空报告）
+
+    异常:
+    ValueError: 当日期格式不正确时抛出
+    """
+    from trading.fetch_guard import FetchReport
+
+    if store is None:
+        from trading.bar_store import bar_store as store
+
+    _validate_range(start_date, end_date)
+
+    report = FetchReport()
+    chunks = plan_fetch(start_date, end_date, _resolve_markets(market), store)
+    if chunks:
+        all_data, report = _fetch_chunks(chunks)
+        store.write(_combine(all_data), report.fetched)
+        if not report.complete:
+            logger.warning(report.summary())
+    return report
+
+
+def load_bars(start_date: str, end_date: str, market: str = None, store=None) -> pd.DataFrame:
+    """
+    获取期货日线数据，优先读取本地行情存储（见 ensure_bars）
+
+    参数同 ensure_bars
+
+    返回:
+    pd.DataFrame: 规范化后的日线数据；完整性报告见 df.attrs['fetch_report']
+    """
+    if store is None:
+        from trading.bar_store import bar_store as store
+
+    report = ensure_bars(start_date, end_date, market, store)
+    result_df = store.load_frame(start_date, end_date, _resolve_markets(market))
+    result_df.attrs['fetch_report'] = report
+    return result_df
+
 
+if __name__ == '__main__':
+    from trading.schema import concat_bars, memory_report, normalize_bars
 
-testdata = fetch_raw_data("20250603","20250603","CFFEX")
-print(testdata)
\ No newline at end of file
+    # 对比一年全交易所数据规范化前后的内存占用
+    raw = fetch_raw_data("20240101", "20241231", normalize=False)
+    normalized = concat_bars([normalize_bars(part) for _, part in raw.groupby('exchange')])
+    report = memory_report(raw, normalized)
+    print(f"{report['rows']} 条记录：{report['before_bytes'] / 2 ** 20:.1f}MB -> "
+          f"{report['after_bytes'] / 2 ** 20:.1f}MB，减少 {report['reduction']:.0%}")
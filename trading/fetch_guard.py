@@ -0,0 +1,198 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FetchTimeout(TimeoutError):
+    """接口调用超过截止时间"""
+
+
+class CircuitOpenError(RuntimeError):
+    """交易所熔断中，调用被直接拒绝"""
+
+
+def call_with_deadline(func, timeout: float, *args, **kwargs):
+    """
+    在守护线程中调用 func，超过 timeout 秒未返回时抛出 FetchTimeout
+
+    akshare 的请求无法中途取消，超时的线程会被放弃并在后台自行结束，不阻塞调用方和进程退出。
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True, name='fetch-call').start()
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        if future.done():
+            raise
+        raise FetchTimeout(f"调用超过 {timeout:g} 秒未返回")
+
+
+class RetryPolicy:
+    """指数退避重试，等待时间在 [0, min(max_delay, base_delay * 2^n)] 内随机（full jitter）"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    单个数据源的熔断器
+
+    连续失败 failure_threshold 次后熔断，reset_timeout 秒内的调用直接拒绝；
+    之后放行一次试探调用，成功则恢复，失败则重新熔断。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否允许发起调用"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class FetchGuard:
+    """
+    取数调用的执行层：每次调用有截止时间，失败按抖动指数退避重试，每个交易所独立熔断
+
+    参数:
+    retry (RetryPolicy, optional): 重试策略
+    failure_threshold (int): 连续失败多少次后熔断
+    reset_timeout (float): 熔断持续秒数
+    """
+
+    def __init__(self, retry: RetryPolicy = None, failure_threshold: int = 3, reset_timeout: float = 300.0):
+        self.retry = retry or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, source: str) -> CircuitBreaker:
+        with self._lock:
+            if source not in self._breakers:
+                self._breakers[source] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[source]
+
+    def call(self, source: str, func, *args, timeout: float = 60.0, **kwargs):
+        """
+        调用 func，失败时重试
+
+        参数:
+        source (str): 数据源（交易所），熔断按数据源区分
+        func: 被调用的函数
+        timeout (float): 单次调用的截止时间（秒）
+
+        异常:
+        CircuitOpenError: 数据源熔断中
+        Exception: 重试耗尽后抛出最后一次的异常
+        """
+        breaker = self.breaker(source)
+        for attempt in range(self.retry.attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"{source} 连续失败，已熔断")
+            try:
+                result = call_with_deadline(func, timeout, *args, **kwargs)
+            except Exception as e:
+                breaker.record_failure()
+                if attempt + 1 >= self.retry.attempts:
+                    raise
+                delay = self.retry.delay(attempt)
+                logger.warning(f"{source} 第 {attempt + 1} 次调用失败: {e}，{delay:.1f} 秒后重试")
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+
+class FetchReport:
+    """
+    一次取数的完整性报告
+
+    requested / fetched 为 {交易所: 交易日数组}，failures 记录失败分段 (交易所, 开始日期, 结束日期, 错误)。
+    """
+
+    def __init__(self):
+        self.requested = {}
+        self.fetched = {}
+        self.failures = []
+
+    def add_requested(self, exchange: str, sessions):
+        self.requested[exchange] = np.union1d(self.requested.get(exchange, []), sessions).astype(np.int32)
+
+    def add_fetched(self, exchange: str, sessions):
+        self.fetched[exchange] = np.union1d(self.fetched.get(exchange, []), sessions).astype(np.int32)
+
+    def add_failure(self, exchange: str, start_date: str, end_date: str, error: Exception):
+        self.failures.append((exchange, start_date, end_date, f"{type(error).__name__}: {error}"))
+
+    @property
+    def missing(self) -> dict:
+        """{交易所: 未获取到的交易日数组}，只包含有缺失的交易所"""
+        missing = {}
+        for exchange, sessions in self.requested.items():
+            lost = np.setdiff1d(sessions, self.fetched.get(exchange, [])).astype(np.int32)
+            if len(lost):
+                missing[exchange] = lost
+        return missing
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    def summary(self) -> str:
+        if self.complete:
+            return "数据完整"
+        parts = [f"{exchange} 缺 {len(dates)} 个交易日（{dates[0]}-{dates[-1]}）"
+                 for exchange, dates in self.missing.items()]
+        return "数据不完整：" + "；".join(parts)
+
+
+# 创建全局取数执行层实例（熔断状态在进程内共享）
+fetch_guard = FetchGuard()
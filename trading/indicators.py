@@ -0,0 +1,516 @@
+"""
+技术指标
+
+所有指标都建立在几个向量化的滚动原语之上：滚动和 / 平方和与滚动最大 / 最小（同一个 van Herk /
+Gil-Werman 分块归约）以及 EMA（分块闭式递推）。输入沿第0轴为时间，可以是一维（单个合约）
+或二维（时间 × 合约的面板）；窗口未满的位置为 NaN。
+
+Indicators 把一个合约（或面板）的行情与 IndicatorCache 绑定，结果按 (指标, 参数, 合约, 数据版本) 缓存。
+组合指标通过同一个缓存取中间结果，共用窗口的指标只计算一次：同周期的布林带（任意倍数）与 z-score
+共用滚动均值与标准差，Keltner 通道复用收盘价 EMA 与 ATR，均线交叉复用各自的均线。
+
+python -m trading.indicators 运行与 pandas 对照的自检。
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# EMA 分块递推时单块内权重的最大放大倍数，超过后开始新的一块（控制浮点误差）
+_EMA_MAX_GAIN = 1e8
+
+
+def _as_float(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+
+def _check_period(period: int):
+    if int(period) != period or period < 1:
+        raise ValueError(f"周期必须为正整数: {period}")
+
+
+# ========== 滚动原语 ==========
+
+def _window_reduce(values: np.ndarray, period: int, ufunc, pad_value: float) -> np.ndarray:
+    """
+    van Herk / Gil-Werman 分块滚动归约（适用于任意满足结合律的 ufunc：add、maximum、minimum）
+
+    按窗口长度分块，求块内的前缀归约与后缀归约；不与块首对齐的窗口恰好跨越相邻两块，结果为起点的
+    后缀归约与终点的前缀归约再归约一次。与窗口长度无关，每个元素约 3 次运算；求和时不做前缀和相减，
+    没有长序列累计和相减带来的精度损失。
+
+    返回:
+    np.ndarray: 长度为 len(values) - period + 1，第 i 项为窗口 [i, i+period) 的归约
+    """
+    n = len(values)
+    if period == 1:
+        return values.copy()
+    blocks = -(-n // period)
+    tail = (blocks * period - n,) + values.shape[1:]
+    padded = np.concatenate([values, np.full(tail, pad_value)])
+    shaped = padded.reshape((blocks, period) + values.shape[1:])
+    prefix = ufunc.accumulate(shaped, axis=1).reshape(padded.shape)
+    suffix = ufunc.accumulate(shaped[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    count = n - period + 1
+    result = ufunc(suffix[:count], prefix[period - 1:n])
+    # 起点与块首对齐的窗口恰为整块，只取后缀归约（求和时不能重复计入）
+    result[::period] = suffix[:count:period]
+    return result
+
+
+def _rolling(values, period: int, ufunc, pad_value: float) -> np.ndarray:
+    _check_period(period)
+    values = _as_float(values)
+    result = np.full(values.shape, np.nan)
+    if len(values) >= period:
+        result[period - 1:] = _window_reduce(values, period, ufunc, pad_value)
+    return result
+
+
+def rolling_sum(values, period: int) -> np.ndarray:
+    """
+    滚动和
+
+    参数:
+    values: 序列，沿第0轴为时间
+    period (int): 窗口长度
+
+    返回:
+    np.ndarray: 形状与 values 相同，前 period-1 个位置为 NaN；窗口内有 NaN 时结果为 NaN
+    """
+    return _rolling(values, period, np.add, 0.0)
+
+
+def rolling_max(values, period: int) -> np.ndarray:
+    """滚动最大值，前 period-1 个位置为 NaN；窗口内有 NaN 时结果为 NaN"""
+    return _rolling(values, period, np.maximum, -np.inf)
+
+
+def rolling_min(values, period: int) -> np.ndarray:
+    """滚动最小值，前 period-1 个位置为 NaN；窗口内有 NaN 时结果为 NaN"""
+    return _rolling(values, period, np.minimum, np.inf)
+
+
+def rolling_moments(values, period: int):
+    """
+    滚动均值与总体标准差（由滚动和与滚动平方和算出）
+
+    先减去各列首个有效值再求平方和，降低方差相减时的精度损失（面板中上市较晚的合约前段为 NaN，
+    不能用第0行平移，否则整列都成为 NaN）。
+
+    返回:
+    tuple: (mean, sd)，形状与 values 相同，前 period-1 个位置为 NaN
+    """
+    _check_period(period)
+    values = _as_float(values)
+    mean = np.full(values.shape, np.nan)
+    sd = np.full(values.shape, np.nan)
+    if len(values) >= period:
+        first = np.isfinite(values).argmax(axis=0)
+        shift = np.take_along_axis(values, np.expand_dims(first, 0), axis=0)
+        # 全为 NaN 的列不平移
+        shift = np.where(np.isfinite(shift), shift, 0.0)
+        centered = values - shift
+        centered_mean = _window_reduce(centered, period, np.add, 0.0) / period
+        var = _window_reduce(centered * centered, period, np.add, 0.0) / period - centered_mean * centered_mean
+        mean[period - 1:] = centered_mean + shift
+        sd[period - 1:] = np.sqrt(np.maximum(var, 0))
+    return mean, sd
+
+
+def ema(values, period: int, alpha: float = None) -> np.ndarray:
+    """
+    指数移动平均：以前 period 个值的简单平均为初值，之后 y[t] = alpha * x[t] + (1 - alpha) * y[t-1]
+
+    递推按块展开为闭式：块内 y[c+j] = d^(j+1) * y[c-1] + alpha * d^j * Σ x[c+k] * d^(-k)（d = 1 - alpha），
+    用一次累计和算出整块；块长度使 d^(-k) 不超过 _EMA_MAX_GAIN，保证精度。
+
+    参数:
+    values: 序列，沿第0轴为时间
+    period (int): 周期（决定初值窗口与默认平滑系数）
+    alpha (float, optional): 平滑系数，默认 2 / (period + 1)；Wilder 平滑（ATR）为 1 / period
+
+    返回:
+    np.ndarray: 形状与 values 相同，前 period-1 个位置为 NaN
+    """
+    _check_period(period)
+    values = _as_float(values)
+    alpha = 2.0 / (period + 1) if alpha is None else float(alpha)
+    if not 0 < alpha <= 1:
+        raise ValueError(f"平滑系数必须在 (0, 1] 内: {alpha}")
+
+    n = len(values)
+    result = np.full(values.shape, np.nan)
+    if n < period:
+        return result
+    result[period - 1] = values[:period].mean(axis=0)
+    decay = 1.0 - alpha
+    if decay == 0:
+        result[period:] = values[period:]
+        return result
+
+    block = max(1, int(np.log(_EMA_MAX_GAIN) / -np.log(decay)))
+    shape = (-1,) + (1,) * (values.ndim - 1)
+    previous = result[period - 1]
+    for start in range(period, n, block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1).reshape(shape)
+        # powers[j] = d^(j+1)，权重 d^(-k) = d / powers[k]
+        weighted = np.cumsum(chunk * (decay / powers), axis=0)
+        result[start:start + len(chunk)] = powers * previous + alpha * (powers / decay) * weighted
+        previous = result[start + len(chunk) - 1]
+    return result
+
+
+# ========== 指标 ==========
+
+def true_range(high, low, close) -> np.ndarray:
+    """真实波幅：max(最高 - 最低, |最高 - 前收|, |最低 - 前收|)，首根K线为最高 - 最低"""
+    high, low, close = _as_float(high), _as_float(low), _as_float(close)
+    result = high - low
+    if len(result) > 1:
+        previous = close[:-1]
+        result[1:] = np.maximum(result[1:], np.maximum(np.abs(high[1:] - previous), np.abs(low[1:] - previous)))
+    return result
+
+
+def atr(high, low, close, period: int = 14) -> np.ndarray:
+    """平均真实波幅（Wilder 平滑）"""
+    return ema(true_range(high, low, close), period, alpha=1.0 / period)
+
+
+def bollinger_bands(closes, period: int, std: float):
+    """
+    计算滚动布林带（向量化，基于滚动和与平方和）
+
+    参数:
+    closes (np.ndarray): 收盘价序列，沿第0轴为时间，可为一维或二维
+    period (int): 布林带周期
+    std (float): 布林带标准差倍数
+
+    返回:
+    tuple: (middle, upper, lower)，形状与 closes 相同，前 period-1 个位置为 NaN
+    """
+    middle, sd = rolling_moments(closes, period)
+    return middle, middle + std * sd, middle - std * sd
+
+
+def keltner_channels(high, low, close, period: int = 20, multiplier: float = 2.0, atr_period: int = None):
+    """
+    Keltner 通道：中轨为收盘价 EMA，上下轨为中轨 ± multiplier × ATR
+
+    返回:
+    tuple: (middle, upper, lower)
+    """
+    middle = ema(close, period)
+    band = multiplier * atr(high, low, close, atr_period or period)
+    return middle, middle + band, middle - band
+
+
+def donchian_channels(high, low, period: int = 20):
+    """
+    唐奇安通道：period 根K线的最高价与最低价
+
+    返回:
+    tuple: (upper, middle, lower)
+    """
+    upper = rolling_max(high, period)
+    lower = rolling_min(low, period)
+    return upper, (upper + lower) / 2, lower
+
+
+def crossings(fast, slow) -> np.ndarray:
+    """
+    两条线的交叉点
+
+    返回:
+    np.ndarray: int8，快线上穿慢线为 1，下穿为 -1，其余（含任一值为 NaN）为 0
+    """
+    fast, slow = _as_float(fast), _as_float(slow)
+    with np.errstate(invalid='ignore'):
+        side = np.sign(fast - slow)
+    result = np.zeros(side.shape, dtype=np.int8)
+    if len(side) > 1:
+        before, after = side[:-1], side[1:]
+        valid = ~np.isnan(before) & ~np.isnan(after)
+        result[1:][valid & (after > 0) & (before <= 0)] = 1
+        result[1:][valid & (after < 0) & (before >= 0)] = -1
+    return result
+
+
+def moving_average(values, period: int, kind: str = 'sma') -> np.ndarray:
+    """简单（sma）或指数（ema）移动平均"""
+    if kind == 'sma':
+        return rolling_sum(values, period) / period
+    if kind == 'ema':
+        return ema(values, period)
+    raise ValueError(f"未知的均线类型: {kind}")
+
+
+def ma_cross(values, fast: int, slow: int, kind: str = 'sma'):
+    """
+    均线交叉
+
+    返回:
+    tuple: (fast_ma, slow_ma, cross)，cross 见 crossings
+    """
+    fast_ma = moving_average(values, fast, kind)
+    slow_ma = moving_average(values, slow, kind)
+    return fast_ma, slow_ma, crossings(fast_ma, slow_ma)
+
+
+def zscore(values, period: int) -> np.ndarray:
+    """滚动 z-score：(值 - 滚动均值) / 滚动标准差；标准差为0时为 NaN"""
+    mean, sd = rolling_moments(values, period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(sd > 0, (_as_float(values) - mean) / sd, np.nan)
+
+
+# ========== 结果缓存 ==========
+
+def _freeze(value):
+    """缓存的数组设为只读，避免调用方修改共享结果"""
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, tuple):
+        for item in value:
+            _freeze(item)
+    return value
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+class IndicatorCache:
+    """
+    指标结果缓存（LRU，按占用字节数限制大小）
+
+    键为 (指标, 参数, 合约, 数据版本)。计算在锁外进行，组合指标计算时可以递归读取中间结果；
+    并发的相同请求可能各算一次，结果相同，后写入的覆盖先写入的。
+
+    参数:
+    max_bytes (int): 缓存数组的总字节数上限
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = _freeze(compute())
+        size = _nbytes(value)
+        with self._lock:
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            # 至少保留刚写入的一项
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                evicted, _ = self._entries.popitem(last=False)
+                self.nbytes -= self._sizes.pop(evicted)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+
+# 全局指标缓存实例
+indicator_cache = IndicatorCache()
+
+
+class Indicators:
+    """
+    一个合约（或面板）的指标计算入口，结果经 IndicatorCache 缓存
+
+    参数:
+    symbol: 合约代码；面板可用任意可哈希的名称
+    bars (dict): {字段: 数组}，至少包含 close，ATR / Keltner / 唐奇安通道需要 high、low
+    data_version: 行情数据版本，数据更新后改变，旧版本的结果不再命中并逐渐被淘汰
+    cache (IndicatorCache, optional): 默认使用全局缓存
+    """
+
+    def __init__(self, symbol, bars: dict, data_version=0, cache: IndicatorCache = None):
+        self.symbol = symbol
+        self.data_version = data_version
+        self._bars = bars
+        self._cache = cache if cache is not None else indicator_cache
+
+    def _get(self, name: str, params: tuple, compute):
+        return self._cache.get_or_compute((name, params, self.symbol, self.data_version), compute)
+
+    def field(self, name: str) -> np.ndarray:
+        """行情字段（float64，缓存转换结果）"""
+        if name not in self._bars:
+            raise KeyError(f"{self.symbol} 缺少行情字段 {name}")
+        return self._get('field', (name,), lambda: np.array(self._bars[name], dtype=np.float64))
+
+    # ---------- 共用的中间结果 ----------
+
+    def moments(self, period: int, field: str = 'close'):
+        """滚动均值与标准差，布林带与 z-score 共用"""
+        return self._get('moments', (period, field), lambda: rolling_moments(self.field(field), period))
+
+    def sma(self, period: int, field: str = 'close') -> np.ndarray:
+        return self.moments(period, field)[0]
+
+    def ema(self, period: int, field: str = 'close') -> np.ndarray:
+        return self._get('ema', (period, field), lambda: ema(self.field(field), period))
+
+    def moving_average(self, period: int, kind: str = 'sma', field: str = 'close') -> np.ndarray:
+        if kind == 'sma':
+            return self.sma(period, field)
+        if kind == 'ema':
+            return self.ema(period, field)
+        raise ValueError(f"未知的均线类型: {kind}")
+
+    def true_range(self) -> np.ndarray:
+        return self._get('true_range', (), lambda: true_range(
+            self.field('high'), self.field('low'), self.field('close')))
+
+    def highest(self, period: int, field: str = 'high') -> np.ndarray:
+        return self._get('highest', (period, field), lambda: rolling_max(self.field(field), period))
+
+    def lowest(self, period: int, field: str = 'low') -> np.ndarray:
+        return self._get('lowest', (period, field), lambda: rolling_min(self.field(field), period))
+
+    # ---------- 指标 ----------
+
+    def atr(self, period: int = 14) -> np.ndarray:
+        return self._get('atr', (period,), lambda: ema(self.true_range(), period, alpha=1.0 / period))
+
+    def bollinger(self, period: int, std: float):
+        """(middle, upper, lower)"""
+        def compute():
+            middle, sd = self.moments(period)
+            return middle, middle + std * sd, middle - std * sd
+
+        return self._get('bollinger', (period, std), compute)
+
+    def keltner(self, period: int = 20, multiplier: float = 2.0, atr_period: int = None):
+        """(middle, upper, lower)"""
+        atr_period = atr_period or period
+
+        def compute():
+            middle = self.ema(period)
+            band = multiplier * self.atr(atr_period)
+            return middle, middle + band, middle - band
+
+        return self._get('keltner', (period, multiplier, atr_period), compute)
+
+    def donchian(self, period: int = 20):
+        """(upper, middle, lower)"""
+        def compute():
+            upper, lower = self.highest(period), self.lowest(period)
+            return upper, (upper + lower) / 2, lower
+
+        return self._get('donchian', (period,), compute)
+
+    def ma_cross(self, fast: int, slow: int, kind: str = 'sma'):
+        """(fast_ma, slow_ma, cross)"""
+        def compute():
+            fast_ma = self.moving_average(fast, kind)
+            slow_ma = self.moving_average(slow, kind)
+            return fast_ma, slow_ma, crossings(fast_ma, slow_ma)
+
+        return self._get('ma_cross', (fast, slow, kind), compute)
+
+    def zscore(self, period: int) -> np.ndarray:
+        def compute():
+            mean, sd = self.moments(period)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(sd > 0, (self.field('close') - mean) / sd, np.nan)
+
+        return self._get('zscore', (period,), compute)
+
+
+def symbol_indicators(symbol: str, start_date: str = None, end_date: str = None,
+                      cache: IndicatorCache = None) -> Indicators:
+    """
+    从本地行情存储读取合约日线并创建 Indicators（以存储的数据版本为缓存版本）
+
+    参数:
+    symbol (str): 合约代码
+    start_date (str, optional): 开始日期，格式为YYYYMMDD
+    end_date (str, optional): 结束日期，格式为YYYYMMDD
+
+    返回:
+    Indicators: 合约不存在时行情为空
+    """
+    from trading.bar_store import bar_store
+
+    bars = bar_store.history(symbol, start_date, end_date)
+    return Indicators(symbol, bars, (bar_store.data_version, start_date, end_date), cache)
+
+
+def self_check() -> list:
+    """
+    与 pandas 的滚动均值 / 总体标准差对照检查 rolling_moments
+
+    覆盖：单个序列、前段为 NaN 的序列（上市较晚的合约）、含全 NaN 列与较晚开始的列的面板。
+
+    返回:
+        list: 各项检查的说明
+
+    异常:
+        AssertionError: 任一检查不通过
+    """
+    import pandas as pd
+
+    def expected(frame, period):
+        rolling = frame.rolling(period)
+        return rolling.mean().to_numpy(), rolling.std(ddof=0).to_numpy()
+
+    rng = np.random.default_rng(0)
+    prices = 3500 + rng.normal(0, 20, (60, 4)).cumsum(axis=0)
+    prices[:15, 1] = np.nan
+    prices[:, 2] = np.nan
+    prices[:59, 3] = np.nan
+    cases = [
+        ("单个序列", prices[:, 0]),
+        ("前段为 NaN 的序列", np.array([np.nan, np.nan, 1, 2, 3, 4, 5, 6])),
+        ("面板（较晚开始、全 NaN、只有一根K线的列）", prices),
+    ]
+
+    passed = []
+    for name, values in cases:
+        for period in (1, 3, 20):
+            mean, sd = rolling_moments(values, period)
+            want_mean, want_sd = expected(pd.DataFrame(values), period)
+            shape = np.shape(values)
+            np.testing.assert_allclose(mean, want_mean.reshape(shape), rtol=1e-9, atol=1e-9,
+                                       err_msg=f"{name} 周期 {period} 的均值")
+            np.testing.assert_allclose(sd, want_sd.reshape(shape), rtol=1e-7, atol=1e-7,
+                                       err_msg=f"{name} 周期 {period} 的标准差")
+        passed.append(f"rolling_moments: {name}与 pandas 一致")
+    return passed
+
+
+if __name__ == '__main__':
+    for line in self_check():
+        print(f"通过 {line}")
@@ -0,0 +1,372 @@
+"""
+盘中分钟K线流式布林带
+
+数据源（新浪分钟线接口或本地文件回放）按轮询返回新完成的K线，RollingBands 为每个合约维护一个
+预分配的 NumPy 环形缓冲区，每根K线以 O(1) 更新滚动和与平方和；IntradayMonitor 在收盘价
+突破/跌破布林带时产生事件。内存只与合约数和周期有关，与盘中运行时长无关。
+"""
+import asyncio
+import csv
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from trading.signal import SIGNAL_LONG, SIGNAL_SHORT
+
+logger = logging.getLogger(__name__)
+
+MINUTE_COLUMNS = ['symbol', 'datetime', 'open', 'high', 'low', 'close', 'volume']
+
+# time 为 numpy.datetime64（分钟精度）
+MinuteBar = namedtuple('MinuteBar', ['symbol', 'time', 'open', 'high', 'low', 'close', 'volume'])
+BandBreak = namedtuple('BandBreak', ['symbol', 'time', 'close', 'middle', 'upper', 'lower', 'signal'])
+
+# 尚未收到K线的合约的最后时间
+_NO_TIME = np.iinfo(np.int64).min
+
+
+def _minute_keys(values) -> np.ndarray:
+    """时间列转为自纪元起的分钟数（int64）"""
+    return pd.to_datetime(values).values.astype('datetime64[m]').astype(np.int64)
+
+
+def frame_to_bars(symbol: str, frame: pd.DataFrame, after: int = _NO_TIME) -> list:
+    """
+    将分钟线表格转为 MinuteBar 列表
+
+    参数:
+    symbol (str): 合约代码
+    frame (pd.DataFrame): 包含 datetime、open、high、low、close、volume 列
+    after (int): 只保留时间晚于该分钟数的K线
+
+    返回:
+    list: 按时间排序的 MinuteBar
+    """
+    if frame.empty:
+        return []
+    keys = _minute_keys(frame['datetime'])
+    keep = keys > after
+    columns = [frame[name].to_numpy(dtype=np.float64)[keep] for name in ('open', 'high', 'low', 'close', 'volume')]
+    times = keys[keep].astype('datetime64[m]')
+    return [MinuteBar(symbol, time, *values) for time, *values in zip(times, *columns)]
+
+
+class MinuteBarSource(ABC):
+    """
+    分钟K线数据源接口
+
+    history 返回开始监控前已完成的K线（用于预热，不产生信号），poll 返回自上次调用以来新完成的K线。
+    子类必须实现 poll。
+    """
+
+    @property
+    def exhausted(self) -> bool:
+        """数据源是否已无更多数据（实时数据源始终为 False）"""
+        return False
+
+    def history(self, symbols) -> list:
+        return []
+
+    @abstractmethod
+    def poll(self, symbols) -> list:
+        """自上次调用以来新完成的K线（MinuteBar 列表，按时间排序）"""
+
+
+class AkshareMinuteSource(MinuteBarSource):
+    """
+    新浪分钟线数据源（ak.futures_zh_minute_sina）
+
+    接口每次返回当日全部分钟线，最后一根仍在形成中，等出现更新的K线后才输出。
+    指定 record_path 时把输出的K线追加到 CSV，之后可用 FileReplaySource 回放。
+    """
+
+    def __init__(self, period: str = '1', timeout: float = 10.0, record_path: str = None):
+        self.period = period
+        self.timeout = timeout
+        self.record_path = record_path
+        self._last = {}
+
+    def _fetch(self, symbol: str) -> list:
+        import akshare as ak
+        from trading.fetch_guard import fetch_guard
+
+        try:
+            frame = fetch_guard.call('SINA_MINUTE', ak.futures_zh_minute_sina,
+                                     symbol=symbol, period=self.period, timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f"获取 {symbol} 分钟线失败: {e}", extra={'job_id': f"intraday:{symbol}"})
+            return []
+
+        bars = frame_to_bars(symbol, frame.iloc[:-1], self._last.get(symbol, _NO_TIME))
+        if bars:
+            self._last[symbol] = int(bars[-1].time.astype(np.int64))
+        return bars
+
+    def poll(self, symbols) -> list:
+        bars = [bar for symbol in symbols for bar in self._fetch(symbol)]
+        if bars and self.record_path:
+            self._record(bars)
+        return bars
+
+    history = poll
+
+    def _record(self, bars: list):
+        new_file = not os.path.exists(self.record_path)
+        with open(self.record_path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(MINUTE_COLUMNS)
+            writer.writerows((bar.symbol, str(bar.time), bar.open, bar.high, bar.low, bar.close, bar.volume)
+                             for bar in bars)
+
+
+def _replay_bars(frame: pd.DataFrame) -> list:
+    """多合约分钟线表格（datetime 已转为分钟数）转为 MinuteBar 列表，保持行顺序"""
+    times = frame['datetime'].to_numpy(dtype=np.int64).astype('datetime64[m]')
+    columns = [frame[name].to_numpy(dtype=np.float64) for name in ('open', 'high', 'low', 'close', 'volume')]
+    return [MinuteBar(symbol, time, *values)
+            for symbol, time, *values in zip(frame['symbol'].astype(str), times, *columns)]
+
+
+class FileReplaySource(MinuteBarSource):
+    """
+    按时间顺序回放分钟线文件（CSV，列见 MINUTE_COLUMNS），每次 poll 返回下一分钟的全部K线
+
+    参数:
+    source: CSV 路径或 DataFrame
+    warm_up (int): 作为 history 返回的前若干分钟
+    """
+
+    def __init__(self, source, warm_up: int = 0):
+        frame = pd.read_csv(source) if isinstance(source, (str, os.PathLike)) else source
+        frame = frame.assign(datetime=_minute_keys(frame['datetime'])).sort_values('datetime', kind='stable')
+
+        self._bars = _replay_bars(frame)
+        keys = frame['datetime'].to_numpy()
+        # 每一分钟在 _bars 中的起止位置
+        self._bounds = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1], True])
+        self._cursor = 0
+        self.warm_up = warm_up
+
+    @property
+    def exhausted(self) -> bool:
+        return self._cursor >= len(self._bounds) - 1
+
+    def _take(self, minutes: int, symbols) -> list:
+        end = min(self._cursor + minutes, len(self._bounds) - 1)
+        bars = self._bars[self._bounds[self._cursor]:self._bounds[end]]
+        self._cursor = end
+        if symbols is None:
+            return bars
+        wanted = set(symbols)
+        return [bar for bar in bars if bar.symbol in wanted]
+
+    def history(self, symbols) -> list:
+        return self._take(self.warm_up, symbols) if self.warm_up else []
+
+    def poll(self, symbols) -> list:
+        return self._take(1, symbols)
+
+
+class RollingBands:
+    """
+    多合约滚动布林带，所有合约共用预分配的二维环形缓冲区
+
+    每根K线只更新滚动和与平方和（O(1)）；每写满一轮缓冲区按窗口重新求和一次，消除浮点累计误差。
+    与 trading.indicators.bollinger_bands 相同，先减去合约首个价格再累加，标准差为总体标准差。
+
+    参数:
+    period (int): 布林带周期
+    std (float): 标准差倍数
+    capacity (int): 初始合约容量，超出时按倍数扩容
+    """
+
+    def __init__(self, period: int, std: float, capacity: int = 64):
+        if period < 1:
+            raise ValueError("布林带周期必须为正整数")
+        self.period = period
+        self.std = std
+        self._rows = {}
+        # 每个合约当前相对布林带的位置：1 上轨之上，-1 下轨之下，0 带内（由 IntradayMonitor 维护）
+        self.state = None
+        self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity: int):
+        old = len(self._rows)
+        previous = getattr(self, '_window', None)
+
+        def grow(array, fill):
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:old] = array[:old]
+            return grown
+
+        if previous is None:
+            self._window = np.zeros((capacity, self.period))
+            self._pos = np.zeros(capacity, dtype=np.int64)
+            self._count = np.zeros(capacity, dtype=np.int64)
+            self._sum = np.zeros(capacity)
+            self._sumsq = np.zeros(capacity)
+            self._shift = np.zeros(capacity)
+            self._last_time = np.full(capacity, _NO_TIME, dtype=np.int64)
+            self.state = np.zeros(capacity, dtype=np.int8)
+        else:
+            self._window = grow(self._window, 0.0)
+            self._pos = grow(self._pos, 0)
+            self._count = grow(self._count, 0)
+            self._sum = grow(self._sum, 0.0)
+            self._sumsq = grow(self._sumsq, 0.0)
+            self._shift = grow(self._shift, 0.0)
+            self._last_time = grow(self._last_time, _NO_TIME)
+            self.state = grow(self.state, 0)
+
+    @property
+    def nbytes(self) -> int:
+        """缓冲区占用的字节数"""
+        return sum(array.nbytes for array in (self._window, self._pos, self._count, self._sum,
+                                              self._sumsq, self._shift, self._last_time, self.state))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _row(self, symbol: str) -> int:
+        row = self._rows.get(symbol)
+        if row is None:
+            row = len(self._rows)
+            if row >= len(self._window):
+                self._allocate(2 * len(self._window))
+            self._rows[symbol] = row
+        return row
+
+    def update(self, symbol: str, time: int, close: float):
+        """
+        加入一根K线的收盘价
+
+        参数:
+        symbol (str): 合约代码
+        time (int): K线时间（分钟数），不晚于该合约上一根K线的重复或乱序K线被忽略
+        close (float): 收盘价
+
+        返回:
+        tuple: (row, middle, upper, lower)；K线被忽略或不足 period 根时 middle 等为 None
+        """
+        row = self._row(symbol)
+        if time <= self._last_time[row] or not np.isfinite(close):
+            return row, None, None, None
+        self._last_time[row] = time
+
+        if self._count[row] == 0:
+            self._shift[row] = close
+        value = close - self._shift[row]
+        pos = self._pos[row]
+        window = self._window[row]
+
+        if self._count[row] >= self.period:
+            dropped = window[pos]
+            self._sum[row] += value - dropped
+            self._sumsq[row] += value * value - dropped * dropped
+        else:
+            self._sum[row] += value
+            self._sumsq[row] += value * value
+            self._count[row] += 1
+        window[pos] = value
+
+        pos += 1
+        if pos == self.period:
+            pos = 0
+            self._sum[row] = window.sum()
+            self._sumsq[row] = np.dot(window, window)
+        self._pos[row] = pos
+
+        if self._count[row] < self.period:
+            return row, None, None, None
+
+        mean = self._sum[row] / self.period
+        sd = np.sqrt(max(self._sumsq[row] / self.period - mean * mean, 0.0))
+        middle = mean + self._shift[row]
+        return row, middle, middle + self.std * sd, middle - self.std * sd
+
+
+class IntradayMonitor:
+    """
+    盘中布林带突破监控
+
+    收盘价从带内移到上轨之上（或下轨之下）时产生一次 BandBreak，停留在带外的后续K线不重复产生。
+
+    参数:
+    source (MinuteBarSource): 分钟K线数据源
+    symbols (list, optional): 监控的合约；None 表示数据源中的全部合约（仅回放数据源支持）
+    period (int): 布林带周期
+    std (float): 标准差倍数
+    """
+
+    def __init__(self, source: MinuteBarSource, symbols=None, period: int = 20, std: float = 2.0):
+        self.source = source
+        self.symbols = symbols
+        self.bands = RollingBands(period, std, capacity=len(symbols) if symbols else 64)
+
+    def process(self, bars, emit: bool = True) -> list:
+        """
+        按顺序处理一批K线
+
+        参数:
+        bars (list): MinuteBar 列表
+        emit (bool): 为 False 时只更新状态（用于预热）
+
+        返回:
+        list: 本批K线产生的 BandBreak
+        """
+        events = []
+        for bar in bars:
+            time = int(bar.time.astype(np.int64))
+            row, middle, upper, lower = self.bands.update(bar.symbol, time, bar.close)
+            if middle is None:
+                continue
+
+            current = 1 if bar.close > upper else -1 if bar.close < lower else 0
+            state = self.bands.state
+            if current and current != state[row] and emit:
+                events.append(BandBreak(bar.symbol, bar.time, bar.close, middle, upper, lower,
+                                        SIGNAL_LONG if current > 0 else SIGNAL_SHORT))
+            state[row] = current
+        return events
+
+    async def run(self, on_break, poll_interval: float = 60.0):
+        """
+        持续轮询数据源并处理K线，直到数据源耗尽或任务被取消
+
+        参数:
+        on_break: 协程函数，接收每个 BandBreak
+        poll_interval (float): 两次轮询之间的间隔（秒）
+        """
+        history = await asyncio.to_thread(self.source.history, self.symbols)
+        self.process(history, emit=False)
+        logger.info(f"盘中监控已预热：{len(self.bands)} 个合约，{len(history)} 根K线")
+
+        while not self.source.exhausted:
+            bars = await asyncio.to_thread(self.source.poll, self.symbols)
+            for event in self.process(bars):
+                await on_break(event)
+            if poll_interval and not self.source.exhausted:
+                await asyncio.sleep(poll_interval)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='回放分钟线文件并输出布林带突破')
+    parser.add_argument('path', help='分钟线 CSV，列为 ' + ','.join(MINUTE_COLUMNS))
+    parser.add_argument('--period', type=int, default=20)
+    parser.add_argument('--std', type=float, default=2.0)
+    args = parser.parse_args()
+
+    async def show(event):
+        print(f"{event.time} {event.symbol} {event.signal} 收盘 {event.close:g} "
+              f"上轨 {event.upper:.2f} 下轨 {event.lower:.2f}")
+
+    monitor = IntradayMonitor(FileReplaySource(args.path), period=args.period, std=args.std)
+    asyncio.run(monitor.run(show, poll_interval=0))
+    print(f"{len(monitor.bands)} 个合约，缓冲区 {monitor.bands.nbytes / 2 ** 10:.1f}KB")
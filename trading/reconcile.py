@@ -0,0 +1,200 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from trading.contracts import contract_multipliers, normalize_contract_code
+from trading.signal import SIGNAL_LONG, SIGNAL_SHORT
+
+logger = logging.getLogger(__name__)
+
+# CFMMC 持仓明细中的列名
+POSITION_CONTRACT = '合约'
+POSITION_SIDE = '买/卖'
+POSITION_LOTS = '持仓量'
+
+# 每个信号品种的目标手数（与回测一致，每次交易一手）
+TARGET_LOTS = 1
+
+KEYS = ['user_id', 'variety', 'symbol']
+
+# 对账状态
+STATUS_MATCHED = '一致'
+STATUS_ADJUST = '需调整'
+STATUS_NO_SIGNAL = '无信号'
+
+
+def _normalize_codes(codes: pd.Series, reference_year: int) -> pd.DataFrame:
+    """规范化合约代码，只对去重后的代码逐个解析"""
+    mapping = {code: normalize_contract_code(code, reference_year) for code in codes.unique()}
+    parsed = pd.DataFrame([mapping[code] for code in mapping], index=list(mapping), columns=['variety', 'symbol'])
+    return parsed.reindex(codes.to_numpy()).reset_index(drop=True)
+
+
+def normalize_positions(positions: dict, trade_date: str) -> pd.DataFrame:
+    """
+    将所有用户的 CFMMC 持仓明细合并为带符号的持仓手数
+
+    参数:
+    positions (dict): {user_id: get_user_position_data 返回的持仓明细}
+    trade_date (str): 持仓日期，格式为YYYYMMDD或YYYY-MM-DD，用于补全郑商所合约年份
+
+    返回:
+    pd.DataFrame: user_id、variety、symbol、lots 列，买为正、卖为负，每个 (用户, 合约) 一行
+    """
+    frames = []
+    for user_id, frame in positions.items():
+        if frame is None or frame.empty or POSITION_CONTRACT not in frame:
+            continue
+        part = frame[[POSITION_CONTRACT, POSITION_SIDE, POSITION_LOTS]]
+        frames.append(part.assign(user_id=user_id))
+
+    if not frames:
+        return pd.DataFrame(columns=KEYS + ['lots'])
+
+    data = pd.concat(frames, ignore_index=True)
+    codes = _normalize_codes(data[POSITION_CONTRACT].astype(str), int(str(trade_date)[:4]))
+
+    # 合计行等无法识别的代码会被丢弃
+    lots = pd.to_numeric(data[POSITION_LOTS], errors='coerce').fillna(0).to_numpy()
+    sign = np.where(data[POSITION_SIDE].astype(str).str.strip().str.startswith('卖'), -1, 1)
+    data = pd.DataFrame({
+        'user_id': data['user_id'].to_numpy(),
+        'variety': codes['variety'].to_numpy(),
+        'symbol': codes['symbol'].to_numpy(),
+        'lots': lots * sign,
+    }).dropna(subset=['symbol'])
+
+    return data.groupby(KEYS, as_index=False, sort=False)['lots'].sum()
+
+
+def target_positions(groups: dict, trade_date: str) -> pd.DataFrame:
+    """
+    根据信号生成所有用户的目标持仓
+
+    参数:
+    groups (dict): SignalService.fan_out 的返回值 {(period, std, signal_date): (用户ID列表, 信号DataFrame)}
+    trade_date (str): 用于补全郑商所合约年份
+
+    返回:
+    pd.DataFrame: user_id、variety、symbol、target_lots、signal_price 列，只包含触发信号的品种
+    """
+    reference_year = int(str(trade_date)[:4])
+    group_targets, group_users = [], []
+
+    for group_id, (user_ids, signals) in enumerate(groups.values()):
+        group_users.append(pd.DataFrame({'group': group_id, 'user_id': list(user_ids)}))
+        triggered = signals[signals['signal'].isin([SIGNAL_LONG, SIGNAL_SHORT])]
+        if triggered.empty:
+            continue
+        codes = _normalize_codes(triggered['symbol'].astype(str), reference_year)
+        group_targets.append(pd.DataFrame({
+            'group': group_id,
+            'variety': codes['variety'].to_numpy(),
+            'symbol': codes['symbol'].to_numpy(),
+            'target_lots': np.where(triggered['signal'] == SIGNAL_LONG, TARGET_LOTS, -TARGET_LOTS),
+            'signal_price': triggered['close'].to_numpy(dtype=np.float64),
+        }))
+
+    if not group_targets:
+        return pd.DataFrame(columns=KEYS + ['target_lots', 'signal_price'])
+
+    # 每组参数的目标只生成一次，再按组展开到用户
+    targets = pd.concat(group_targets, ignore_index=True)
+    users = pd.concat(group_users, ignore_index=True)
+    return users.merge(targets, on='group')[KEYS + ['target_lots', 'signal_price']]
+
+
+def latest_prices(signal_date: str, trade_date: str = None) -> pd.Series:
+    """从行情存储读取各合约截至信号日的最新收盘价，索引为规范化后的合约代码"""
+    from trading.bar_store import bar_store
+
+    bars = bar_store.as_of(signal_date, 1)
+    if bars.empty:
+        return pd.Series(dtype=np.float64)
+    codes = _normalize_codes(bars['symbol'].astype(str), int(str(trade_date or signal_date)[:4]))
+    return pd.Series(bars['close'].to_numpy(dtype=np.float64), index=codes['symbol'].to_numpy()).groupby(level=0).last()
+
+
+def reconcile(holdings: pd.DataFrame, targets: pd.DataFrame, net_assets: dict,
+              prices: pd.Series = None):
+    """
+    对比实际持仓与目标持仓（所有用户一次合并计算）
+
+    未触发信号的品种维持现有持仓；触发信号的品种以信号日主力合约为目标，同品种的其他合约目标为 0（移仓）。
+
+    参数:
+    holdings (pd.DataFrame): normalize_positions 的返回值
+    targets (pd.DataFrame): target_positions 的返回值
+    net_assets (dict): {user_id: 净资产}
+    prices (pd.Series, optional): {合约: 价格}，缺失时使用信号收盘价
+
+    返回:
+    tuple: (detail, summary)
+        detail (pd.DataFrame): 每个 (用户, 合约) 一行：持仓、目标、差额、名义价值与状态
+        summary (pd.DataFrame): 每个用户一行：名义敞口与净资产占用率
+    """
+    detail = holdings.merge(targets, on=KEYS, how='outer')
+    detail['lots'] = detail['lots'].fillna(0.0)
+
+    # 品种有信号时，未被选为目标的合约目标为 0；品种无信号时维持原持仓
+    has_signal = detail['target_lots'].notna().groupby([detail['user_id'], detail['variety']]).transform('any')
+    detail['status'] = np.where(has_signal, STATUS_ADJUST, STATUS_NO_SIGNAL)
+    detail['target_lots'] = np.where(has_signal, detail['target_lots'].fillna(0.0), detail['lots'])
+    detail['delta'] = detail['target_lots'] - detail['lots']
+    detail.loc[has_signal & (detail['delta'] == 0), 'status'] = STATUS_MATCHED
+
+    price = detail['symbol'].map(prices) if prices is not None else pd.Series(np.nan, index=detail.index)
+    detail['price'] = price.fillna(detail['signal_price'])
+    detail['multiplier'] = detail['variety'].map(contract_multipliers)
+
+    unknown = sorted(detail.loc[detail['multiplier'].isna(), 'variety'].dropna().unique())
+    if unknown:
+        logger.warning(f"以下品种缺少合约乘数，名义价值按 0 计: {', '.join(unknown)}")
+
+    unit = (detail['price'] * detail['multiplier']).fillna(0.0)
+    detail['notional'] = detail['lots'] * unit
+    detail['target_notional'] = detail['target_lots'] * unit
+    detail['delta_notional'] = detail['delta'] * unit
+
+    by_user = detail.assign(gross=detail['notional'].abs(), target_gross=detail['target_notional'].abs()) \
+        .groupby('user_id')
+    summary = pd.DataFrame({
+        'gross_notional': by_user['gross'].sum(),
+        'net_notional': by_user['notional'].sum(),
+        'target_gross_notional': by_user['target_gross'].sum(),
+        'contracts_to_adjust': by_user['delta'].agg(lambda d: int((d != 0).sum())),
+    })
+    summary['net_asset'] = summary.index.map(net_assets).astype(np.float64)
+    summary['utilization'] = summary['gross_notional'] / summary['net_asset']
+    summary['target_utilization'] = summary['target_gross_notional'] / summary['net_asset']
+
+    columns = KEYS + ['lots', 'target_lots', 'delta', 'price', 'multiplier',
+                      'notional', 'target_notional', 'delta_notional', 'status']
+    detail = detail[columns].sort_values(KEYS).reset_index(drop=True)
+    return detail, summary
+
+
+def reconcile_all(positions: dict, groups: dict, net_assets: dict, trade_date: str, signal_date: str = None):
+    """
+    夜间爬取完成后对所有用户批量对账
+
+    参数:
+    positions (dict): {user_id: 持仓明细}
+    groups (dict): SignalService.fan_out 的返回值
+    net_assets (dict): {user_id: 净资产}
+    trade_date (str): 持仓日期
+    signal_date (str, optional): 取价格的日期，默认为 trade_date
+
+    返回:
+    tuple: (detail, summary)，见 reconcile
+    """
+    trade_date = str(trade_date).replace('-', '')
+    holdings = normalize_positions(positions, trade_date)
+    targets = target_positions(groups, trade_date)
+    prices = latest_prices(signal_date or trade_date, trade_date)
+
+    detail, summary = reconcile(holdings, targets, net_assets, prices)
+    logger.info(f"持仓对账完成：{len(summary)} 个用户，{len(detail)} 个合约，"
+                f"{int((detail['delta'] != 0).sum())} 个需调整")
+    return detail, summary
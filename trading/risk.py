@@ -0,0 +1,349 @@
+"""
+组合风险
+
+所有用户的持仓合并为数组一次计算：名义敞口、保证金占用，以及基于日收益率协方差矩阵的组合波动率与 VaR。
+
+协方差矩阵按品种（主力连续合约的日收益率）以 EWMA 估计（RiskMetrics，λ = 0.94），每日收盘后只用新增
+交易日的收益率做一次 O(品种数²) 的增量更新，不重新扫描历史；模型保存在行情存储目录旁，重启后继续累积。
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from trading.contracts import DEFAULT_MARGIN_RATE, contract_multipliers, margin_rates
+
+logger = logging.getLogger(__name__)
+
+# EWMA 衰减系数（RiskMetrics 日频标准值）
+RISK_DECAY = 0.94
+# 首次建立模型时使用的历史交易日数
+RISK_LOOKBACK = 250
+# 单侧 99% 正态分位数
+VAR_Z_99 = 2.326
+
+RISK_COLUMNS = ['gross_notional', 'net_notional', 'margin', 'margin_usage', 'leverage',
+                'daily_vol', 'daily_vol_pct', 'var_99', 'diversification', 'unmodelled_notional']
+
+
+def default_model_path() -> Path:
+    """协方差模型文件，可通过环境变量 RISK_MODEL_PATH 指定，默认位于行情存储目录旁"""
+    from trading.bar_store import default_store_dir
+
+    return Path(os.getenv('RISK_MODEL_PATH') or default_store_dir().parent / 'risk_covariance.npz')
+
+
+def daily_returns(panel: dict):
+    """
+    由主力连续价格面板计算日收益率
+
+    收益率为持有前一日主力合约一天的价格变化除以前一日收盘价（换月不产生跳空），
+    前一日或当日无行情的位置为 NaN。
+
+    参数:
+    panel (dict): trading.backtest.build_main_panel 的返回值
+
+    返回:
+    tuple: (dates (T-1,), returns (T-1, N))
+    """
+    close = panel['close']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = panel['change'][1:] / close[:-1]
+    returns[np.isnan(close[1:]) | ~(close[:-1] > 0)] = np.nan
+    return panel['dates'][1:], returns
+
+
+class CovarianceModel:
+    """
+    品种日收益率的 EWMA 协方差矩阵，支持逐日增量更新与新品种加入
+
+    分别累积收益率外积与观测权重的 EWMA（两者同样衰减），协方差 = 外积 / 权重。这样冷启动与新上市品种
+    不会被初始的零值低估，某日缺失行情的品种对只跳过当天，不影响其它品种对。
+
+    参数:
+    decay (float): 衰减系数 λ，越大越平滑
+    """
+
+    def __init__(self, decay: float = RISK_DECAY):
+        self.decay = decay
+        self.varieties = []
+        self._index = {}
+        self._products = np.zeros((0, 0))
+        self._weights = np.zeros((0, 0))
+        self._cov = None
+        self.last_date = None
+        self.days = 0
+
+    def __len__(self):
+        return len(self.varieties)
+
+    def _indices(self, varieties) -> np.ndarray:
+        """品种在矩阵中的位置，新品种追加到末尾"""
+        new = [v for v in dict.fromkeys(varieties) if v not in self._index]
+        if new:
+            size = len(self.varieties) + len(new)
+            for name in ('_products', '_weights'):
+                grown = np.zeros((size, size))
+                old = getattr(self, name)
+                grown[:len(old), :len(old)] = old
+                setattr(self, name, grown)
+            for variety in new:
+                self._index[variety] = len(self.varieties)
+                self.varieties.append(variety)
+        return np.array([self._index[v] for v in varieties], dtype=np.intp)
+
+    def update(self, dates, varieties, returns):
+        """
+        按日期顺序加入收益率，已经计入的日期（不晚于 last_date）自动跳过
+
+        参数:
+        dates: (T,) 交易日，int YYYYMMDD
+        varieties: (N,) 品种
+        returns: (T, N) 日收益率，NaN 表示当天无观测
+
+        返回:
+        int: 新计入的交易日数
+        """
+        dates = np.asarray(dates)
+        returns = np.asarray(returns, dtype=np.float64).reshape(len(dates), -1)
+        if self.last_date is not None:
+            keep = dates > self.last_date
+            dates, returns = dates[keep], returns[keep]
+        if not len(dates):
+            return 0
+
+        varieties = list(varieties)
+        if returns.shape[1] != len(varieties):
+            raise ValueError(f"收益率列数 {returns.shape[1]} 与品种数 {len(varieties)} 不一致")
+        index = self._indices(varieties)
+        block = np.ix_(index, index)
+        products, weights = self._products[block], self._weights[block]
+        keep = 1.0 - self.decay
+        for row in returns:
+            observed = ~np.isnan(row)
+            value = np.where(observed, row, 0.0)
+            mask = observed.astype(np.float64)
+            # 两者都有观测的品种对才更新，其余保持不变
+            pair = np.outer(mask, mask)
+            products += pair * (keep * np.outer(value, value) - keep * products)
+            weights += pair * (keep - keep * weights)
+        self._products[block], self._weights[block] = products, weights
+
+        self._cov = None
+        self.last_date = int(dates[-1])
+        self.days += len(dates)
+        return len(dates)
+
+    @property
+    def covariance(self) -> np.ndarray:
+        """完整协方差矩阵（按 varieties 顺序），无共同观测的品种对为 0"""
+        if self._cov is None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._cov = np.where(self._weights > 0, self._products / self._weights, 0.0)
+        return self._cov
+
+    def submatrix(self, varieties):
+        """
+        指定品种的协方差子矩阵
+
+        返回:
+        tuple: (cov (K, K), known (K,) 模型中有观测的品种)
+        """
+        known = np.array([v in self._index and self._weights[self._index[v], self._index[v]] > 0
+                          for v in varieties], dtype=bool)
+        index = np.array([self._index.get(v, 0) for v in varieties], dtype=np.intp)
+        cov = self.covariance[np.ix_(index, index)] if len(index) else np.zeros((0, 0))
+        cov = np.where(known[:, None] & known[None, :], cov, 0.0)
+        return cov, known
+
+    def volatility(self, varieties) -> np.ndarray:
+        """各品种的日收益率波动率，未知品种为 NaN"""
+        cov, known = self.submatrix(varieties)
+        return np.where(known, np.sqrt(np.diag(cov)), np.nan)
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + '.tmp.npz')
+        np.savez(temporary, varieties=np.array(self.varieties, dtype=str), products=self._products,
+                 weights=self._weights, decay=self.decay, days=self.days,
+                 last_date=-1 if self.last_date is None else self.last_date)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取模型；文件不存在时返回None"""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            model = cls(float(data['decay']))
+            model.varieties = [str(v) for v in data['varieties']]
+            model._index = {v: i for i, v in enumerate(model.varieties)}
+            model._products = data['products']
+            model._weights = data['weights']
+            model.days = int(data['days'])
+            model.last_date = None if int(data['last_date']) < 0 else int(data['last_date'])
+        return model
+
+
+def portfolio_risk(user_ids, varieties, lots, prices, net_assets: dict = None,
+                   model: CovarianceModel = None, multipliers: dict = None, margins: dict = None) -> pd.DataFrame:
+    """
+    批量计算所有用户的组合风险（全部向量化，一次矩阵运算）
+
+    同一品种不同月份的合约合并为该品种的敞口（不计跨期价差风险）。组合日波动率 = sqrt(eᵀ Σ e)，
+    e 为各品种的名义敞口，Σ 为日收益率协方差；模型中没有的品种不计入波动率，其敞口单独列出。
+    有持仓但没有任何品种在模型中（包括未提供模型）时，波动率、VaR 与分散度为 NaN 而不是 0。
+
+    参数:
+    user_ids, varieties, lots, prices: 等长数组，每个 (用户, 合约) 一项；手数买为正、卖为负
+    net_assets (dict, optional): {user_id: 净资产}，用于计算占用比例
+    model (CovarianceModel, optional): 协方差模型，缺省时不计算波动率
+    multipliers (dict, optional): 合约乘数，默认 contract_multipliers
+    margins (dict, optional): 保证金比例，默认 margin_rates
+
+    返回:
+    pd.DataFrame: 以 user_id 为索引，列见 RISK_COLUMNS
+    """
+    lots = np.asarray(lots, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+
+    # 哈希分组（字符串数组上比 np.unique 的排序快一个数量级）
+    user_index, users = pd.factorize(np.asarray(user_ids), sort=True)
+    variety_index, names = pd.factorize(np.asarray(varieties, dtype=object), sort=True)
+    # 参数表按品种查一次再展开（品种数远小于持仓数）
+    multipliers = multipliers if multipliers is not None else contract_multipliers
+    margins = margins if margins is not None else margin_rates
+    name_multiplier = np.array([multipliers.get(name, np.nan) for name in names.tolist()], dtype=np.float64)
+    name_rate = np.array([margins.get(name, DEFAULT_MARGIN_RATE) for name in names.tolist()], dtype=np.float64)
+    multiplier, rate = name_multiplier[variety_index], name_rate[variety_index]
+
+    unknown = names[np.isnan(name_multiplier)].tolist()
+    if unknown:
+        logger.warning(f"以下品种缺少合约乘数，风险按 0 计: {', '.join(unknown)}")
+
+    notional = np.nan_to_num(lots * prices * multiplier)
+    count = len(users)
+    gross = np.bincount(user_index, np.abs(notional), minlength=count)
+    net = np.bincount(user_index, notional, minlength=count)
+    margin = np.bincount(user_index, np.abs(notional) * rate, minlength=count)
+
+    # 用户 × 品种 的名义敞口矩阵
+    width = len(names)
+    exposure = np.bincount(user_index * width + variety_index, notional, minlength=count * width).reshape(count, width)
+
+    if model is not None and len(model):
+        cov, known = model.submatrix(names)
+    else:
+        cov, known = np.zeros((width, width)), np.zeros(width, dtype=bool)
+    variance = np.einsum('uk,uk->u', exposure @ cov, exposure)
+    daily_vol = np.sqrt(np.maximum(variance, 0.0))
+    standalone = np.abs(exposure) @ np.sqrt(np.maximum(np.diag(cov), 0.0))
+    unmodelled = np.abs(exposure[:, ~known]).sum(axis=1)
+    # 全部敞口都不在模型中：波动率未知，不能报告为零风险
+    daily_vol[(unmodelled > 0) & ~(np.abs(exposure[:, known]) > 0).any(axis=1)] = np.nan
+
+    assets = pd.Series(net_assets or {}, dtype=np.float64).reindex(users).to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = pd.DataFrame({
+            'gross_notional': gross,
+            'net_notional': net,
+            'margin': margin,
+            'margin_usage': margin / assets,
+            'leverage': gross / assets,
+            'daily_vol': daily_vol,
+            'daily_vol_pct': daily_vol / assets,
+            'var_99': VAR_Z_99 * daily_vol,
+            # 组合波动率与各品种单独波动率之和的比值，越小分散效果越好
+            'diversification': np.where(standalone > 0, daily_vol / standalone, np.nan),
+            'unmodelled_notional': unmodelled,
+        }, index=pd.Index(users, name='user_id'))
+    return result
+
+
+class RiskService:
+    """
+    风险服务 - 维护协方差模型并批量评估所有用户的持仓
+
+    参数:
+    path: 模型文件路径，默认 default_model_path()
+    lookback (int): 首次建立模型时使用的历史交易日数
+    decay (float): EWMA 衰减系数
+    """
+
+    def __init__(self, path=None, lookback: int = RISK_LOOKBACK, decay: float = RISK_DECAY):
+        self._path = Path(path) if path else None
+        self.lookback = lookback
+        self.decay = decay
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path or default_model_path()
+
+    @property
+    def model(self) -> CovarianceModel:
+        if self._model is None:
+            self._model = CovarianceModel.load(self.path) or CovarianceModel(self.decay)
+        return self._model
+
+    def refresh(self, end_date: str) -> int:
+        """
+        用行情存储中截至 end_date 的新交易日更新协方差（模型为空时读取 lookback 个交易日建立）
+
+        返回:
+        int: 新计入的交易日数
+        """
+        from trading.backtest import build_main_panel
+        from trading.bar_store import bar_store
+        from trading.signal import history_start
+
+        end_date = str(end_date).replace('-', '')
+        with self._lock:
+            model = self.model
+            if model.last_date is not None and model.last_date >= int(end_date):
+                return 0
+            # 从上次计入的交易日开始读取，作为第一个新交易日收益率的前收
+            start = str(model.last_date) if model.last_date is not None else history_start(end_date, self.lookback + 1)
+            data = bar_store.load_frame(start, end_date)
+            if data.empty:
+                return 0
+
+            panel = build_main_panel(data)
+            dates, returns = daily_returns(panel)
+            added = model.update(dates.astype(np.int64), panel['varieties'].tolist(), returns)
+            if added:
+                model.save(self.path)
+                logger.info(f"协方差模型更新 {added} 个交易日，共 {len(model)} 个品种，截至 {model.last_date}")
+            return added
+
+    def assess(self, holdings: pd.DataFrame, net_assets: dict, as_of: str = None) -> pd.DataFrame:
+        """
+        评估持仓风险
+
+        参数:
+        holdings (pd.DataFrame): 包含 user_id、variety、lots、price 列（如 reconcile 的 detail）
+        net_assets (dict): {user_id: 净资产}
+        as_of (str, optional): 先将协方差更新到该日期
+
+        返回:
+        pd.DataFrame: 见 portfolio_risk
+        """
+        if as_of:
+            try:
+                self.refresh(as_of)
+            except Exception as e:
+                logger.warning(f"协方差模型更新失败，使用已有模型: {e}")
+        held = holdings[holdings['lots'] != 0].dropna(subset=['variety'])
+        with self._lock:
+            return portfolio_risk(held['user_id'].to_numpy(), held['variety'].to_numpy(), held['lots'].to_numpy(),
+                                  held['price'].to_numpy(), net_assets, self.model)
+
+
+# 全局风险服务实例
+risk_service = RiskService()
@@ -0,0 +1,190 @@
+"""
+日线行情的规范化数据结构
+
+fetch_raw_data 与 BarStore.load_frame 输出的 DataFrame 均符合以下结构：
+
+    列名            类型                  说明
+    symbol          category             合约代码
+    date            int32                交易日 YYYYMMDD
+    open            float32 / float64    开盘价
+    high            float32 / float64    最高价
+    low             float32 / float64    最低价
+    close           float32 / float64    收盘价
+    volume          Int32 / Int64        成交量（可空整数）
+    open_interest   Int32 / Int64        持仓量（可空整数）
+    turnover        float64              成交额
+    settle          float32 / float64    结算价
+    pre_settle      float32 / float64    昨结算价
+    variety         category             品种代码
+    exchange        category             交易所
+
+价格列在 float32 往返误差不超过最小跳动价位（0.002）的四分之一时使用 float32，否则保留 float64；
+成交量与持仓量在取值范围允许时使用 Int32。
+"""
+import numpy as np
+import pandas as pd
+
+from trading.contracts import exchanges
+
+CATEGORY_COLUMNS = ['symbol', 'variety', 'exchange']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'settle', 'pre_settle']
+COUNT_COLUMNS = ['volume', 'open_interest']
+FLOAT64_COLUMNS = ['turnover']
+BAR_COLUMNS = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume', 'open_interest',
+               'turnover', 'settle', 'pre_settle', 'variety', 'exchange']
+
+# float32 往返误差上限：最小跳动价位 0.002 的四分之一
+FLOAT32_TOLERANCE = 5e-4
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def date_key(value) -> int:
+    """将 YYYYMMDD 字符串、整数或日期对象转换为整数日期键"""
+    if hasattr(value, 'strftime'):
+        return int(value.strftime('%Y%m%d'))
+    return int(str(value).replace('-', ''))
+
+
+def _date_column(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_integer_dtype(values):
+        return values.to_numpy(dtype=np.int32)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime('%Y%m%d').astype(np.int32).to_numpy()
+    return values.astype(str).str.replace('-', '', regex=False).astype(np.int32).to_numpy()
+
+
+def price_dtype(values: np.ndarray):
+    """价格列可安全使用 float32 时返回 float32，否则返回 float64"""
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return np.float32
+    error = np.abs(finite.astype(np.float32).astype(np.float64) - finite).max()
+    return np.float32 if error <= FLOAT32_TOLERANCE else np.float64
+
+
+def _count_column(values: pd.Series) -> pd.arrays.IntegerArray:
+    numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    mask = np.isnan(numbers)
+    filled = np.where(mask, 0, np.round(numbers))
+    dtype = np.int32 if len(filled) == 0 or np.abs(filled).max() <= INT32_MAX else np.int64
+    return pd.arrays.IntegerArray(filled.astype(dtype), mask)
+
+
+def _category_column(values: pd.Series) -> pd.Categorical:
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.array
+    return pd.Categorical(values.astype(str).to_numpy())
+
+
+def normalize_bars(data: pd.DataFrame, exchange: str = None) -> pd.DataFrame:
+    """
+    将行情数据转换为规范化结构（见模块说明），已规范化的列不会重复转换
+
+    参数:
+    data (pd.DataFrame): akshare 返回或从存储读取的日线数据
+    exchange (str, optional): 数据所属交易所，data 中没有 exchange 列时使用
+
+    返回:
+    pd.DataFrame: 规范化后的数据
+    """
+    length = len(data)
+    columns = {
+        'symbol': _category_column(data['symbol']),
+        'date': _date_column(data['date']),
+    }
+
+    for column in PRICE_COLUMNS:
+        if column not in data:
+            continue
+        values = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        columns[column] = values.astype(price_dtype(values), copy=False)
+
+    for column in COUNT_COLUMNS:
+        if column in data:
+            columns[column] = _count_column(data[column])
+
+    for column in FLOAT64_COLUMNS:
+        if column in data:
+            columns[column] = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=np.float64)
+
+    columns['variety'] = _category_column(data['variety'])
+    if 'exchange' in data:
+        columns['exchange'] = _category_column(data['exchange'])
+    else:
+        columns['exchange'] = pd.Categorical.from_codes(
+            np.full(length, exchanges.index(exchange), dtype=np.int8), categories=exchanges)
+
+    ordered = [column for column in BAR_COLUMNS if column in columns]
+    return pd.DataFrame({column: columns[column] for column in ordered}, copy=False)
+
+
+def _concat_categorical(pieces, total: int) -> pd.Categorical:
+    """按并集类别拼接分类列，直接写入预分配的编码数组"""
+    categories = pd.Index(sorted(set().union(*(piece.categories for piece in pieces))))
+    code_dtype = np.int16 if len(categories) < np.iinfo(np.int16).max else np.int32
+    codes = np.empty(total, dtype=code_dtype)
+
+    offset = 0
+    for piece in pieces:
+        mapping = categories.get_indexer(piece.categories)
+        piece_codes = piece.codes
+        codes[offset:offset + len(piece)] = np.where(piece_codes < 0, -1, mapping[piece_codes])
+        offset += len(piece)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def concat_bars(frames) -> pd.DataFrame:
+    """
+    拼接多个已规范化的行情数据
+
+    每列只分配一次目标数组并按偏移写入，避免 pd.concat 的中间拷贝与分类列退化为 object。
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    if len(frames) == 1:
+        return frames[0]
+
+    total = sum(len(frame) for frame in frames)
+    columns = {}
+    for column in frames[0].columns:
+        pieces = [frame[column].array for frame in frames]
+
+        if column in CATEGORY_COLUMNS:
+            columns[column] = _concat_categorical(pieces, total)
+            continue
+
+        if column in COUNT_COLUMNS:
+            dtype = np.result_type(*(piece.dtype.numpy_dtype for piece in pieces))
+            values = np.empty(total, dtype=dtype)
+            mask = np.empty(total, dtype=bool)
+            offset = 0
+            for piece in pieces:
+                values[offset:offset + len(piece)] = piece._data
+                mask[offset:offset + len(piece)] = piece._mask
+                offset += len(piece)
+            columns[column] = pd.arrays.IntegerArray(values, mask)
+            continue
+
+        pieces = [frame[column].to_numpy() for frame in frames]
+        dtype = np.result_type(*(piece.dtype for piece in pieces))
+        values = np.empty(total, dtype=dtype)
+        offset = 0
+        for piece in pieces:
+            values[offset:offset + len(piece)] = piece
+            offset += len(piece)
+        columns[column] = values
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> dict:
+    """对比规范化前后的内存占用"""
+    before_bytes = int(before.memory_usage(deep=True).sum())
+    after_bytes = int(after.memory_usage(deep=True).sum())
+    return {
+        'rows': len(after),
+        'before_bytes': before_bytes,
+        'after_bytes': after_bytes,
+        'reduction': 1 - after_bytes / before_bytes if before_bytes else 0.0,
+    }
@@ -1,7 +1,251 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
+import numpy as np
+import pandas as pd
 
+from trading.schema import date_key
 
+logger = logging.getLogger(__name__)
 
+# 信号类型
+SIGNAL_LONG = "突破上轨"
+SIGNAL_SHORT = "跌破下轨"
 
+SIGNAL_COLUMNS = ['variety', 'symbol', 'close', 'middle', 'upper', 'lower', 'signal']
 
 
+def pick_main_rows(frame: pd.DataFrame, keys) -> pd.DataFrame:
+    """
+    每组（如 ['date', 'variety']）取持仓量最大的一行
+
+    持仓量缺失（NA）的合约排在最前，只有整组都缺失持仓量时才会被选中。
+    按持仓量排序后去重，比 groupby().idxmax() 的逐组调用快两个数量级。
+    """
+    return (frame.sort_values('open_interest', kind='stable', na_position='first')
+            .drop_duplicates(keys, keep='last'))
+
+
+def select_main_contracts(data: pd.DataFrame, signal_date: str) -> pd.DataFrame:
+    """
+    选出每个品种在信号日的主力合约（持仓量最大的合约）
+
+    参数:
+    data (pd.DataFrame): fetch_raw_data 返回的日线数据
+    signal_date (str): 信号日期，格式为YYYYMMDD
+
+    返回:
+    pd.DataFrame: 每个品种一行，包含 variety、symbol 列
+    """
+    day = data[data['date'] == date_key(signal_date)]
+    if day.empty:
+        return pd.DataFrame(columns=['variety', 'symbol'])
+
+    main = pick_main_rows(day, 'variety')
+    return main[['variety', 'symbol']].sort_values('variety').reset_index(drop=True)
+
+
+def compute_bollinger_signals(data: pd.DataFrame, period: int, std: float,
+                              signal_date: str) -> pd.DataFrame:
+    """
+    计算信号日各品种主力合约的布林带信号
+
+    参数:
+    data (pd.DataFrame): 包含信号日及之前至少 period 个交易日的日线数据
+    period (int): 布林带周期
+    std (float): 布林带标准差倍数
+    signal_date (str): 信号日期，格式为YYYYMMDD
+
+    返回:
+    pd.DataFrame: 每个品种一行，包含 variety、symbol、close、middle、upper、lower、signal 列；
+                  历史数据不足 period 根的品种不输出
+    """
+    if data.empty:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+    main = select_main_contracts(data, signal_date)
+    if main.empty:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+    history = data.loc[data['symbol'].isin(main['symbol']) & (data['date'] <= date_key(signal_date)),
+                       ['symbol', 'date', 'close']]
+    history = history.assign(close=history['close'].astype(np.float64))
+    window = history.sort_values('date').groupby('symbol', observed=True).tail(period)
+
+    grouped = window.groupby('symbol', observed=True)['close']
+    stats = pd.DataFrame({
+        'close': grouped.last(),
+        'middle': grouped.mean(),
+        'sd': grouped.std(ddof=0),
+        'bars': grouped.size(),
+    })
+    stats = stats[stats['bars'] >= period]
+
+    result = main.merge(stats, left_on='symbol', right_index=True)
+    result['upper'] = result['middle'] + std * result['sd']
+    result['lower'] = result['middle'] - std * result['sd']
+    result['signal'] = None
+    result.loc[result['close'] > result['upper'], 'signal'] = SIGNAL_LONG
+    result.loc[result['close'] < result['lower'], 'signal'] = SIGNAL_SHORT
+
+    return result[SIGNAL_COLUMNS].sort_values('variety').reset_index(drop=True)
+
+
+def history_start(signal_date: str, bars: int) -> str:
+    """信号日及之前第 bars 个交易日（按交易日历计算）"""
+    from trading.trade_calendar import trading_calendar
+
+    end = datetime.strptime(signal_date, '%Y%m%d')
+    sessions = trading_calendar.sessions(end - timedelta(days=bars * 7 // 5 + 30), signal_date)
+    return str(sessions[max(len(sessions) - bars, 0)]) if len(sessions) else signal_date
+
+
+def history_windows(signal_dates, bars: int) -> list:
+    """
+    各信号日所需的行情区间 [history_start, signal_date]，重叠的区间合并
+
+    不重叠的区间分开保留，个别很早的信号日不会使中间的全部交易日都被获取。
+
+    返回:
+    list: 按起始日排序的 (start_date, end_date)
+    """
+    windows = []
+    for start, end in sorted((history_start(day, bars), day) for day in set(signal_dates)):
+        if windows and int(start) <= int(windows[-1][1]):
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def prefetch_history(signal_dates, bars: int) -> list:
+    """为多个信号日补齐所需的行情缓存，每个（合并后的）区间取数一次，返回各区间的 FetchReport"""
+    from trading.data_fetcher import ensure_bars
+
+    return [ensure_bars(start, end) for start, end in history_windows(signal_dates, bars)]
+
+
+def load_history_bars(signal_date: str, bars: int) -> pd.DataFrame:
+    """
+    获取各合约截至信号日的最后 bars 根日线
+
+    未缓存的交易日先从接口获取并写入存储，然后从存储按截止日期二分查找读取，
+    不同信号日的查询共用同一份内存映射数据。只返回在起始交易日之后仍有行情的合约。
+    """
+    from trading.bar_store import bar_store
+    from trading.data_fetcher import ensure_bars
+
+    start_date = history_start(signal_date, bars)
+    report = ensure_bars(start_date, signal_date)
+
+    data = bar_store.as_of(signal_date, bars, since=start_date)
+    data.attrs['fetch_report'] = report
+    return data
+
+
+class SignalService:
+    """
+    信号服务 - 按参数分组计算信号，结果按参数缓存
+
+    多数用户共用默认参数 (19, 2)，因此按 (period, std, signal_date) 分组后每组只计算一次，
+    并以 (period, std, signal_date, data_version) 为键做 LRU 缓存。计算量只随不同参数组数增长，
+    与用户数量无关。
+    """
+
+    def __init__(self, bar_loader=None, cache_size: int = 128):
+        self._bar_loader = bar_loader or load_history_bars
+        # 使用默认行情来源时，多个信号日的缺失数据先一次性获取
+        self._prefetch = prefetch_history if bar_loader is None else None
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self.data_version = 0
+
+    def invalidate(self):
+        """行情数据更新后调用，使已缓存的信号全部失效"""
+        with self._lock:
+            self.data_version += 1
+            self._cache.clear()
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _cache_put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def get_signals(self, period: int, std: float, signal_date: str) -> pd.DataFrame:
+        """获取单组参数的信号（优先使用缓存）"""
+        return self.compute_groups([(period, std, signal_date)])[(period, std, signal_date)]
+
+    def compute_groups(self, param_sets) -> dict:
+        """
+        计算多组参数的信号
+
+        所有信号日缺失的行情先一次补齐，之后每个信号日按截止日期查询一次（按最大周期取数），
+        未命中缓存的参数组各计算一次。
+
+        参数:
+        param_sets: 可迭代的 (period, std, signal_date)
+
+        返回:
+        dict: {(period, std, signal_date): pd.DataFrame}
+        """
+        results = {}
+        missing_by_date = {}
+
+        for params in set(param_sets):
+            cached = self._cache_get(params + (self.data_version,))
+            if cached is not None:
+                results[params] = cached
+            else:
+                missing_by_date.setdefault(params[2], []).append(params)
+
+        if self._prefetch is not None and missing_by_date:
+            self._prefetch(missing_by_date.keys(),
+                           max(period for params_list in missing_by_date.values() for period, _, _ in params_list))
+
+        for signal_date, params_list in missing_by_date.items():
+            version = self.data_version
+            max_period = max(period for period, _, _ in params_list)
+            data = self._bar_loader(signal_date, max_period)
+            # 行情不完整时结果不缓存，下次请求重新取数
+            report = data.attrs.get('fetch_report')
+            complete = report is None or report.complete
+
+            for period, std, _ in params_list:
+                params = (period, std, signal_date)
+                signals = compute_bollinger_signals(data, period, std, signal_date)
+                if complete:
+                    self._cache_put(params + (version,), signals)
+                results[params] = signals
+
+            logger.info(f"信号日 {signal_date} 计算了 {len(params_list)} 组参数")
+
+        return results
+
+    def fan_out(self, user_params: dict) -> dict:
+        """
+        按参数分组计算信号并分发给用户
+
+        参数:
+        user_params (dict): {user_id: (period, std, signal_date)}
+
+        返回:
+        dict: {(period, std, signal_date): (用户ID列表, 信号DataFrame)}
+        """
+        groups = {}
+        for user_id, params in user_params.items():
+            groups.setdefault(tuple(params), []).append(user_id)
+
+        signals = self.compute_groups(groups.keys())
+        return {params: (user_ids, signals[params]) for params, user_ids in groups.items()}
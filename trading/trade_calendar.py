@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 收盘后多久认为当日日线已可获取
+DAILY_DATA_READY_HOUR = 17
+
+
+def parse_date(text: str, name: str = '日期') -> date:
+    """
+    校验并解析 YYYYMMDD 格式的日期
+
+    异常:
+    ValueError: 格式不正确或日期无效时抛出
+    """
+    if not isinstance(text, str) or not re.fullmatch(r'\d{8}', text):
+        raise ValueError(f"{name}格式错误，应为YYYYMMDD格式的八位数字，当前输入: {text}")
+    try:
+        return datetime.strptime(text, '%Y%m%d').date()
+    except ValueError as e:
+        raise ValueError(f"日期无效: {e}")
+
+
+def _to_int(value) -> int:
+    if isinstance(value, (date, datetime)):
+        return int(value.strftime('%Y%m%d'))
+    return int(str(value).replace('-', ''))
+
+
+def default_calendar_path() -> Path:
+    """交易日历缓存文件，可通过环境变量 TRADE_CALENDAR_PATH 指定"""
+    return Path(os.getenv('TRADE_CALENDAR_PATH',
+                          Path(__file__).resolve().parent.parent / 'data' / 'trade_calendar.json'))
+
+
+class TradingCalendar:
+    """
+    国内期货交易所交易日历（各交易所节假日安排一致）
+
+    优先读取本地缓存；没有缓存时使用 akshare 随包附带的日历。查询超出日历范围的日期时
+    尝试从新浪刷新一次，仍未覆盖的部分按工作日估计，并视为非最终结果。
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache_path = Path(cache_path) if cache_path is not None else default_calendar_path()
+        self._dates = None
+        self._lock = threading.Lock()
+        self._refresh_attempted = None
+
+    # ========== 加载与刷新 ==========
+
+    def _load(self) -> np.ndarray:
+        if self._dates is not None:
+            return self._dates
+
+        with self._lock:
+            if self._dates is None:
+                dates = None
+                if self.cache_path.exists():
+                    try:
+                        with open(self.cache_path, encoding='utf-8') as f:
+                            dates = json.load(f)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"读取交易日历缓存失败，改用内置日历: {e}")
+
+                if dates is None:
+                    from akshare.futures import cons
+                    dates = cons.get_calendar()
+
+                self._dates = np.unique(np.asarray([_to_int(d) for d in dates], dtype=np.int32))
+        return self._dates
+
+    def refresh(self) -> bool:
+        """从新浪获取最新交易日历并写入缓存，成功返回 True"""
+        try:
+            import akshare as ak
+            trade_dates = ak.tool_trade_date_hist_sina()['trade_date']
+            fetched = np.asarray([_to_int(d) for d in trade_dates], dtype=np.int32)
+        except Exception as e:
+            logger.warning(f"刷新交易日历失败: {e}")
+            return False
+
+        dates = np.union1d(self._load(), fetched).astype(np.int32)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump([str(d) for d in dates], f)
+
+        with self._lock:
+            self._dates = dates
+        logger.info(f"交易日历已更新至 {dates[-1]}")
+        return True
+
+    def _ensure_covers(self, end: int):
+        """查询日期超出日历范围时每天最多尝试刷新一次"""
+        if end <= self.last_known_date:
+            return
+        today = date.today()
+        if self._refresh_attempted != today:
+            self._refresh_attempted = today
+            self.refresh()
+
+    # ========== 查询 ==========
+
+    @property
+    def last_known_date(self) -> int:
+        """日历覆盖的最后一天"""
+        return int(self._load()[-1])
+
+    def is_final(self, day) -> bool:
+        """该日期是否在日历覆盖范围内（否则是否交易日只是按工作日估计）"""
+        return _to_int(day) <= self.last_known_date
+
+    def sessions(self, start_date, end_date) -> np.ndarray:
+        """
+        区间内的交易日
+
+        参数:
+        start_date: 开始日期（YYYYMMDD 字符串、整数或日期对象）
+        end_date: 结束日期
+
+        返回:
+        np.ndarray: int32 YYYYMMDD 交易日数组，已排序
+        """
+        start, end = _to_int(start_date), _to_int(end_date)
+        self._ensure_covers(end)
+
+        dates = self._load()
+        known = dates[np.searchsorted(dates, start, side='left'):np.searchsorted(dates, end, side='right')]
+
+        last_known = int(dates[-1])
+        if end <= last_known:
+            return known
+
+        # 超出日历范围的部分按工作日估计
+        first = max(datetime.strptime(str(start), '%Y%m%d').date(),
+                    datetime.strptime(str(last_known), '%Y%m%d').date() + timedelta(days=1))
+        last = datetime.strptime(str(end), '%Y%m%d').date()
+        days = (first + timedelta(days=i) for i in range((last - first).days + 1))
+        estimated = [_to_int(day) for day in days if day.weekday() < 5]
+        return np.concatenate([known, np.asarray(estimated, dtype=np.int32)])
+
+    def is_session(self, day) -> bool:
+        """是否为交易日"""
+        key = _to_int(day)
+        return len(self.sessions(key, key)) == 1
+
+    def latest_settled_session(self, now: datetime = None) -> int:
+        """日线数据已可获取的最近交易日（当日收盘数据在 17 点后视为可用）"""
+        now = now or datetime.now()
+        today = now.date()
+        end = today if now.hour >= DAILY_DATA_READY_HOUR else today - timedelta(days=1)
+        recent = self.sessions(end - timedelta(days=30), end)
+        return int(recent[-1]) if len(recent) else _to_int(end)
+
+
+# 创建全局交易日历实例（首次查询时加载）
+trading_calendar = TradingCalendar()